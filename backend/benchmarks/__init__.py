@@ -0,0 +1,5 @@
+"""
+benchmarks for the songs api
+
+run from backend/, e.g. `python -m benchmarks.cache_render`
+"""
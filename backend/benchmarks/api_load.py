@@ -0,0 +1,368 @@
+"""
+- reproducible load run of SongViewSet against a synthetic catalog (music.seeding, the
+  generator behind manage.py seed_songs)
+- an in-process client (DRF's APIClient, the full middleware/view stack, no network)
+  plays a weighted iPod traffic mix:
+  - browse:  first page of the library, then following its next cursors like a scroll wheel
+  - filter:  genre / decade / year range / artist pages
+  - detail:  song details, skewed so a small set of songs takes most of the traffic
+  - search:  ?q= with catalog words, artist names and the odd typo
+  - write:   admin creates and partial updates (these invalidate the list caches)
+- reports req/s and latency percentiles overall and per endpoint, sql queries per request
+  and list/detail cache hit ratios; --seed makes the request sequence identical run to run
+- --save-baseline stores the result under benchmarks/baselines/, --baseline compares a run
+  against one and --max-regression turns it into a pass/fail check; query counts don't
+  depend on the machine, latencies do, so keep baselines per machine
+- runs on the configured database and cache, or on a dedicated sqlite file (--sqlite) and
+  an in-memory redis stand-in (--cache fakeredis, needs `pip install fakeredis`)
+- usage: python -m benchmarks.api_load [--songs 10000] [--requests 5000] [--warmup 500]
+  [--mix browse=35,filter=20,detail=30,search=10,write=5] [--seed 1]
+  [--sqlite /tmp/ipodify-bench.sqlite3] [--cache configured|locmem|fakeredis]
+  [--save-baseline NAME] [--baseline NAME|PATH] [--max-regression 20] [--json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from pathlib import Path
+from urllib.parse import urlencode
+
+BASELINE_DIR = Path(__file__).resolve().parent / 'baselines'
+DEFAULT_MIX = 'browse=35,filter=20,detail=30,search=10,write=5'
+PAGE_SIZE = 20
+# pages a browse session scrolls through before starting over at the top
+MAX_BROWSE_DEPTH = 10
+# detail ids are drawn as ids[int(len(ids) * random() ** DETAIL_SKEW)]: ~30% of lookups
+# land on the first 1% of songs
+DETAIL_SKEW = 4
+
+
+def configure(args):
+    """settings overrides, applied before django.setup()"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ipodify.settings')
+    from django.conf import settings
+
+    if args.sqlite:
+        settings.DATABASES['default'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': args.sqlite}
+    if args.cache == 'locmem':
+        settings.CACHES['default'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    elif args.cache == 'fakeredis':
+        import fakeredis
+        import fakeredis.aioredis
+
+        server = fakeredis.FakeServer()
+        options = settings.CACHES['default'].setdefault('OPTIONS', {})
+        options['CONNECTION_POOL_KWARGS'] = {'connection_class': fakeredis.FakeConnection, 'server': server}
+        options['ASYNC_CONNECTION_POOL_KWARGS'] = {
+            'connection_class': fakeredis.aioredis.FakeAsyncRedisConnection, 'server': server,
+        }
+    # one client hammering the api would trip the per-user throttles within seconds
+    settings.REST_FRAMEWORK = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_CLASSES': []}
+    settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+
+
+def parse_mix(value):
+    """'browse=35,detail=30' -> {'browse': 35, 'detail': 30}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in TRAFFIC:
+            raise argparse.ArgumentTypeError(f'unknown traffic type {name!r}, expected one of {sorted(TRAFFIC)}')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+class Traffic:
+    """request generator for one run; every random choice comes from one seeded Random"""
+
+    def __init__(self, rng, song_ids):
+        from music.seeding import ARTIST_COUNT, TITLE_NOUNS, TITLE_WORDS, artist_name
+        from music.types import Decade, Genre
+
+        self.rng = rng
+        self.song_ids = song_ids
+        self.genres = list(Genre.values)
+        self.decades = list(Decade.values)
+        self.words = [word.lower() for word in TITLE_WORDS + TITLE_NOUNS]
+        self.artists = [artist_name(index) for index in range(ARTIST_COUNT)]
+        self.next_page = None
+        self.depth = 0
+        self.writes = 0
+        # written titles/urls must not collide with an earlier run's against the same database
+        self.run_id = f'{time.time_ns():x}'
+
+    def browse(self):
+        if self.next_page is None or self.depth >= MAX_BROWSE_DEPTH:
+            self.depth = 0
+            return 'browse', 'get', f'/api/songs/?page_size={PAGE_SIZE}', None
+        self.depth += 1
+        return 'browse', 'get', self.next_page, None
+
+    def filter(self):
+        rng = self.rng
+        params = rng.choice((
+            lambda: {'genre': rng.choice(self.genres)},
+            lambda: {'decade': rng.choice(self.decades)},
+            lambda: {'genre': rng.choice(self.genres), 'decade': rng.choice(self.decades)},
+            lambda: {'year_min': (start := rng.randrange(1965, 2020)), 'year_max': start + rng.randrange(1, 6)},
+            lambda: {'artist': rng.choice(self.artists)},
+        ))()
+        return 'filter', 'get', f'/api/songs/?{urlencode({**params, "page_size": PAGE_SIZE})}', None
+
+    def detail_id(self):
+        return self.song_ids[int(len(self.song_ids) * self.rng.random() ** DETAIL_SKEW)]
+
+    def detail(self):
+        return 'detail', 'get', f'/api/songs/{self.detail_id()}/', None
+
+    def search(self):
+        rng = self.rng
+        query = rng.choice((
+            lambda: rng.choice(self.words),
+            lambda: f'{rng.choice(self.words)} {rng.choice(self.words)}',
+            lambda: rng.choice(self.artists),
+            # a dropped letter, the search is typo tolerant
+            lambda: (word := rng.choice(self.words))[:-2] + word[-1],
+        ))()
+        return 'search', 'get', f'/api/songs/?{urlencode({"q": query})}', None
+
+    def write(self):
+        self.writes += 1
+        if self.rng.random() < 0.5:
+            year = self.rng.randrange(1970, 2025)
+            return 'write', 'post', '/api/songs/', {
+                'title': f'Benchmark Write {self.run_id}-{self.writes}',
+                'artist': 'Benchmark Writer',
+                'album': 'Benchmark Writes',
+                'year': year,
+                'duration': self.rng.randrange(120, 420),
+                'spotify_url': f'https://open.spotify.com/track/bench{self.run_id}{self.writes}',
+                'genre': self.rng.choice(self.genres),
+            }
+        return 'write', 'patch', f'/api/songs/{self.detail_id()}/', {'duration': self.rng.randrange(120, 420)}
+
+    def saw_response(self, kind, body):
+        """follow the browse cursor"""
+        if kind == 'browse':
+            pagination = body.get('pagination') or {}
+            self.next_page = pagination.get('next')
+
+
+TRAFFIC = {name: getattr(Traffic, name) for name in ('browse', 'filter', 'detail', 'search', 'write')}
+
+
+def run(args):
+    import django
+
+    configure(args)
+    django.setup()
+
+    from django.contrib.auth import get_user_model
+    from django.core.cache import cache
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.test import APIClient
+
+    from music.caching import get_cache_stats
+    from music.local_cache import song_details
+    from music.models import Song
+    from music.seeding import seed_songs
+
+    log = (lambda message: print(message, file=sys.stderr)) if args.json else print
+    if args.sqlite:
+        call_command('migrate', verbosity=0)
+    missing = args.songs - Song.objects.count()
+    if missing > 0:
+        log(f'seeding {missing} songs')
+        seed_songs(missing, seed=args.seed)
+    song_ids = list(Song.objects.order_by('created_at', 'id').values_list('id', flat=True)[:args.songs])
+
+    admin, _ = get_user_model().objects.get_or_create(
+        username='benchmark-admin', defaults={'is_staff': True, 'is_superuser': True}
+    )
+    client = APIClient()
+    client.force_authenticate(user=admin)
+
+    rng = random.Random(args.seed)
+    traffic = Traffic(rng, song_ids)
+    kinds, weights = zip(*args.mix.items())
+
+    def one_request(record):
+        kind = rng.choices(kinds, weights)[0]
+        kind, method, path, payload = TRAFFIC[kind](traffic)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, method)(path, payload, format='json') if payload else client.get(path)
+            elapsed = time.perf_counter() - started
+        body = json.loads(response.content) if response.content else {}
+        traffic.saw_response(kind, body)
+        if record:
+            endpoint = results.setdefault(kind, {'latencies': [], 'queries': 0, 'errors': 0})
+            endpoint['latencies'].append(elapsed)
+            endpoint['queries'] += len(queries)
+            endpoint['errors'] += response.status_code >= 400
+
+    results = {}
+    if args.cold:
+        cache.clear()
+        song_details.clear()
+    for _ in range(args.warmup):
+        one_request(record=False)
+
+    stats_before, local_before = get_cache_stats(), song_details.stats()
+    started = time.perf_counter()
+    for _ in range(args.requests):
+        one_request(record=True)
+    elapsed = time.perf_counter() - started
+    stats_after, local_after = get_cache_stats(), song_details.stats()
+
+    def ratio(hits, misses):
+        return round(hits / (hits + misses), 4) if hits + misses else None
+
+    def delta(name):
+        return stats_after[name] - stats_before[name]
+
+    def summarize(latencies, queries, errors):
+        latencies = sorted(latencies)
+        return {
+            'requests': len(latencies),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'queries_per_request': round(queries / len(latencies), 3),
+            'errors': errors,
+        }
+
+    endpoints = {kind: summarize(**data) for kind, data in sorted(results.items())}
+    overall = summarize(
+        [latency for data in results.values() for latency in data['latencies']],
+        sum(data['queries'] for data in results.values()),
+        sum(data['errors'] for data in results.values()),
+    )
+    overall['rps'] = round(args.requests / elapsed, 1)
+    local_hits = local_after['hits'] - local_before['hits']
+    local_misses = local_after['misses'] - local_before['misses']
+    return {
+        'meta': {
+            'songs': args.songs,
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'seed': args.seed,
+            'mix': args.mix,
+            'database': connection.vendor,
+            'cache': args.cache,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+        },
+        'overall': overall,
+        'endpoints': endpoints,
+        'cache': {
+            'list_hit_ratio': ratio(delta('list_hits'), delta('list_misses')),
+            'list_stale': delta('list_stale'),
+            'detail_hit_ratio': ratio(delta('detail_hits'), delta('detail_misses')),
+            'detail_local_hit_ratio': ratio(local_hits, local_misses),
+        },
+    }
+
+
+def baseline_path(name):
+    path = Path(name)
+    return path if path.suffix == '.json' else BASELINE_DIR / f'{name}.json'
+
+
+def compare(result, baseline, max_regression):
+    """
+    - print this run against a baseline, returns the list of regressions over the threshold
+    - latencies and req/s regress by more than max_regression percent, query counts by any increase
+    """
+    regressions = []
+
+    def check(label, current, previous, higher_is_worse=True, threshold=max_regression):
+        if current is None or not previous:
+            return
+        change = (current - previous) / previous * 100
+        worse = change if higher_is_worse else -change
+        flag = ''
+        if threshold is not None and worse > threshold:
+            flag = '  << regression'
+            regressions.append(label)
+        print(f'{label:<34}{previous:>12}{current:>12}{change:>+9.1f}%{flag}')
+
+    print(f"\n{'vs baseline':<34}{'baseline':>12}{'current':>12}{'change':>10}")
+    check('overall req/s', result['overall']['rps'], baseline['overall']['rps'], higher_is_worse=False)
+    for kind, current in result['endpoints'].items():
+        previous = baseline['endpoints'].get(kind)
+        if previous is None:
+            continue
+        check(f'{kind} p50 ms', current['p50_ms'], previous['p50_ms'])
+        check(f'{kind} p95 ms', current['p95_ms'], previous['p95_ms'])
+        # the same seed and catalog send the same requests, so any extra query is real
+        check(f'{kind} queries/request', current['queries_per_request'], previous['queries_per_request'],
+              threshold=0 if max_regression is not None else None)
+    return regressions
+
+
+def print_result(result):
+    meta, overall = result['meta'], result['overall']
+    print(f"\nsongs={meta['songs']} requests={meta['requests']} database={meta['database']} "
+          f"cache={meta['cache']} seed={meta['seed']}")
+    print(f"{'endpoint':<10}{'requests':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>10}{'errors':>8}")
+    for kind, data in [*result['endpoints'].items(), ('overall', overall)]:
+        print(f"{kind:<10}{data['requests']:>10}{data['p50_ms']:>10.2f}{data['p95_ms']:>10.2f}"
+              f"{data['p99_ms']:>10.2f}{data['queries_per_request']:>10.2f}{data['errors']:>8}")
+    print(f"throughput: {overall['rps']:.0f} req/s (single in-process client)")
+    print('cache: ' + ', '.join(f'{name}={value}' for name, value in result['cache'].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--songs', type=int, default=10000, help='catalog size, seeded if smaller')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=500, help='requests sent before measuring')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--sqlite', help='run against (and migrate) this sqlite file instead of the configured database')
+    parser.add_argument('--cache', choices=['configured', 'locmem', 'fakeredis'], default='configured')
+    parser.add_argument('--cold', action='store_true', help='clear the caches before the warmup')
+    parser.add_argument('--save-baseline', metavar='NAME')
+    parser.add_argument('--baseline', metavar='NAME|PATH')
+    parser.add_argument('--max-regression', type=float, metavar='PCT',
+                        help='exit 1 if a latency or req/s regresses by more than PCT percent against --baseline')
+    parser.add_argument('--json', action='store_true', help='print the result as json')
+    args = parser.parse_args()
+    if isinstance(args.mix, str):
+        args.mix = parse_mix(args.mix)
+
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_result(result)
+
+    if args.save_baseline:
+        path = baseline_path(args.save_baseline)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(result, indent=2) + '\n')
+        print(f'saved baseline {path}', file=sys.stderr)
+    if args.baseline:
+        baseline = json.loads(baseline_path(args.baseline).read_text())
+        if baseline['meta']['songs'] != result['meta']['songs'] or baseline['meta']['seed'] != result['meta']['seed']:
+            print('warning: baseline was recorded with a different --songs/--seed', file=sys.stderr)
+        regressions = compare(result, baseline, args.max_regression)
+        if regressions:
+            print(f"regressed: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
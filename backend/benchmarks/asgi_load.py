@@ -0,0 +1,164 @@
+"""
+- load test of the song read endpoints under three server setups:
+  - wsgi:        gunicorn ipodify.wsgi, sync views (the current deployment shape)
+  - asgi-sync:   uvicorn ipodify.asgi, sync views (each request bridged to a thread)
+  - asgi-async:  uvicorn ipodify.asgi, DJANGO_ASYNC_READS=true (music.async_views)
+- each setup is started as a subprocess on its own port, warmed up, then driven by a
+  keep-alive asyncio client at each --concurrency level; reports req/s, p50 and p99
+- needs `pip install gunicorn uvicorn` plus a reachable database and redis for the
+  settings in use (DJANGO_SETTINGS_MODULE is passed through to the servers)
+- with DJANGO_DEBUG=false, pass --basic-auth user:password and allow 127.0.0.1 in
+  DJANGO_ALLOWED_HOSTS
+- usage: python -m benchmarks.asgi_load [--paths /api/songs/?page_size=20 /api/songs/1/]
+  [--concurrency 1 16 64] [--requests 2000] [--workers 2] [--threads 8]
+  [--servers wsgi asgi-sync asgi-async]
+"""
+import argparse
+import asyncio
+import base64
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+HOST = '127.0.0.1'
+
+
+def server_command(name, port, workers, threads):
+    """(argv, extra environment) for a server setup"""
+    if name == 'wsgi':
+        argv = [
+            sys.executable, '-m', 'gunicorn', 'ipodify.wsgi:application',
+            '--bind', f'{HOST}:{port}', '--workers', str(workers), '--threads', str(threads),
+            '--log-level', 'warning',
+        ]
+        return argv, {}
+    argv = [
+        sys.executable, '-m', 'uvicorn', 'ipodify.asgi:application',
+        '--host', HOST, '--port', str(port), '--workers', str(workers),
+        '--log-level', 'warning', '--no-access-log',
+    ]
+    return argv, {'DJANGO_ASYNC_READS': 'true' if name == 'asgi-async' else 'false'}
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((HOST, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+async def read_response(reader):
+    """read one HTTP/1.1 response, returns the status code"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('server closed the connection')
+    status = int(status_line.split()[1])
+    length, chunked = 0, False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'transfer-encoding' and 'chunked' in value.lower():
+            chunked = True
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length:
+        await reader.readexactly(length)
+    return status
+
+
+async def client(port, requests, paths, auth, latencies, errors):
+    """one keep-alive connection issuing requests back to back"""
+    reader, writer = await asyncio.open_connection(HOST, port)
+    headers = f'Host: {HOST}\r\nAccept: application/json\r\n'
+    if auth:
+        headers += f'Authorization: Basic {auth}\r\n'
+    try:
+        for i in range(requests):
+            path = paths[i % len(paths)]
+            started = time.perf_counter()
+            writer.write(f'GET {path} HTTP/1.1\r\n{headers}\r\n'.encode('latin-1'))
+            status = await read_response(reader)
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def drive(port, concurrency, total, paths, auth):
+    latencies, errors = [], []
+    per_client = max(1, total // concurrency)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        client(port, per_client, paths, auth, latencies, errors) for _ in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(round(p / 100 * (len(latencies) - 1))))] * 1000
+
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": pct(50),
+        "p99_ms": pct(99),
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--paths', nargs='+', default=['/api/songs/?page_size=20'])
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 16, 64])
+    parser.add_argument('--requests', type=int, default=2000, help='requests per concurrency level')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads per worker')
+    parser.add_argument('--servers', nargs='+', default=['wsgi', 'asgi-sync', 'asgi-async'],
+                        choices=['wsgi', 'asgi-sync', 'asgi-async'])
+    parser.add_argument('--port', type=int, default=8100, help='first port, one per server')
+    parser.add_argument('--basic-auth', help='user:password for non-DEBUG settings')
+    args = parser.parse_args()
+
+    auth = base64.b64encode(args.basic_auth.encode('utf-8')).decode('ascii') if args.basic_auth else None
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'ipodify.settings')
+
+    print(f"paths={args.paths} workers={args.workers} requests/level={args.requests}")
+    print(f"{'server':<12}{'conc':>6}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for offset, name in enumerate(args.servers):
+        port = args.port + offset
+        argv, extra_env = server_command(name, port, args.workers, args.threads)
+        process = subprocess.Popen(argv, cwd=BACKEND_DIR, env={**env, **extra_env})
+        try:
+            wait_for_port(port)
+            # warm up caches and connections on every worker
+            asyncio.run(drive(port, args.workers * 4, args.workers * 200, args.paths, auth))
+            for concurrency in args.concurrency:
+                result = asyncio.run(drive(port, concurrency, args.requests, args.paths, auth))
+                print(f"{name:<12}{concurrency:>6}{result['rps']:>10.0f}{result['p50_ms']:>10.2f}"
+                      f"{result['p99_ms']:>10.2f}{result['errors']:>8}")
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+- compares serving a cached song list page from
+  - dict cache + DRF JSONRenderer (how list/retrieve cached before)
+  - dict cache + ORJSONRenderer
+  - pre-rendered bytes cache (RenderedEnvelope, what list/retrieve do now)
+- each iteration is one cache hit: cache.get() plus producing the response body
+- usage: python -m benchmarks.cache_render [--songs 100] [--iterations 5000] [--locmem]
+  (--locmem uses an in-process cache instead of the configured redis)
+"""
+import argparse
+import os
+import statistics
+import time
+from datetime import date, datetime, timezone as dt_timezone
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ipodify.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.cache import cache as default_cache  # noqa: E402
+from django.core.cache.backends.locmem import LocMemCache  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from music.models import Song  # noqa: E402
+from music.renderers import ORJSONRenderer, RenderedEnvelope  # noqa: E402
+from music.serializers import SongSerializer  # noqa: E402
+from music.types import Genre  # noqa: E402
+
+
+def build_page(songs):
+    """a list envelope shaped like GET /songs/?page_size=<songs>"""
+    instances = []
+    for i in range(songs):
+        song = Song(
+            id=i + 1,
+            title=f'Benchmark Song {i}',
+            artist=f'Benchmark Artist {i % 37}',
+            album=f'Benchmark Album {i % 11}',
+            year=1970 + i % 55,
+            duration=120 + i % 300,
+            spotify_url=f'https://open.spotify.com/track/bench{i}',
+            cover_art_url=f'https://example.com/covers/{i}.jpg',
+            genre=Genre.values[i % len(Genre.values)],
+            created_at=date(2025, 1, 1),
+            updated_at=datetime(2025, 1, 1, 12, 0, i % 60, tzinfo=dt_timezone.utc),
+        )
+        song.decade = Song.get_decade_from_year(song.year)
+        instances.append(song)
+    return {
+        "status": "success",
+        "code": 200,
+        "data": SongSerializer(instances, many=True).data,
+        "pagination": {"next": "http://localhost:8000/api/songs/?cursor=abc", "previous": None, "page_size": songs},
+    }
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(name, serve, iterations):
+    for _ in range(min(200, iterations)):
+        serve()  # warm up
+    samples = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        serve()
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    return {
+        "tier": name,
+        "rps": iterations / elapsed,
+        "p50_us": percentile(samples, 50) * 1e6,
+        "p99_us": percentile(samples, 99) * 1e6,
+        "mean_us": statistics.fmean(samples) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--songs', type=int, default=100)
+    parser.add_argument('--iterations', type=int, default=5000)
+    parser.add_argument('--locmem', action='store_true')
+    args = parser.parse_args()
+
+    cache = LocMemCache('benchmarks', {'OPTIONS': {'MAX_ENTRIES': 100}}) if args.locmem else default_cache
+    page = build_page(args.songs)
+    drf_renderer, orjson_renderer = JSONRenderer(), ORJSONRenderer()
+
+    cache.set('bench_dict', dict(page, timestamp=timezone.now().isoformat()), 300)
+    cache.set('bench_bytes', RenderedEnvelope.render(page).body, 300)
+
+    def dict_drf():
+        data = cache.get('bench_dict')
+        data['timestamp'] = timezone.now().isoformat()
+        return drf_renderer.render(data)
+
+    def dict_orjson():
+        data = cache.get('bench_dict')
+        data['timestamp'] = timezone.now().isoformat()
+        return orjson_renderer.render(data)
+
+    def rendered_bytes():
+        return orjson_renderer.render(RenderedEnvelope(cache.get('bench_bytes')))
+
+    assert dict_drf().rsplit(b'"timestamp"', 1)[0] == rendered_bytes().rsplit(b'"timestamp"', 1)[0]
+
+    results = [
+        run('dict + JSONRenderer', dict_drf, args.iterations),
+        run('dict + ORJSONRenderer', dict_orjson, args.iterations),
+        run('bytes (RenderedEnvelope)', rendered_bytes, args.iterations),
+    ]
+
+    backend = 'locmem' if args.locmem else settings.CACHES['default']['BACKEND']
+    print(f"{args.songs} songs/page, {args.iterations} cache hits per tier, cache={backend}")
+    print(f"{'tier':<26}{'req/s':>12}{'p50 us':>10}{'p99 us':>10}")
+    for result in results:
+        print(f"{result['tier']:<26}{result['rps']:>12.0f}{result['p50_us']:>10.1f}{result['p99_us']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+- SongSerializer(many=True) vs SongReadSerializer for a large list
+- SongSerializer gets model instances (what the list endpoint used to build), the fast
+  path gets the .values() rows it reads now
+- usage: python -m benchmarks.read_serializer [--rows 10000] [--repeat 5] [--from-db]
+  (--from-db includes fetching the first --rows songs from the configured database)
+"""
+import argparse
+import copy
+import os
+import time
+from datetime import date, datetime, timezone as dt_timezone
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ipodify.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from music.models import Song  # noqa: E402
+from music.renderers import dumps  # noqa: E402
+from music.serializers import SongSerializer, song_read_serializer  # noqa: E402
+from music.types import Genre  # noqa: E402
+
+
+def build_rows(count):
+    """.values()-shaped rows, as the database would return them"""
+    rows = []
+    for i in range(count):
+        year = 1970 + i % 55
+        rows.append({
+            'id': i + 1,
+            'created_at': date(2025, 1, 1),
+            'updated_at': datetime(2025, 1, 1, 12, 0, i % 60, i % 1000000, tzinfo=dt_timezone.utc),
+            'decade': Song.get_decade_from_year(year),
+            'genre': Genre.values[i % len(Genre.values)],
+            'year': year,
+            'cover_art_url': f'https://example.com/covers/{i}.jpg' if i % 3 else None,
+            'title': f'Benchmark Song {i}',
+            'artist': f'Benchmark Artist {i % 37}',
+            'album': f'Benchmark Album {i % 11}',
+            'duration': 120 + i % 300,
+            'spotify_url': f'https://open.spotify.com/track/bench{i}',
+        })
+    return rows
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--from-db', action='store_true')
+    args = parser.parse_args()
+
+    if args.from_db:
+        queryset = Song.objects.order_by('-created_at', '-id')[:args.rows]
+        model_path = lambda: SongSerializer(list(queryset), many=True).data  # noqa: E731
+        fast_path = lambda: song_read_serializer.serialize(song_read_serializer.values(queryset))  # noqa: E731
+    else:
+        rows = build_rows(args.rows)
+        # instantiating the models is part of the old path's cost, as it is for a queryset
+        model_path = lambda: SongSerializer([Song(**row) for row in rows], many=True).data  # noqa: E731
+        fast_path = lambda: song_read_serializer.serialize(copy.copy(row) for row in rows)  # noqa: E731
+
+    model_time, expected = best_of(args.repeat, model_path)
+    fast_time, actual = best_of(args.repeat, fast_path)
+    assert dumps(actual) == dumps(expected), 'fast path output differs from SongSerializer'
+
+    source = 'database' if args.from_db else 'in-memory rows'
+    print(f"{len(expected)} songs from {source}, best of {args.repeat}")
+    print(f"SongSerializer      {model_time * 1000:9.1f} ms")
+    print(f"SongReadSerializer  {fast_time * 1000:9.1f} ms")
+    print(f"speedup             {model_time / fast_time:9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import sys
 from pathlib import Path
 from os import getenv
 from dotenv import load_dotenv
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'corsheaders',
     'music',
@@ -50,6 +52,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so its total covers every other middleware
+    'music.timing.ServerTimingMiddleware',
+    'music.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -98,6 +103,15 @@ DATABASES = {
   }
 }
 
+# Local SQLite database for testing without postgres (DJANGO_DB_ENGINE=sqlite)
+if getenv('DJANGO_DB_ENGINE', 'postgresql').lower() == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -148,6 +162,10 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny' if DEBUG else 'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'music.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_FILTER_BACKENDS': [
@@ -156,8 +174,8 @@ REST_FRAMEWORK = {
         'rest_framework.filters.OrderingFilter',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'music.throttling.MeteredAnonRateThrottle',
+        'music.throttling.MeteredUserRateThrottle'
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
@@ -198,12 +216,15 @@ CACHES = {
         "BACKEND": "django_redis.cache.RedisCache",
         "LOCATION": getenv('REDIS_URL', 'redis://127.0.0.1:6379/1'),
         "OPTIONS": {
-            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            # django-redis DefaultClient that reports to the Server-Timing breakdown
+            "CLIENT_CLASS": "music.timing.TimedRedisClient",
             "SOCKET_CONNECT_TIMEOUT": 5,
             "SOCKET_TIMEOUT": 5,
             "RETRY_ON_TIMEOUT": True,
             "MAX_CONNECTIONS": 1000,
-            "CONNECTION_POOL_KWARGS": {"max_connections": 100}
+            "CONNECTION_POOL_KWARGS": {"max_connections": 100},
+            # redis.asyncio pool used by the async read path (music.async_cache)
+            "ASYNC_CONNECTION_POOL_KWARGS": {"max_connections": 100}
         }
     }
 }
@@ -214,3 +235,41 @@ SESSION_CACHE_ALIAS = "default"
 
 # Cache timeout in seconds (5 minutes)
 CACHE_TTL = 300
+
+# Serve GET /api/songs/ and /api/songs/<id>/ from native async views (music.async_views).
+# Only worth it under an ASGI server (e.g. uvicorn ipodify.asgi:application), under WSGI
+# every async view call is bridged back to sync
+ASYNC_SONG_READS = getenv('DJANGO_ASYNC_READS', 'False').lower() == 'true'
+
+# Share of requests measured by music.timing.ServerTimingMiddleware (0 to 1, off unless
+# set): sampled requests log a json line on the `music.timing` logger, and those made by
+# staff users (or any request with DEBUG on) also get a Server-Timing header
+SERVER_TIMING_SAMPLE_RATE = float(getenv('DJANGO_SERVER_TIMING_SAMPLE_RATE', '0'))
+
+# Bearer token GET /metrics requires; without one /metrics is a 404 unless DEBUG is on
+METRICS_TOKEN = getenv('DJANGO_METRICS_TOKEN', '')
+
+# Cover art thumbnails (music.cover_art): where they are cached on disk, the byte budget
+# of that cache, processes resizing covers per worker, and the origin prefixed to the
+# thumbnail urls in song responses (e.g. https://api.example.com; empty uses the origin
+# each request reached the api at)
+COVER_ART_ROOT = getenv('DJANGO_COVER_ART_ROOT', str(BASE_DIR / 'cover_art_cache'))
+COVER_ART_MAX_BYTES = int(getenv('DJANGO_COVER_ART_MAX_BYTES', str(512 * 1024 * 1024)))
+COVER_ART_WORKERS = int(getenv('DJANGO_COVER_ART_WORKERS', '2'))
+COVER_ART_BASE_URL = getenv('DJANGO_COVER_ART_BASE_URL', '')
+# Also fetch originals from loopback/private addresses (a cover server on the local network)
+COVER_ART_ALLOW_PRIVATE_SOURCES = getenv('DJANGO_COVER_ART_ALLOW_PRIVATE_SOURCES', 'False').lower() == 'true'
+
+# manage.py test keeps the per-request timing lines out of its output
+TESTING = sys.argv[1:2] == ['test']
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'music.timing': {'handlers': [] if TESTING else ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Song
+from .models import Playlist, SmartPlaylist, Song
 
 # Register your models here.
 admin.site.register(Song)
+admin.site.register(Playlist)
+admin.site.register(SmartPlaylist)
@@ -1,6 +1,25 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+
+def ensure_search_schema(sender, using, **kwargs):
+    """re-create search triggers/indexes that a table rebuild may have dropped"""
+    from django.db import connections
+    from .search import install_search
+
+    install_search(connections[using])
 
 
 class MusicConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'music'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .metrics import install_db_metrics
+        from .timing import install_db_timing
+
+        post_migrate.connect(ensure_search_schema, sender=self)
+        connection_created.connect(install_db_timing)
+        connection_created.connect(install_db_metrics)
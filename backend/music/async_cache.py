@@ -0,0 +1,130 @@
+import asyncio
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+
+from .timing import timed_cache_call
+
+"""
+- non-blocking access to the default cache for the async read path
+- with django-redis, talks to redis through redis.asyncio: same keys (cache.make_key) and
+  same serialization (the django-redis client's encode/decode), so entries written by the
+  sync views are read by the async ones and the other way round
+- any other backend falls back to django's cache.aget()/aset()..., which run the sync
+  backend in a thread
+"""
+
+
+def _is_django_redis():
+    try:
+        from django_redis.cache import RedisCache
+    except ImportError:
+        return False
+    return isinstance(caches['default'], RedisCache)
+
+
+class AsyncRedisCache:
+    """
+    - the subset of the cache api the read path uses, as coroutines
+    - one redis.asyncio client per event loop (connections can't be shared between loops)
+    - pool options come from CACHES['default']['OPTIONS']['ASYNC_CONNECTION_POOL_KWARGS']
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self):
+        import redis.asyncio
+
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            config = settings.CACHES[self.alias]
+            options = config.get('OPTIONS', {})
+            location = config['LOCATION']
+            if isinstance(location, (list, tuple)):
+                location = location[0]  # primary, the one django-redis writes to
+            pool = redis.asyncio.ConnectionPool.from_url(
+                location,
+                socket_connect_timeout=options.get('SOCKET_CONNECT_TIMEOUT'),
+                socket_timeout=options.get('SOCKET_TIMEOUT'),
+                **options.get('ASYNC_CONNECTION_POOL_KWARGS', {}),
+            )
+            client = redis.asyncio.Redis(connection_pool=pool)
+            self._clients[loop] = client
+        return client
+
+    @staticmethod
+    def _timeout(timeout):
+        """django-style timeout (None = forever) as redis EX seconds"""
+        if timeout is None:
+            return None
+        return max(int(timeout), 1)
+
+    async def get(self, key):
+        with timed_cache_call() as call:
+            value = await self._client().get(cache.make_key(key))
+            call.outcome(value is not None, value is None)
+        return None if value is None else cache.client.decode(value)
+
+    async def get_many(self, keys):
+        keys = list(keys)
+        with timed_cache_call() as call:
+            values = await self._client().mget([cache.make_key(key) for key in keys])
+            found = {key: value for key, value in zip(keys, values) if value is not None}
+            call.outcome(len(found), len(keys) - len(found))
+        return {key: cache.client.decode(value) for key, value in found.items()}
+
+    async def set(self, key, value, timeout):
+        with timed_cache_call():
+            await self._client().set(cache.make_key(key), cache.client.encode(value), ex=self._timeout(timeout))
+
+    async def add(self, key, value, timeout):
+        with timed_cache_call():
+            return bool(await self._client().set(
+                cache.make_key(key), cache.client.encode(value), ex=self._timeout(timeout), nx=True
+            ))
+
+    async def incr(self, key, delta=1):
+        """INCRBY, creating the key without expiry if it is missing (like caching._incr)"""
+        with timed_cache_call():
+            return await self._client().incrby(cache.make_key(key), delta)
+
+    async def delete(self, key):
+        with timed_cache_call():
+            await self._client().delete(cache.make_key(key))
+
+
+class AsyncFallbackCache:
+    """same api over django's thread-backed async cache methods, for non-redis backends"""
+
+    async def get(self, key):
+        return await cache.aget(key)
+
+    async def get_many(self, keys):
+        return await cache.aget_many(keys)
+
+    async def set(self, key, value, timeout):
+        await cache.aset(key, value, timeout)
+
+    async def add(self, key, value, timeout):
+        return await cache.aadd(key, value, timeout)
+
+    async def incr(self, key, delta=1):
+        from .caching import _incr
+        return await sync_to_async(_incr)(key, delta)
+
+    async def delete(self, key):
+        await cache.adelete(key)
+
+
+_redis_cache = AsyncRedisCache()
+_fallback_cache = AsyncFallbackCache()
+
+
+def get_async_cache():
+    """the async cache for the configured backend"""
+    return _redis_cache if _is_django_redis() else _fallback_cache
@@ -0,0 +1,167 @@
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from .caching import (
+    NEGATIVE_TTL,
+    aget_list_version,
+    aget_or_build,
+    arecord_detail_lookup,
+    arecord_list_lookup,
+    detail_cache_key,
+    list_cache_key,
+)
+from .conditional import list_validators, not_modified_response, set_validators
+from .local_cache import MISSING, invalidation_listener_started, song_details, start_invalidation_listener
+from .models import Song
+from .renderers import RenderedEnvelope
+from .search import is_search_request
+
+"""
+- native async GET /songs/ and GET /songs/<id>/ for ASGI deployments (DJANGO_ASYNC_READS=true)
+- cache reads/writes go through redis.asyncio and database reads through the async orm,
+  so a worker's event loop keeps serving other requests while they wait
+- responses are built by the SongViewSet helpers (get_read_queryset, render_list,
+  render_detail) and finalized by DRF, so they are byte-for-byte what the sync views send
+- authentication, permissions and throttling are DRF's, run once per request in a thread
+  (session/basic auth and the throttles are sync only)
+- anything else on these urls (writes, the browsable api, ?format=) is handed to the sync
+  viewset unchanged
+"""
+
+
+async def _list(view, request):
+    """async SongViewSet.list"""
+    generation, last_modified = await aget_list_version()
+    cache_key = list_cache_key(request.query_params, view.filterset_class, generation)
+    etag, last_modified = list_validators(cache_key, last_modified)
+    not_modified = not_modified_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    async def build():
+        rows = view.get_read_queryset(request)
+        if is_search_request(request):
+            page = None
+            rows = [row async for row in rows]
+        else:
+            page = await view.paginator.apaginate_queryset(rows, request, view=view)
+            if page is None:
+                rows = [row async for row in rows]
+        return view.render_list(rows, page)
+
+    body, state = await aget_or_build(cache_key, build)
+    await arecord_list_lookup(hit=state != 'miss', stale=state == 'stale')
+    return set_validators(Response(RenderedEnvelope(body)), etag, last_modified)
+
+
+async def _retrieve(view, request, pk):
+    """async SongViewSet.retrieve"""
+
+    async def build():
+        # what get_object() does: the filtered queryset, a bad pk is a 404
+        try:
+            instance = await view.filter_queryset(view.get_queryset()).filter(pk=pk).afirst()
+        except (TypeError, ValueError, ValidationError):
+            return None
+        if instance is None:
+            return None
+        view.check_object_permissions(request, instance)
+        return view.render_detail(instance)
+
+    if not invalidation_listener_started():
+        # the first request subscribes over a blocking connection, keep it off the event loop
+        await sync_to_async(start_invalidation_listener)()
+    cache_key = detail_cache_key(pk)
+    cached_response = song_details.get(cache_key)
+    if cached_response is MISSING:
+        cached_response, state = await aget_or_build(cache_key, build, negative_ttl=NEGATIVE_TTL)
+        await arecord_detail_lookup(hit=state != 'miss')
+        song_details.set(cache_key, cached_response)
+
+    if cached_response is None:
+        raise Song.DoesNotExist
+
+    etag, last_modified, body = cached_response
+    not_modified = not_modified_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+    return set_validators(Response(RenderedEnvelope(body), status=status.HTTP_200_OK), etag, last_modified)
+
+
+async def _handle(view, action, request, kwargs):
+    """run an async action with the same error envelopes as the sync one"""
+    # the sync actions answer unexpected errors with their own envelope, DRF's exceptions
+    # (e.g. an invalid cursor) are left to handle_exception
+    try:
+        if action == 'list':
+            return await _list(view, request)
+        return await _retrieve(view, request, kwargs.get(view.lookup_url_kwarg or view.lookup_field))
+    except APIException:
+        raise
+    except Song.DoesNotExist:
+        return view.error_response('errors.song.retrieve.not_found', status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        code = status.HTTP_500_INTERNAL_SERVER_ERROR if action == 'list' else status.HTTP_400_BAD_REQUEST
+        return view.error_response(f'errors.song.{action}.failed', code, e)
+
+
+def _plain_response(response):
+    """
+    - a rendered DRF Response as a plain HttpResponse
+    - django renders deferred responses in a thread under ASGI, this avoids that hop
+    """
+    response.render()
+    plain = HttpResponse(response.content, status=response.status_code)
+    for header, value in response.items():
+        plain[header] = value
+    return plain
+
+
+def async_read_view(sync_view):
+    """
+    - wrap a router view of SongViewSet (song-list or song-detail) so GET list/retrieve
+      run natively async and every other request goes to the sync view
+    """
+    actions = dict(sync_view.actions)
+    if 'get' in actions:
+        actions.setdefault('head', actions['get'])
+    call_sync_view = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        action = actions.get(request.method.lower())
+        if action not in ('list', 'retrieve') or 'format' in kwargs:
+            return await call_sync_view(request, *args, **kwargs)
+
+        # what ViewSetMixin.as_view() and APIView.dispatch() set up before the handler runs
+        viewset = sync_view.cls(**sync_view.initkwargs)
+        viewset.action_map = actions
+        for method, name in actions.items():
+            setattr(viewset, method, getattr(viewset, name))
+        viewset.args, viewset.kwargs = args, kwargs
+        drf_request = viewset.initialize_request(request, *args, **kwargs)
+        viewset.request = drf_request
+        viewset.headers = viewset.default_response_headers
+        viewset.format_kwarg = None
+
+        # the browsable api (and any other non-json renderer) stays on the sync view
+        renderer, media_type = viewset.perform_content_negotiation(drf_request)
+        if renderer.format != 'json':
+            return await call_sync_view(request, *args, **kwargs)
+
+        try:
+            await sync_to_async(viewset.initial)(drf_request, *args, **kwargs)
+            response = await _handle(viewset, action, drf_request, kwargs)
+        except Exception as exc:
+            response = viewset.handle_exception(exc)
+        response = viewset.finalize_response(drf_request, response, *args, **kwargs)
+        if isinstance(response, Response):
+            return _plain_response(response)
+        return response
+
+    view.actions = actions
+    return csrf_exempt(view)
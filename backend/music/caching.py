@@ -0,0 +1,409 @@
+import asyncio
+import hashlib
+import math
+import random
+import time
+import uuid
+from decimal import Decimal, InvalidOperation
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django_filters import NumberFilter
+from rest_framework.settings import api_settings
+
+from .async_cache import get_async_cache
+from .local_cache import song_details
+from .metrics import metrics, timed_invalidation
+from .pagination import SongCursorPagination
+
+"""
+- cache keys for song responses
+- list responses are namespaced by a generation counter: every list key embeds the
+  current generation, and a write bumps it with a single INCR. old entries are never
+  looked up again and simply expire after CACHE_TTL, so invalidation is O(1) instead
+  of a SCAN over the whole redis keyspace (which also holds every session)
+- list keys are canonical: only parameters the list endpoint actually reads are kept,
+  values are normalized and sorted, then hashed, so equivalent requests share one entry
+  and junk parameters can't multiply entries
+- hit/miss/invalidation counters live in the cache too, so they add up across workers
+- responses are rebuilt single-flight (see get_or_build): one worker holds a short lock
+  and recomputes, the others serve the previous value or wait for the new one, and hot
+  entries are refreshed a little before they expire rather than all at once after
+"""
+
+LIST_KEY_PREFIX = 'songs_list'
+LIST_GENERATION_KEY = 'songs_list_generation'
+LIST_MODIFIED_KEY = 'songs_list_modified'
+DETAIL_KEY_PREFIX = 'song_detail'
+STATS_KEY_PREFIX = 'songs_cache_stats'
+STATS = ('list_hits', 'list_misses', 'list_stale', 'list_invalidations', 'detail_hits', 'detail_misses')
+
+# how long a "no such song" result is cached, ids that get created are invalidated explicitly
+NEGATIVE_TTL = 30
+
+# an entry outlives its ttl by this long so it can be served while it is being rebuilt
+STALE_TTL = 60
+# lock held by the worker rebuilding an entry, in seconds; expires if that worker dies
+REBUILD_LOCK_TIMEOUT = 10
+# how long a worker with nothing to serve waits for another worker's rebuild
+REBUILD_WAIT = 2.0
+REBUILD_POLL_INTERVAL = 0.05
+# probabilistic early refresh (XFetch): >1 refreshes earlier, <1 later
+EARLY_REFRESH_BETA = 1.0
+
+
+def _incr(key, delta=1):
+    """atomic increment that creates the key (without expiry) if it is missing"""
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        return cache.incr(key, delta)
+
+
+def _initial_generation():
+    """
+    - starting generation when the counter is missing (first use, or evicted by redis)
+    - seeded from the clock so a lost counter never restarts below a generation that
+      still has live entries
+    """
+    return time.time_ns() // 1000
+
+
+def get_list_generation():
+    """current list cache generation"""
+    generation = cache.get(LIST_GENERATION_KEY)
+    if generation is None:
+        cache.add(LIST_GENERATION_KEY, _initial_generation(), timeout=None)
+        generation = cache.get(LIST_GENERATION_KEY)
+    return generation
+
+
+def get_list_version():
+    """
+    - (generation, last_modified) for list responses, in one round trip
+    - last_modified is the unix time of the last write through the api
+    """
+    values = cache.get_many([LIST_GENERATION_KEY, LIST_MODIFIED_KEY])
+    generation = values.get(LIST_GENERATION_KEY)
+    if generation is None:
+        generation = get_list_generation()
+    last_modified = values.get(LIST_MODIFIED_KEY)
+    if last_modified is None:
+        cache.add(LIST_MODIFIED_KEY, time.time(), timeout=None)
+        last_modified = cache.get(LIST_MODIFIED_KEY)
+    return generation, last_modified
+
+
+async def aget_list_version():
+    """get_list_version() for the async read path"""
+    async_cache = get_async_cache()
+    values = await async_cache.get_many([LIST_GENERATION_KEY, LIST_MODIFIED_KEY])
+    generation = values.get(LIST_GENERATION_KEY)
+    if generation is None:
+        await async_cache.add(LIST_GENERATION_KEY, _initial_generation(), timeout=None)
+        generation = await async_cache.get(LIST_GENERATION_KEY)
+    last_modified = values.get(LIST_MODIFIED_KEY)
+    if last_modified is None:
+        await async_cache.add(LIST_MODIFIED_KEY, time.time(), timeout=None)
+        last_modified = await async_cache.get(LIST_MODIFIED_KEY)
+    return generation, last_modified
+
+
+def _normalize_text(value, casefold=False):
+    """trim and collapse whitespace, casefold for case-insensitive lookups"""
+    value = ' '.join(value.split())
+    return value.casefold() if casefold else value
+
+
+def _normalize_number(value):
+    """'01985', '1985.0' and ' 1985 ' all become '1985', anything unparseable is kept"""
+    try:
+        number = Decimal(value.strip())
+    except InvalidOperation:
+        return value
+    if not number.is_finite():
+        return value
+    if number == number.to_integral_value():
+        return str(int(number))
+    return str(number.normalize())
+
+
+def _normalize_page_size(value):
+    """the page size the paginator will actually use, e.g. 500 -> '100'"""
+    paginator = SongCursorPagination
+    try:
+        size = int(Decimal(value.strip()))
+    except (InvalidOperation, ValueError):
+        return str(paginator.page_size)
+    if size <= 0:
+        return str(paginator.page_size)
+    return str(min(size, paginator.max_page_size))
+
+
+def canonical_list_params(query_params, filterset_class):
+    """
+    - reduce list query params to a sorted tuple of (name, normalized value)
+    - keeps filterset params, pagination params and ordering; drops everything else
+    - like django-filter, the last value wins for repeated params and blanks are ignored
+    """
+    params = {}
+    for name, value in query_params.items():
+        value = value.strip()
+        if not value:
+            continue
+
+        if name in filterset_class.base_filters:
+            field = filterset_class.base_filters[name]
+            if isinstance(field, NumberFilter):
+                params[name] = _normalize_number(value)
+            else:
+                # icontains lookups and ?q= search ignore case, exact lookups do not
+                casefold = field.lookup_expr.startswith('i') or bool(field.method)
+                params[name] = _normalize_text(value, casefold=casefold)
+        elif name == SongCursorPagination.page_size_query_param:
+            params[name] = _normalize_page_size(value)
+        elif name == SongCursorPagination.cursor_query_param:
+            params[name] = value
+        elif name == api_settings.ORDERING_PARAM:
+            params[name] = ','.join(part.strip() for part in value.split(',') if part.strip())
+
+    return tuple(sorted(params.items()))
+
+
+def list_cache_key(query_params, filterset_class, generation=None):
+    """
+    - cache key for a list response in the given (default: current) generation
+    - e.g. songs_list_v1718000000000000_3f2a...: a fixed-length digest of the canonical params
+    """
+    if generation is None:
+        generation = get_list_generation()
+    canonical = urlencode(canonical_list_params(query_params, filterset_class))
+    digest = hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+    return f"{LIST_KEY_PREFIX}_v{generation}_{digest}"
+
+
+def detail_cache_key(pk):
+    """cache key for a single song response"""
+    return f"{DETAIL_KEY_PREFIX}_{pk}"
+
+
+def invalidate_song_lists():
+    """drop every cached list response by moving to a new generation"""
+    with timed_invalidation(LIST_KEY_PREFIX):
+        try:
+            cache.incr(LIST_GENERATION_KEY)
+        except ValueError:
+            cache.add(LIST_GENERATION_KEY, _initial_generation(), timeout=None)
+        cache.set(LIST_MODIFIED_KEY, time.time(), timeout=None)
+    _incr(f"{STATS_KEY_PREFIX}_list_invalidations")
+
+
+def _lookup_result(hit, stale=False):
+    """result label of a cache lookup metric"""
+    return 'stale' if stale else 'hit' if hit else 'miss'
+
+
+def record_list_lookup(hit, stale=False):
+    """count a list cache hit or miss, stale hits are also counted separately"""
+    metrics.inc('songs_cache_requests_total', family=LIST_KEY_PREFIX, result=_lookup_result(hit, stale))
+    _incr(f"{STATS_KEY_PREFIX}_{'list_hits' if hit else 'list_misses'}")
+    if stale:
+        _incr(f"{STATS_KEY_PREFIX}_list_stale")
+
+
+def _refresh_early(expires_at, build_time, beta=EARLY_REFRESH_BETA):
+    """
+    - XFetch: volunteer to rebuild before expiry, with a probability that grows as expiry
+      gets closer and with how long the value takes to build
+    - spreads the rebuilds of a hot key over its last seconds instead of every worker
+      missing at the same instant
+    """
+    # -log(u) for u in (0, 1] is exponentially distributed with mean 1
+    return time.time() - build_time * beta * math.log(1.0 - random.random()) >= expires_at
+
+
+def _store(key, build, ttl, negative_ttl):
+    """build a value and cache it as (value, expires_at, build_time)"""
+    started = time.perf_counter()
+    value = build()
+    build_time = time.perf_counter() - started
+    if value is None and negative_ttl is not None:
+        ttl = negative_ttl
+    cache.set(key, (value, time.time() + ttl, build_time), ttl + STALE_TTL)
+    return value
+
+
+def get_or_build(key, build, ttl=None, negative_ttl=None):
+    """
+    - cached value for key, calling build() to (re)compute it at most once at a time
+    - returns (value, state), state being 'hit', 'stale' (an expired or early-refresh
+      value served while another worker rebuilds) or 'miss' (built by this call)
+    - fresh entry: returned as is, unless this request is picked for an early refresh
+    - otherwise the worker that takes the lock rebuilds; the others serve the old value
+      if there is one, else poll for up to REBUILD_WAIT seconds and build themselves if
+      the rebuild still hasn't landed (so a crashed lock holder costs a delay, not an error)
+    - build() may return None for "does not exist", cached for negative_ttl if given
+    """
+    if ttl is None:
+        ttl = settings.CACHE_TTL
+
+    entry = cache.get(key)
+    if entry is not None:
+        value, expires_at, build_time = entry
+        if not _refresh_early(expires_at, build_time):
+            return value, 'hit'
+
+    lock_key = f"{key}_lock"
+    token = uuid.uuid4().hex
+    if cache.add(lock_key, token, REBUILD_LOCK_TIMEOUT):
+        try:
+            return _store(key, build, ttl, negative_ttl), 'miss'
+        finally:
+            # only release our own lock, it may have timed out and been taken by another worker
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    if entry is not None:
+        return entry[0], 'stale'
+
+    deadline = time.monotonic() + REBUILD_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(REBUILD_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0], 'hit'
+    return _store(key, build, ttl, negative_ttl), 'miss'
+
+
+def get_many_or_build(keys, build_many, ttl=None, negative_ttl=None):
+    """
+    - get_or_build() for many keys at once: one cache.get_many for all of them, one
+      build_many(missing_keys) -> {key: value} call for the misses, and the results cached
+      with one set_many (negative entries with a second one)
+    - returns ({key: value}, hits); keys build_many leaves out are None ("does not exist")
+    - same entries as get_or_build, so single and batch lookups share them; expired entries
+      are rebuilt with the batch rather than served stale, and there is no rebuild lock
+      (a batch is already one query however many keys it misses)
+    """
+    if ttl is None:
+        ttl = settings.CACHE_TTL
+
+    now = time.time()
+    values = {}
+    for key, entry in cache.get_many(keys).items():
+        value, expires_at, _ = entry
+        if expires_at > now:
+            values[key] = value
+    hits = len(values)
+
+    missing = [key for key in keys if key not in values]
+    if missing:
+        started = time.perf_counter()
+        built = build_many(missing)
+        build_time = (time.perf_counter() - started) / len(missing)
+        found, not_found = {}, {}
+        for key in missing:
+            value = values[key] = built.get(key)
+            if value is None and negative_ttl is not None:
+                not_found[key] = (None, now + negative_ttl, build_time)
+            else:
+                found[key] = (value, now + ttl, build_time)
+        if found:
+            cache.set_many(found, ttl + STALE_TTL)
+        if not_found:
+            cache.set_many(not_found, negative_ttl + STALE_TTL)
+    return values, hits
+
+
+async def _astore(key, build, ttl, negative_ttl):
+    started = time.perf_counter()
+    value = await build()
+    build_time = time.perf_counter() - started
+    if value is None and negative_ttl is not None:
+        ttl = negative_ttl
+    await get_async_cache().set(key, (value, time.time() + ttl, build_time), ttl + STALE_TTL)
+    return value
+
+
+async def aget_or_build(key, build, ttl=None, negative_ttl=None):
+    """
+    - get_or_build() for the async read path, build is a coroutine function
+    - same entries and lock keys, so sync and async workers share one single flight
+    """
+    if ttl is None:
+        ttl = settings.CACHE_TTL
+    async_cache = get_async_cache()
+
+    entry = await async_cache.get(key)
+    if entry is not None:
+        value, expires_at, build_time = entry
+        if not _refresh_early(expires_at, build_time):
+            return value, 'hit'
+
+    lock_key = f"{key}_lock"
+    token = uuid.uuid4().hex
+    if await async_cache.add(lock_key, token, REBUILD_LOCK_TIMEOUT):
+        try:
+            return await _astore(key, build, ttl, negative_ttl), 'miss'
+        finally:
+            if await async_cache.get(lock_key) == token:
+                await async_cache.delete(lock_key)
+
+    if entry is not None:
+        return entry[0], 'stale'
+
+    deadline = time.monotonic() + REBUILD_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(REBUILD_POLL_INTERVAL)
+        entry = await async_cache.get(key)
+        if entry is not None:
+            return entry[0], 'hit'
+    return await _astore(key, build, ttl, negative_ttl), 'miss'
+
+
+def record_detail_lookup(hit):
+    """count a redis-tier detail hit or miss (local tier hits are counted in process)"""
+    metrics.inc('songs_cache_requests_total', family=DETAIL_KEY_PREFIX, result=_lookup_result(hit))
+    _incr(f"{STATS_KEY_PREFIX}_{'detail_hits' if hit else 'detail_misses'}")
+
+
+def record_detail_lookups(hits, misses):
+    """record_detail_lookup() for a batch, one increment per counter"""
+    for result, stat, count in (('hit', 'detail_hits', hits), ('miss', 'detail_misses', misses)):
+        if count:
+            metrics.inc('songs_cache_requests_total', count, family=DETAIL_KEY_PREFIX, result=result)
+            _incr(f"{STATS_KEY_PREFIX}_{stat}", count)
+
+
+async def arecord_list_lookup(hit, stale=False):
+    """record_list_lookup() for the async read path"""
+    metrics.inc('songs_cache_requests_total', family=LIST_KEY_PREFIX, result=_lookup_result(hit, stale))
+    async_cache = get_async_cache()
+    await async_cache.incr(f"{STATS_KEY_PREFIX}_{'list_hits' if hit else 'list_misses'}")
+    if stale:
+        await async_cache.incr(f"{STATS_KEY_PREFIX}_list_stale")
+
+
+async def arecord_detail_lookup(hit):
+    """record_detail_lookup() for the async read path"""
+    metrics.inc('songs_cache_requests_total', family=DETAIL_KEY_PREFIX, result=_lookup_result(hit))
+    await get_async_cache().incr(f"{STATS_KEY_PREFIX}_{'detail_hits' if hit else 'detail_misses'}")
+
+
+def get_cache_stats():
+    """
+    - counters plus derived hit ratios and the current generation
+    - returns a dict, e.g. {"list_hits": 90, "list_misses": 10, "list_hit_ratio": 0.9, ...}
+    - redis counters add up across workers, detail_local is this worker's in-process tier
+    """
+    keys = {f"{STATS_KEY_PREFIX}_{name}": name for name in STATS}
+    values = cache.get_many(list(keys))
+    stats = {name: values.get(key, 0) for key, name in keys.items()}
+    for tier in ('list', 'detail'):
+        hits, misses = stats[f'{tier}_hits'], stats[f'{tier}_misses']
+        stats[f'{tier}_hit_ratio'] = round(hits / (hits + misses), 4) if hits + misses else None
+    stats['detail_local'] = song_details.stats()
+    stats['list_generation'] = get_list_generation()
+    return stats
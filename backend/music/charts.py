@@ -0,0 +1,351 @@
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .caching import REBUILD_LOCK_TIMEOUT
+from .local_cache import _redis_connection
+from .models import PlayEvent, PlayRollup
+from .types import Decade, Genre
+
+"""
+- top songs / top artists and listening time per genre and decade, over the last day
+  (24 hourly buckets), the last week (7 daily buckets) or all time, all in UTC
+- every play event flush adds its events to the PlayRollup table (one upsert per
+  ROLLUP_UPSERT_BATCH rows, in the same transaction as the events) and to redis sorted
+  sets, one per (chart, bucket): songs and artists scored by plays, genres and decades by
+  seconds listened. bucket sets expire once they fall out of their window
+- a chart read is one ZREVRANGE of the all-time set, or of the window's buckets merged
+  with ZUNIONSTORE and kept WINDOW_TTL seconds, so it costs the same however many events
+  there are. music_playevent is never aggregated on a request
+- the sorted sets are derived data: when redis loses them they are reloaded from the
+  rollup table on the next read, and `manage.py rebuild_play_charts` recomputes both from
+  the events (e.g. after a flusher crashed between its commit and its redis update)
+- artists, genres and decades are the song's at the time of the flush
+- deleting a song takes its rollups back out of every live set (see forget_song), so the
+  charts match the rollup table, whose rows cascade with the song
+- without a redis cache backend charts are aggregated from the rollup table
+"""
+
+WINDOWS = ('day', 'week', 'all')
+CHART_LIMIT = 25
+CHART_MAX = 100
+# extra top songs read, so songs deleted since their plays don't leave a chart short
+CHART_SLACK = 10
+CHARTS_KEY_PREFIX = 'charts'
+CHARTS_READY_KEY = 'play_charts_ready'
+# a day or week chart is merged from its buckets at most this often
+WINDOW_TTL = 30
+ROLLUP_UPSERT_BATCH = 500
+REBUILD_BATCH_SIZE = 5000
+
+# buckets a window is merged from, and how long a bucket's sorted sets are kept
+WINDOW_BUCKETS = {'day': (PlayRollup.HOUR, 24), 'week': (PlayRollup.DAY, 7)}
+RETENTION = {PlayRollup.HOUR: timedelta(hours=25), PlayRollup.DAY: timedelta(days=8)}
+# start of the "older than any window" day rows summed up for the all-time charts
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def bucket_starts(played_at):
+    """(hour, day) bucket starts of a play, in UTC"""
+    hour = played_at.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return hour, hour.replace(hour=0)
+
+
+def _stamp(bucket, start):
+    return start.strftime('%Y%m%d%H' if bucket == PlayRollup.HOUR else '%Y%m%d')
+
+
+def _key(chart, stamp):
+    """e.g. charts_songs_2024010112, charts_genre_all"""
+    return cache.make_key(f'{CHARTS_KEY_PREFIX}_{chart}_{stamp}')
+
+
+def rollup_rows(events):
+    """{(bucket, start, song id): [plays, seconds]} of play events"""
+    rows = defaultdict(lambda: [0, 0])
+    for event in events:
+        for bucket, start in zip((PlayRollup.HOUR, PlayRollup.DAY), bucket_starts(event['played_at'])):
+            totals = rows[(bucket, start, event['song_id'])]
+            totals[0] += 1
+            totals[1] += event['seconds_played']
+    return rows
+
+
+def apply_rollups(rows, using='default'):
+    """add rollup rows to the PlayRollup table"""
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(PlayRollup._meta.db_table)
+    items = list(rows.items())
+    for offset in range(0, len(items), ROLLUP_UPSERT_BATCH):
+        chunk = items[offset:offset + ROLLUP_UPSERT_BATCH]
+        params = []
+        for (bucket, start, song_id), (plays, seconds) in chunk:
+            params.extend([bucket, connection.ops.adapt_datetimefield_value(start), song_id, plays, seconds])
+        # INSERT .. ON CONFLICT DO UPDATE works on both postgres and sqlite
+        sql = (
+            f"INSERT INTO {table} ({quote('bucket')}, {quote('start')}, {quote('song_id')}, "
+            f"{quote('plays')}, {quote('seconds')}) "
+            f"VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(chunk))} "
+            f"ON CONFLICT ({quote('bucket')}, {quote('start')}, {quote('song_id')}) DO UPDATE SET "
+            f"{quote('plays')} = {table}.{quote('plays')} + excluded.{quote('plays')}, "
+            f"{quote('seconds')} = {table}.{quote('seconds')} + excluded.{quote('seconds')}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+def _chart_increments(rows, songs, now):
+    """
+    - ({redis key: Counter(member: increment)}, {redis key: expiry}) of rollup rows
+    - every day row counts towards all time; buckets already out of their window are skipped
+    """
+    increments, expiry = defaultdict(Counter), {}
+    for (bucket, start, song_id), (plays, seconds) in rows.items():
+        if song_id not in songs:
+            continue
+        stamps = []
+        expires = start + RETENTION[bucket]
+        if expires > now:
+            stamps.append((_stamp(bucket, start), expires))
+        if bucket == PlayRollup.DAY:
+            stamps.append(('all', None))
+        artist, genre, decade = songs[song_id]
+        for stamp, expires in stamps:
+            for chart, member, amount in (
+                ('songs', song_id, plays),
+                ('artists', artist, plays),
+                ('genre', genre, seconds),
+                ('decade', decade, seconds),
+            ):
+                if member in (None, '') or not amount:
+                    continue
+                key = _key(chart, stamp)
+                increments[key][member] += amount
+                if expires is not None:
+                    expiry[key] = expires
+    return increments, expiry
+
+
+def _add_to_charts(connection, rows, songs):
+    increments, expiry = _chart_increments(rows, songs, timezone.now())
+    pipeline = connection.pipeline(transaction=False)
+    for key, members in increments.items():
+        for member, amount in members.items():
+            pipeline.zincrby(key, amount, member)
+        if key in expiry:
+            pipeline.expireat(key, expiry[key])
+    pipeline.execute()
+
+
+def record_plays(events, songs, using='default'):
+    """
+    - add freshly inserted play events to the rollups and the live charts
+    - songs: {song id: (artist, genre, decade)} for every event's song
+    - not idempotent: pass only the events this transaction inserted (see
+      plays.insert_events), an event passed twice is counted twice
+    - call inside the transaction that inserts the events; the charts are updated once
+      it commits
+    """
+    rows = rollup_rows(events)
+    if not rows:
+        return
+    apply_rollups(rows, using=using)
+    connection = _redis_connection()
+    if connection is not None:
+        transaction.on_commit(lambda: _add_to_charts(connection, rows, songs), using=using)
+
+
+def _chart_keys(connection):
+    return list(connection.scan_iter(match=cache.make_key(f'{CHARTS_KEY_PREFIX}_*'), count=1000))
+
+
+def _live_rollups(rollups, now):
+    """
+    - (rows, songs) of the rollups that still feed a live chart, as record_plays takes them
+    - day rows older than any window are summed into one all-time row per song
+    """
+    day_cutoff = now - RETENTION[PlayRollup.DAY]
+    fields = ('bucket', 'start', 'song_id', 'plays', 'seconds', 'song__artist', 'song__genre', 'song__decade')
+    rows, songs = {}, {}
+    recent = (
+        rollups.filter(bucket=PlayRollup.HOUR, start__gt=now - RETENTION[PlayRollup.HOUR])
+        | rollups.filter(bucket=PlayRollup.DAY, start__gt=day_cutoff)
+    )
+    for bucket, start, song_id, plays, seconds, *song in recent.values_list(*fields).iterator(
+            chunk_size=REBUILD_BATCH_SIZE):
+        rows[(bucket, start, song_id)] = (plays, seconds)
+        songs[song_id] = tuple(song)
+    # older days only count towards all time, one summed row per song
+    older = rollups.filter(bucket=PlayRollup.DAY, start__lte=day_cutoff).values(
+        'song_id', 'song__artist', 'song__genre', 'song__decade'
+    ).annotate(total_plays=Sum('plays'), total_seconds=Sum('seconds')).order_by()
+    for row in older.iterator(chunk_size=REBUILD_BATCH_SIZE):
+        rows[(PlayRollup.DAY, EPOCH, row['song_id'])] = (row['total_plays'], row['total_seconds'])
+        songs[row['song_id']] = (row['song__artist'], row['song__genre'], row['song__decade'])
+    return rows, songs
+
+
+def load_charts(using='default'):
+    """replace the live charts with what the rollup table says"""
+    connection = _redis_connection()
+    if connection is None:
+        return
+    rows, songs = _live_rollups(PlayRollup.objects.using(using), timezone.now())
+    keys = _chart_keys(connection)
+    if keys:
+        connection.delete(*keys)
+    _add_to_charts(connection, rows, songs)
+
+
+def ensure_charts():
+    """reload the live charts from the rollup table if redis has lost them"""
+    if cache.get(CHARTS_READY_KEY):
+        return
+    lock_key = f'{CHARTS_READY_KEY}_lock'
+    if cache.add(lock_key, 1, REBUILD_LOCK_TIMEOUT):
+        try:
+            load_charts()
+            cache.set(CHARTS_READY_KEY, True, timeout=None)
+        finally:
+            cache.delete(lock_key)
+
+
+def rebuild_play_charts(using='default'):
+    """recompute the rollup table from music_playevent and reload the live charts"""
+    with transaction.atomic(using=using):
+        PlayRollup.objects.using(using).all().delete()
+        for bucket, trunc in ((PlayRollup.HOUR, TruncHour), (PlayRollup.DAY, TruncDay)):
+            rows = PlayEvent.objects.using(using).annotate(
+                bucket_start=trunc('played_at', tzinfo=dt_timezone.utc)
+            ).values('bucket_start', 'song_id').annotate(
+                total_plays=Count('id'), total_seconds=Sum('seconds_played')
+            ).order_by()
+            batch = []
+            for row in rows.iterator(chunk_size=REBUILD_BATCH_SIZE):
+                batch.append(PlayRollup(bucket=bucket, start=row['bucket_start'], song_id=row['song_id'],
+                                        plays=row['total_plays'], seconds=row['total_seconds']))
+                if len(batch) == REBUILD_BATCH_SIZE:
+                    PlayRollup.objects.using(using).bulk_create(batch)
+                    batch = []
+            PlayRollup.objects.using(using).bulk_create(batch)
+    load_charts(using=using)
+    cache.set(CHARTS_READY_KEY, True, timeout=None)
+
+
+def _merged_key(chart, window, now):
+    """(key of a window's merged set, latest bucket start, bucket step)"""
+    bucket = WINDOW_BUCKETS[window][0]
+    latest = bucket_starts(now)[0 if bucket == PlayRollup.HOUR else 1]
+    step = timedelta(hours=1) if bucket == PlayRollup.HOUR else timedelta(days=1)
+    return _key(chart, f'{window}_{_stamp(bucket, latest)}'), latest, step
+
+
+def _remove_from_charts(connection, rows, songs):
+    now = timezone.now()
+    negated = {key: (-plays, -seconds) for key, (plays, seconds) in rows.items()}
+    increments, _ = _chart_increments(negated, songs, now)
+    pipeline = connection.pipeline(transaction=False)
+    for key, members in increments.items():
+        for member, amount in members.items():
+            pipeline.zincrby(key, amount, member)
+        # members left at zero, and a bucket that had already expired, go away
+        pipeline.zremrangebyscore(key, '-inf', 0)
+    # the merged day and week sets are rebuilt from the corrected buckets on the next read
+    pipeline.delete(*[
+        _merged_key(chart, window, now)[0]
+        for chart in ('songs', 'artists', 'genre', 'decade') for window in WINDOW_BUCKETS
+    ])
+    pipeline.execute()
+
+
+def forget_song(song_id, using='default'):
+    """
+    - take a song about to be deleted out of the live charts: its rollup totals are
+      subtracted from the all-time sets and from every day and week bucket, so the
+      artists, genres and decades it counted towards drop by what it added
+    - call before the delete, while its rollup rows still exist; redis is updated once
+      the delete commits
+    """
+    connection = _redis_connection()
+    if connection is None:
+        return
+    rows, songs = _live_rollups(PlayRollup.objects.using(using).filter(song_id=song_id), timezone.now())
+    if rows:
+        transaction.on_commit(lambda: _remove_from_charts(connection, rows, songs), using=using)
+
+
+def _window_key(connection, chart, window):
+    """sorted set of a chart over a window, merged from its buckets when it isn't fresh"""
+    if window == 'all':
+        return _key(chart, 'all')
+    bucket, count = WINDOW_BUCKETS[window]
+    merged, latest, step = _merged_key(chart, window, timezone.now())
+    if not connection.exists(merged):
+        sources = [_key(chart, _stamp(bucket, latest - step * index)) for index in range(count)]
+        pipeline = connection.pipeline(transaction=False)
+        pipeline.zunionstore(merged, sources)
+        pipeline.expire(merged, WINDOW_TTL)
+        pipeline.execute()
+    return merged
+
+
+def _window_rollups(window):
+    """PlayRollup rows of a window, for the no-redis fallback"""
+    if window == 'all':
+        return PlayRollup.objects.filter(bucket=PlayRollup.DAY)
+    bucket, count = WINDOW_BUCKETS[window]
+    latest = bucket_starts(timezone.now())[0 if bucket == PlayRollup.HOUR else 1]
+    step = timedelta(hours=1) if bucket == PlayRollup.HOUR else timedelta(days=1)
+    return PlayRollup.objects.filter(bucket=bucket, start__gt=latest - step * count)
+
+
+def top(chart, window, limit=CHART_LIMIT):
+    """
+    - [(member, plays)] of the `songs` or `artists` chart, most played first
+    - e.g. top('artists', 'week', 3) -> [('Queen', 41), ('ABBA', 17), ('Blondie', 9)]
+    """
+    connection = _redis_connection()
+    if connection is None:
+        field = 'song_id' if chart == 'songs' else 'song__artist'
+        rows = _window_rollups(window).values(field).annotate(total=Sum('plays')).order_by('-total', field)
+        return [(row[field], row['total']) for row in rows[:limit]]
+
+    ensure_charts()
+    rows = connection.zrevrange(_window_key(connection, chart, window), 0, limit - 1, withscores=True)
+    convert = int if chart == 'songs' else bytes.decode
+    return [(convert(member), int(score)) for member, score in rows]
+
+
+def listening_time(window):
+    """
+    - seconds listened per genre and per decade, in menu (choices) order, zeros dropped
+    - e.g. {"genre": {"Rock": 5400, ...}, "decade": {"80s": 3600, ...}, "seconds": 9000}
+    """
+    connection = _redis_connection()
+    if connection is None:
+        totals = {}
+        for chart, field in (('genre', 'song__genre'), ('decade', 'song__decade')):
+            rows = _window_rollups(window).values(field).annotate(total=Sum('seconds')).order_by()
+            totals[chart] = {row[field]: row['total'] for row in rows}
+    else:
+        ensure_charts()
+        pipeline = connection.pipeline(transaction=False)
+        for chart in ('genre', 'decade'):
+            pipeline.zrange(_window_key(connection, chart, window), 0, -1, withscores=True)
+        totals = {
+            chart: {member.decode(): int(score) for member, score in rows}
+            for chart, rows in zip(('genre', 'decade'), pipeline.execute())
+        }
+
+    result = {
+        chart: {value: totals[chart][value] for value in choices.values if totals[chart].get(value)}
+        for chart, choices in (('genre', Genre), ('decade', Decade))
+    }
+    result['seconds'] = sum(totals['genre'].values())
+    return result
@@ -0,0 +1,64 @@
+import hashlib
+from datetime import datetime
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+
+"""
+- conditional GET support (ETag / Last-Modified / 304) for the song endpoints
+- validators come from the data version, never from the serialized body, so a matching
+  If-None-Match / If-Modified-Since is answered before anything is serialized:
+  - detail: the song id and its updated_at timestamp
+  - list: the canonical list cache key (which embeds the list generation) and the time
+    of the last song write; both move on every Song save/delete (signals.py) and on bulk
+    writes, which invalidate explicitly
+"""
+
+
+def make_etag(*parts):
+    """strong etag from the parts that identify a representation"""
+    digest = hashlib.blake2b('|'.join(str(part) for part in parts).encode('utf-8'), digest_size=16)
+    return f'"{digest.hexdigest()}"'
+
+
+def song_validators(pk, updated_at):
+    """
+    - (etag, last_modified) for a single song
+    - updated_at can be a datetime or the serialized string from a cached response
+    """
+    if isinstance(updated_at, str):
+        updated_at = parse_datetime(updated_at)
+    if not isinstance(updated_at, datetime):
+        return make_etag('song', pk), None
+    # http dates have one-second resolution, sub-second changes are caught by the etag
+    return make_etag('song', pk, updated_at.isoformat()), int(updated_at.timestamp())
+
+
+def list_validators(cache_key, last_modified):
+    """(etag, last_modified) for a list response"""
+    return make_etag('songs', cache_key), int(last_modified)
+
+
+def not_modified_response(request, etag, last_modified):
+    """
+    - a 304 (or 412) response if the request's preconditions say the client is up to
+      date, None if the full response should be sent
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    """
+    - attach validators to a response
+    - no-cache makes browsers (and SWR's fetches) revalidate every time, which is
+      cheap now that a match is a 304 with no body
+    """
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,470 @@
+import hashlib
+import http.client
+import ipaddress
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import FileResponse, Http404, HttpResponseRedirect
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_safe
+
+from .models import Song
+from .thumbnails import render_thumbnails
+
+logger = logging.getLogger(__name__)
+
+"""
+- iPod-sized cover art: the songs api hands out thumbnail urls instead of the full-size
+  Song.cover_art_url, and GET /api/covers/<song id>/<source digest>/<size>.jpg serves them
+- the first request for a cover fetches the original once (one fetch per source url at a
+  time, across workers) and renders every THUMBNAIL_SIZES entry from a single decode in a
+  process pool, so resizing never holds up the request threads' GIL
+- thumbnails live in a content-addressed disk cache under COVER_ART_ROOT, named by the
+  sha256 of the original image: covers served from different urls share their files. a
+  small index maps the source url's digest to that hash
+- the cache is kept under COVER_ART_MAX_BYTES by deleting the least recently used
+  thumbnails (a file's mtime is its last use); each worker tracks what it wrote and
+  scans the cache once its estimate goes over budget
+- thumbnail urls are absolute, COVER_ART_BASE_URL or else the origin the request reached
+  the api at, so a frontend served from another origin can load them
+- originals are only fetched from public addresses, redirects included, unless
+  COVER_ART_ALLOW_PRIVATE_SOURCES: a cover url can't make the server request its own
+  network (the addresses are checked, and the connection is made to a checked address,
+  so the host can't resolve somewhere else in between)
+- the source digest in the url changes with Song.cover_art_url, so responses are
+  immutable: a year of max-age, with the content hash as ETag
+- `manage.py warm_cover_art` renders the covers not cached yet ahead of the first request
+"""
+
+# pixels per side, 2x the css size the iPod UI draws them at (list row, now playing)
+THUMBNAIL_SIZES = {'small': 80, 'large': 320}
+DEFAULT_SIZE = 'large'
+THUMBNAIL_QUALITY = 85
+COVER_URL_PREFIX = '/api/covers/'
+# a cover url never changes content, its source digest changes instead
+COVER_MAX_AGE = 365 * 24 * 60 * 60
+FETCH_TIMEOUT = 5
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+# a cover that couldn't be fetched or decoded isn't retried for this long
+FAILED_TTL = 300
+FETCH_LOCK_TIMEOUT = 60
+# how long a request waits for another worker's fetch before fetching itself
+FETCH_WAIT = 10.0
+FETCH_POLL_INTERVAL = 0.1
+RENDER_TIMEOUT = 30
+# eviction stops at this share of the byte budget, so one scan makes room for many writes
+EVICT_TO = 0.9
+# a thumbnail's last use is written at most this often
+TOUCH_INTERVAL = 60
+WARM_FETCH_WORKERS = 8
+
+
+class CoverArtUnavailable(Exception):
+    """the cover couldn't be fetched or decoded"""
+
+
+def source_digest(url):
+    """short digest of a cover art url, e.g. '3f2a9c0d41b7e816'"""
+    return hashlib.blake2b(url.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def thumbnail_path(song_id, source, size=DEFAULT_SIZE):
+    """e.g. /api/covers/12/3f2a9c0d41b7e816/large.jpg"""
+    return f'{COVER_URL_PREFIX}{song_id}/{source_digest(source)}/{size}.jpg'
+
+
+def thumbnail_url(song_id, source, size=DEFAULT_SIZE, request=None):
+    """
+    - absolute url of a song's thumbnail, None without cover art
+    - e.g. http://localhost:8000/api/covers/12/3f2a9c0d41b7e816/large.jpg, on
+      COVER_ART_BASE_URL if set, else on the origin of request (path only without one)
+    """
+    if not source:
+        return source
+    path = thumbnail_path(song_id, source, size)
+    if settings.COVER_ART_BASE_URL:
+        return f'{settings.COVER_ART_BASE_URL}{path}'
+    return request.build_absolute_uri(path) if request is not None else path
+
+
+def source_for(value, instance):
+    """
+    - the cover art url to store for a written value: a song's own thumbnail url (a GET
+      sent back with PUT, on whichever origin) keeps its current original
+    """
+    if instance is not None and instance.cover_art_url and value and urlsplit(value).path in {
+        thumbnail_path(instance.pk, instance.cover_art_url, size) for size in THUMBNAIL_SIZES
+    }:
+        return instance.cover_art_url
+    return value
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _render_pool():
+    """this process's render pool, started on first use (so after any worker fork)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.COVER_ART_WORKERS, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _pool
+
+
+class CoverArtStore:
+    """
+    - thumbnails on disk, content addressed:
+      thumbs/ab/<sha256 of the original>_<size>.jpg
+      sources/3f/<source digest> -> the sha256 of what that url served
+    - files are written to a temporary name and renamed, so readers never see half a file
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # bytes in the cache as far as this process knows, None until the first scan
+        self._estimate = None
+
+    def _thumb_path(self, content_hash, size):
+        return self.root / 'thumbs' / content_hash[:2] / f'{content_hash}_{size}.jpg'
+
+    def _source_path(self, digest):
+        return self.root / 'sources' / digest[:2] / digest
+
+    def _write(self, path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f'.{path.name}.{uuid.uuid4().hex}')
+        temporary.write_bytes(data)
+        os.replace(temporary, path)
+
+    def lookup(self, digest):
+        """content hash a source url served, None if not cached"""
+        try:
+            return self._source_path(digest).read_text()
+        except OSError:
+            return None
+
+    def get(self, content_hash, size):
+        """path of a cached thumbnail, marked as used, None if not cached"""
+        path = self._thumb_path(content_hash, size)
+        try:
+            if time.time() - path.stat().st_mtime > TOUCH_INTERVAL:
+                os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, digest, content_hash, thumbnails):
+        """store a source's thumbnails, evicting old ones if that goes over budget"""
+        for size, data in thumbnails.items():
+            self._write(self._thumb_path(content_hash, size), data)
+        self._write(self._source_path(digest), content_hash.encode('ascii'))
+
+        with self._lock:
+            if self._estimate is None:
+                self._estimate = self.usage()
+            else:
+                self._estimate += sum(len(data) for data in thumbnails.values())
+            over = self._estimate > self.max_bytes
+        if over:
+            self.evict()
+
+    def _thumbnails(self):
+        """[(mtime, bytes, path)] of every cached thumbnail"""
+        files = []
+        for entry in (self.root / 'thumbs').glob('*/*.jpg'):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry))
+        return files
+
+    def usage(self):
+        """bytes of thumbnails on disk"""
+        return sum(size for _, size, _ in self._thumbnails())
+
+    def evict(self):
+        """delete least recently used thumbnails until the cache is under EVICT_TO of budget"""
+        files = sorted(self._thumbnails())
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * EVICT_TO
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+        with self._lock:
+            self._estimate = total
+        # source index entries are left behind; one that points at evicted thumbnails
+        # just makes the next request fetch the cover again
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None or _store.root != Path(settings.COVER_ART_ROOT):
+        _store = CoverArtStore(settings.COVER_ART_ROOT, settings.COVER_ART_MAX_BYTES)
+    return _store
+
+
+def check_source(url):
+    """
+    - the addresses url's host resolves to, e.g. ['93.184.216.34'], to connect to
+    - CoverArtUnavailable unless url is http(s) and every address is public (any address
+      with COVER_ART_ALLOW_PRIVATE_SOURCES)
+    - refuses loopback, private, link-local (cloud metadata) and reserved addresses
+    """
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError as e:
+        raise CoverArtUnavailable(url) from e
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise CoverArtUnavailable(url)
+    try:
+        addresses = list(dict.fromkeys(
+            info[4][0] for info in socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)
+        ))
+    except (OSError, UnicodeError) as e:
+        raise CoverArtUnavailable(url) from e
+    if not addresses:
+        raise CoverArtUnavailable(url)
+    if not settings.COVER_ART_ALLOW_PRIVATE_SOURCES and not all(
+            ipaddress.ip_address(address.split('%')[0]).is_global for address in addresses):
+        raise CoverArtUnavailable(url)
+    return addresses
+
+
+def _pinned_connection(connection_class):
+    """
+    - connection_class opening its socket to one of the checked addresses instead of
+      resolving the host again, so a DNS answer can't change between check and connect
+    - the host stays the url's: it's sent as the Host header, and https uses it for SNI
+      and certificate verification
+    """
+
+    class PinnedConnection(connection_class):
+        def __init__(self, host, addresses, **kwargs):
+            super().__init__(host, **kwargs)
+            self.addresses = addresses
+            self._create_connection = self._connect_pinned
+
+        def _connect_pinned(self, address, *args):
+            error = None
+            for pinned in self.addresses:
+                try:
+                    return socket.create_connection((pinned, address[1]), *args)
+                except OSError as e:
+                    error = e
+            raise error
+
+    PinnedConnection.__name__ = f'Pinned{connection_class.__name__}'
+    return PinnedConnection
+
+
+PinnedHTTPConnection = _pinned_connection(http.client.HTTPConnection)
+PinnedHTTPSConnection = _pinned_connection(http.client.HTTPSConnection)
+
+
+def _checked_addresses(req):
+    """the addresses check_source() accepted for a request, refused without them"""
+    addresses = getattr(req, 'checked_addresses', None)
+    if not addresses:
+        raise CoverArtUnavailable(req.full_url)
+    return addresses
+
+
+class PinnedHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(PinnedHTTPConnection, req, addresses=_checked_addresses(req))
+
+
+class PinnedHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(PinnedHTTPSConnection, req, context=self._context,
+                            addresses=_checked_addresses(req))
+
+
+class CheckedRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """follows a redirect only to a url check_source() accepts, pinned to its addresses"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        addresses = check_source(newurl)
+        redirect = super().redirect_request(req, fp, code, msg, headers, newurl)
+        if redirect is not None:
+            redirect.checked_addresses = addresses
+        return redirect
+
+
+# no proxies: a proxy would resolve the host itself
+_opener = urllib.request.build_opener(
+    urllib.request.ProxyHandler({}), PinnedHTTPHandler, PinnedHTTPSHandler, CheckedRedirectHandler
+)
+
+
+def fetch(url):
+    """the image at url, CoverArtUnavailable if it can't be downloaded or isn't public"""
+    request = urllib.request.Request(url, headers={'User-Agent': 'iPodify cover art'})
+    request.checked_addresses = check_source(url)
+    try:
+        with _opener.open(request, timeout=FETCH_TIMEOUT) as response:
+            data = response.read(MAX_SOURCE_BYTES + 1)
+    except (OSError, ValueError) as e:
+        raise CoverArtUnavailable(url) from e
+    if not data or len(data) > MAX_SOURCE_BYTES:
+        raise CoverArtUnavailable(url)
+    return data
+
+
+def _failed_key(digest):
+    return f'cover_art_failed_{digest}'
+
+
+def _cache_cover(source, data=None):
+    """fetch (unless data is given), render and store one cover, returns its content hash"""
+    digest = source_digest(source)
+    try:
+        if data is None:
+            data = fetch(source)
+        content_hash = hashlib.sha256(data).hexdigest()
+        store = get_store()
+        if not all(store.get(content_hash, size) for size in THUMBNAIL_SIZES):
+            thumbnails = _render_pool().submit(
+                render_thumbnails, data, THUMBNAIL_SIZES, THUMBNAIL_QUALITY
+            ).result(timeout=RENDER_TIMEOUT)
+        else:
+            # same image as a cover already cached under another url
+            thumbnails = {}
+        store.put(digest, content_hash, thumbnails)
+        return content_hash
+    except CoverArtUnavailable:
+        raise
+    except Exception as e:
+        # undecodable or oversized images, a broken pool
+        logger.warning('cover art %s could not be rendered: %s', source, e)
+        raise CoverArtUnavailable(source) from e
+
+
+def cached_thumbnail(source, size):
+    """
+    - (path, content hash) of a cover's thumbnail, fetching and rendering it on first use
+    - one worker fetches a given source at a time, the others wait up to FETCH_WAIT for it
+    - raises CoverArtUnavailable, remembered for FAILED_TTL
+    """
+    digest = source_digest(source)
+    store = get_store()
+    content_hash = store.lookup(digest)
+    path = store.get(content_hash, size) if content_hash else None
+    if path is not None:
+        return path, content_hash
+    if cache.get(_failed_key(digest)):
+        raise CoverArtUnavailable(source)
+
+    lock_key = f'cover_art_lock_{digest}'
+    token = uuid.uuid4().hex
+    if not cache.add(lock_key, token, FETCH_LOCK_TIMEOUT):
+        deadline = time.monotonic() + FETCH_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(FETCH_POLL_INTERVAL)
+            content_hash = store.lookup(digest)
+            path = store.get(content_hash, size) if content_hash else None
+            if path is not None:
+                return path, content_hash
+            if cache.get(_failed_key(digest)):
+                raise CoverArtUnavailable(source)
+    try:
+        content_hash = _cache_cover(source)
+    except CoverArtUnavailable:
+        cache.set(_failed_key(digest), True, FAILED_TTL)
+        raise
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+    return store.get(content_hash, size), content_hash
+
+
+def warm_cover_art(sources, log=None):
+    """
+    - cache every source not cached yet: fetched WARM_FETCH_WORKERS at a time, rendered in
+      the process pool
+    - returns (cached, failed) counts
+    """
+    store = get_store()
+    missing = list(dict.fromkeys(source for source in sources if source and not store.lookup(source_digest(source))))
+    cached = failed = 0
+
+    def warm(source):
+        try:
+            _cache_cover(source)
+            return True
+        except CoverArtUnavailable:
+            cache.set(_failed_key(source_digest(source)), True, FAILED_TTL)
+            return False
+
+    with ThreadPoolExecutor(max_workers=WARM_FETCH_WORKERS) as executor:
+        for ok in executor.map(warm, missing):
+            cached += ok
+            failed += not ok
+            if log is not None and (cached + failed) % 100 == 0:
+                log(f'{cached + failed} of {len(missing)} covers')
+    return cached, failed
+
+
+@require_safe
+def cover_art_view(request, song_id, digest, size):
+    """
+    - GET /api/covers/<song id>/<source digest>/<size>.jpg, a song's cover as a thumbnail
+    - open to anyone: <img> tags send no credentials, and covers are public images anyway
+    - a cached thumbnail is served straight from disk, no database query
+    - a url for a cover the song no longer has redirects to its current one
+    """
+    if size not in THUMBNAIL_SIZES:
+        raise Http404
+    store = get_store()
+    content_hash = store.lookup(digest)
+    path = store.get(content_hash, size) if content_hash else None
+    if path is None:
+        source = Song.objects.filter(pk=song_id).values_list('cover_art_url', flat=True).first()
+        if not source:
+            raise Http404
+        if source_digest(source) != digest:
+            return HttpResponseRedirect(thumbnail_url(song_id, source, size, request))
+        try:
+            path, content_hash = cached_thumbnail(source, size)
+        except CoverArtUnavailable:
+            raise Http404
+        if path is None:
+            raise Http404
+
+    etag = f'"{content_hash[:32]}-{size}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        try:
+            response = FileResponse(open(path, 'rb'), content_type='image/jpeg')
+        except OSError:
+            # evicted since the lookup
+            raise Http404
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=COVER_MAX_AGE, immutable=True)
+    return response
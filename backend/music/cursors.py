@@ -0,0 +1,54 @@
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
+
+from .utils import get_message
+
+"""
+- the opaque ?cursor= token of every paged endpoint (songs, playlists, smart playlists,
+  shuffle): a few short named fields, urlencoded then base64url encoded
+- e.g. {'r': 65536} <-> 'cj02NTUzNg=='
+- what the fields mean is up to the endpoint; a token that doesn't decode, or lacks a
+  field, is a 404 with errors.song.list.invalid_cursor everywhere
+"""
+
+CURSOR_QUERY_PARAM = 'cursor'
+
+
+def invalid_cursor():
+    """the exception every bad cursor raises"""
+    return NotFound(get_message('errors.song.list.invalid_cursor'))
+
+
+def encode_cursor(tokens):
+    """{field: value} -> opaque cursor string"""
+    querystring = parse.urlencode(tokens)
+    return b64encode(querystring.encode('ascii'), altchars=b'-_').decode('ascii')
+
+
+def decode_cursor(encoded, defaults=None, **fields):
+    """
+    - opaque cursor string -> {field: converted value}, e.g. decode_cursor(encoded, r=int)
+    - each keyword names a field and the callable converting it; a field missing from the
+      token takes its value from defaults, or makes the cursor invalid
+    """
+    defaults = defaults or {}
+    try:
+        querystring = b64decode(encoded.encode('ascii'), altchars=b'-_').decode('ascii')
+        tokens = parse.parse_qs(querystring, keep_blank_values=True)
+        return {
+            name: convert(tokens[name][0] if name in tokens else defaults[name])
+            for name, convert in fields.items()
+        }
+    except Exception:
+        raise invalid_cursor()
+
+
+def cursor_link(request, tokens, **params):
+    """absolute url of this request with ?cursor= set to tokens, and params replaced, e.g. seed"""
+    url = request.build_absolute_uri()
+    for name, value in params.items():
+        url = replace_query_param(url, name, value)
+    return replace_query_param(url, CURSOR_QUERY_PARAM, encode_cursor(tokens))
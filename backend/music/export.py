@@ -0,0 +1,71 @@
+import csv
+import json
+
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Song
+
+"""
+- streaming export of the song catalog as NDJSON or CSV
+- rows are read in keyset batches over the primary key (WHERE id > last ORDER BY id LIMIT n)
+  with values_list(), so memory stays flat no matter how large the catalog is and nothing
+  relies on server-side cursors (DISABLE_SERVER_SIDE_CURSORS is on for the pooled database)
+- shared by GET /songs/export/ and `manage.py export_songs`
+"""
+
+EXPORT_FIELDS = [field.attname for field in Song._meta.concrete_fields]
+EXPORT_BATCH_SIZE = 2000
+
+
+def iter_song_batches(queryset, batch_size=EXPORT_BATCH_SIZE):
+    """yield lists of EXPORT_FIELDS tuples, walking the primary key"""
+    queryset = queryset.order_by('id').values_list(*EXPORT_FIELDS)
+    last_id = None
+    while True:
+        batch = queryset if last_id is None else queryset.filter(id__gt=last_id)
+        rows = list(batch[:batch_size])
+        if not rows:
+            return
+        yield rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1][0]
+
+
+def stream_ndjson(queryset, batch_size=EXPORT_BATCH_SIZE):
+    """one JSON object per line, same field encoding as the API"""
+    encoder = JSONEncoder(ensure_ascii=False)
+    for rows in iter_song_batches(queryset, batch_size):
+        yield ''.join(encoder.encode(dict(zip(EXPORT_FIELDS, row))) + '\n' for row in rows)
+
+
+class _Echo:
+    """file-like object that hands back whatever csv.writer writes to it"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(queryset, batch_size=EXPORT_BATCH_SIZE):
+    """header row, then one row per song"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for rows in iter_song_batches(queryset, batch_size):
+        yield ''.join(writer.writerow(row) for row in rows)
+
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', stream_ndjson),
+    'csv': ('text/csv', stream_csv),
+}
+
+
+class ExportContentNegotiation(DefaultContentNegotiation):
+    """
+    - ?format= picks the export format on /songs/export/, not a DRF renderer
+    - always selects the first renderer, which is only used for error responses
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
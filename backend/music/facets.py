@@ -0,0 +1,155 @@
+from collections import Counter
+
+from django.db import connections, transaction
+from django.db.models import Count, Sum
+
+from .models import Song, SongFacet
+from .types import Decade, Genre
+
+"""
+- facet counts for the iPod browse menus: songs per genre, decade and year, plus the
+  total count and duration
+- filtered requests run one grouped aggregate (GROUP BY genre, decade, year); the result
+  is at most genres x years rows and is folded into the three facets in python
+- the unfiltered request reads the SongFacet rollup table instead, so the home screen
+  never scans music_song
+"""
+
+FACETS = ('genre', 'decade', 'year')
+# Song fields facet_state() reads
+FACET_FIELDS = frozenset((*FACETS, 'duration'))
+TOTAL = 'total'
+
+
+def facet_state(song):
+    """facet values and duration of a song, in the shape facet_deltas() expects"""
+    return {'genre': song.genre, 'decade': song.decade, 'year': song.year, 'duration': song.duration}
+
+
+def facet_deltas(before, after):
+    """
+    - counter changes for a song going from `before` to `after` (either may be None)
+    - returns {(facet, value): (count_delta, duration_delta)}, without zero entries
+    """
+    deltas = {}
+
+    def add(state, sign):
+        if state is None:
+            return
+        keys = [(facet, str(state[facet])) for facet in FACETS] + [(TOTAL, '')]
+        for key in keys:
+            count, duration = deltas.get(key, (0, 0))
+            deltas[key] = (count + sign, duration + sign * state['duration'])
+
+    add(before, -1)
+    add(after, 1)
+    return {key: delta for key, delta in deltas.items() if delta != (0, 0)}
+
+
+def apply_facet_deltas(deltas, using='default'):
+    """add deltas to the rollup table with one upsert statement"""
+    if not deltas:
+        return
+
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(SongFacet._meta.db_table)
+    placeholders = ', '.join(['(%s, %s, %s, %s)'] * len(deltas))
+    params = []
+    for (facet, value), (count, duration) in deltas.items():
+        params.extend([facet, value, count, duration])
+
+    # INSERT .. ON CONFLICT DO UPDATE works on both postgres and sqlite
+    sql = (
+        f"INSERT INTO {table} ({quote('facet')}, {quote('value')}, {quote('count')}, {quote('duration')}) "
+        f"VALUES {placeholders} "
+        f"ON CONFLICT ({quote('facet')}, {quote('value')}) DO UPDATE SET "
+        f"{quote('count')} = {table}.{quote('count')} + excluded.{quote('count')}, "
+        f"{quote('duration')} = {table}.{quote('duration')} + excluded.{quote('duration')}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def apply_facet_change(before, after, using='default'):
+    """update the rollups for one song changing from `before` to `after`"""
+    apply_facet_deltas(facet_deltas(before, after), using=using)
+
+
+def apply_facet_inserts(songs, using='default'):
+    """update the rollups for many newly inserted songs (bulk_create) in one statement"""
+    deltas = {}
+    for song in songs:
+        for key, (count, duration) in facet_deltas(None, facet_state(song)).items():
+            total_count, total_duration = deltas.get(key, (0, 0))
+            deltas[key] = (total_count + count, total_duration + duration)
+    apply_facet_deltas(deltas, using=using)
+
+
+def rebuild_facet_counts(using='default'):
+    """recompute the rollup table from music_song, e.g. after queryset.update()"""
+    rows = Song.objects.using(using).order_by().values(*FACETS).annotate(
+        count=Count('id'), duration=Sum('duration')
+    )
+    counts = {}
+    for row in rows:
+        for key in [(facet, str(row[facet])) for facet in FACETS] + [(TOTAL, '')]:
+            count, duration = counts.get(key, (0, 0))
+            counts[key] = (count + row['count'], duration + (row['duration'] or 0))
+
+    with transaction.atomic(using=using):
+        SongFacet.objects.using(using).all().delete()
+        SongFacet.objects.using(using).bulk_create([
+            SongFacet(facet=facet, value=value, count=count, duration=duration)
+            for (facet, value), (count, duration) in counts.items()
+        ])
+
+
+def _fold(rows):
+    """fold (genre, decade, year) groups into per-facet counts"""
+    facets = {facet: Counter() for facet in FACETS}
+    total_count = total_duration = 0
+    for row in rows:
+        for facet in FACETS:
+            facets[facet][str(row[facet])] += row['count']
+        total_count += row['count']
+        total_duration += row['duration'] or 0
+    return {**facets, 'count': total_count, 'duration': total_duration}
+
+
+def _ordered(facets):
+    """
+    - API shape: genres and decades in menu (choices) order, years ascending, zeros dropped
+    - e.g. {"genre": {"Rock": 12, ...}, "decade": {"80s": 7, ...}, "year": {"1985": 3, ...},
+      "count": 40, "duration": 9120}
+    """
+    order = {
+        'genre': Genre.values,
+        'decade': Decade.values,
+        'year': sorted(facets['year'], key=int),
+    }
+    result = {
+        facet: {value: facets[facet][value] for value in order[facet] if facets[facet].get(value)}
+        for facet in FACETS
+    }
+    result['count'] = facets['count']
+    result['duration'] = facets['duration']
+    return result
+
+
+def facet_counts(queryset):
+    """facets for a filtered queryset, from one grouped aggregate query"""
+    rows = queryset.order_by().values(*FACETS).annotate(count=Count('id'), duration=Sum('duration'))
+    return _ordered(_fold(rows))
+
+
+def rollup_facet_counts():
+    """facets for the whole library, from the SongFacet rollup table"""
+    facets = {facet: Counter() for facet in FACETS}
+    count = duration = 0
+    for row in SongFacet.objects.filter(count__gt=0).values('facet', 'value', 'count', 'duration'):
+        if row['facet'] == TOTAL:
+            count, duration = row['count'], row['duration']
+        elif row['facet'] in facets:
+            facets[row['facet']][row['value']] = row['count']
+    return _ordered({**facets, 'count': count, 'duration': duration})
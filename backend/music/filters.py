@@ -0,0 +1,29 @@
+from django_filters.rest_framework import FilterSet, CharFilter, NumberFilter
+
+from .models import Song
+from .search import search_songs
+
+
+class SongFilter(FilterSet):
+    """
+    - filter songs by various fields
+    - shared by the list endpoint and smart playlist definitions (see smart_playlists.py)
+    """
+    title = CharFilter(lookup_expr='icontains')
+    artist = CharFilter(lookup_expr='icontains')
+    genre = CharFilter(lookup_expr='exact')
+    decade = CharFilter(lookup_expr='exact')
+    year = NumberFilter()
+    year_min = NumberFilter(field_name='year', lookup_expr='gte')
+    year_max = NumberFilter(field_name='year', lookup_expr='lte')
+    duration_min = NumberFilter(field_name='duration', lookup_expr='gte')
+    duration_max = NumberFilter(field_name='duration', lookup_expr='lte')
+    q = CharFilter(method='filter_search')
+
+    def filter_search(self, queryset, name, value):
+        """ranked full-text search over title, artist and album, typo tolerant"""
+        return search_songs(queryset, value)
+
+    class Meta:
+        model = Song
+        fields = ['title', 'artist', 'genre', 'decade', 'year']
@@ -0,0 +1,161 @@
+import time
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from .caching import detail_cache_key, invalidate_song_lists
+from .facets import apply_facet_inserts
+from .local_cache import invalidate_song_details
+from .smart_playlists import add_new_songs
+from .models import Song
+from .serializers import SongBulkSerializer
+from .utils import get_message
+
+"""
+- bulk song ingestion for POST /songs/bulk/
+- rows are validated field-by-field in one pass without touching the database, then each
+  batch is checked for (title, artist) / (title, album) conflicts with a single query,
+  inserted with one bulk_create, the facet counters get one upsert and the list cache is
+  invalidated once
+"""
+
+BULK_MAX_ROWS = 5000
+BULK_BATCH_SIZE = 500
+
+
+def _first_error(errors):
+    """first error message of a serializer errors dict, same shape as the create endpoint"""
+    error_field = next(iter(errors.keys()))
+    error = errors[error_field]
+    return str(error[0] if isinstance(error, list) else error)
+
+
+def _row_error(index, message):
+    return {"index": index, "status": "error", "message": message}
+
+
+def _conflict_message(data, pairs_by_artist, pairs_by_album):
+    """uniqueness error for a row, or None if it is free to insert"""
+    if (data['title'], data['artist']) in pairs_by_artist:
+        return get_message('errors.song.validation.unique.artist', title=data['title'], artist=data['artist'])
+    if (data['title'], data['album']) in pairs_by_album:
+        return get_message('errors.song.validation.unique.album', title=data['title'], album=data['album'])
+    return None
+
+
+def _existing_pairs(batch):
+    """
+    - (title, artist) and (title, album) pairs already in the database for this batch
+    - one query, served by the unique indexes that both start with title
+    """
+    titles = {data['title'] for _, data in batch}
+    artists = {data['artist'] for _, data in batch}
+    albums = {data['album'] for _, data in batch}
+    rows = Song.objects.filter(title__in=titles).filter(
+        Q(artist__in=artists) | Q(album__in=albums)
+    ).values_list('title', 'artist', 'album')
+
+    pairs_by_artist, pairs_by_album = set(), set()
+    for title, artist, album in rows:
+        pairs_by_artist.add((title, artist))
+        pairs_by_album.add((title, album))
+    return pairs_by_artist, pairs_by_album
+
+
+def _insert_batch(batch, results):
+    """
+    - insert one conflict-free batch with bulk_create
+    - if a concurrent writer took one of the pairs in the meantime, retry the batch row by
+      row so only the conflicting rows fail
+    """
+    # bulk_create bypasses Song.save(), so decade is filled in here
+    songs = [Song(**data, decade=Song.get_decade_from_year(data['year'])) for _, data in batch]
+    try:
+        with transaction.atomic():
+            Song.objects.bulk_create(songs)
+            # bulk_create also skips the facet counters and smart playlists, one pass each
+            apply_facet_inserts(songs)
+            add_new_songs(songs)
+    except IntegrityError:
+        songs = []
+        for index, data in batch:
+            song = Song(**data)
+            try:
+                with transaction.atomic():
+                    song.save()
+            except IntegrityError:
+                message = _conflict_message(data, *_existing_pairs([(index, data)]))
+                results[index] = _row_error(index, message or get_message('errors.song.create.failed'))
+                continue
+            results[index] = {"index": index, "status": "created", "id": song.pk}
+            songs.append(song)
+        return len(songs)
+
+    for (index, _), song in zip(batch, songs):
+        results[index] = {"index": index, "status": "created", "id": song.pk}
+    return len(songs)
+
+
+def bulk_create_songs(rows, batch_size=BULK_BATCH_SIZE):
+    """
+    - validate and insert a list of song dicts
+    - returns (results, summary): one result per input row, in input order, and totals
+      with throughput, e.g.
+      {"received": 1000, "created": 998, "failed": 2, "batches": 2,
+       "duration_ms": 210.4, "rows_per_second": 4752.6}
+    """
+    started = time.perf_counter()
+    results = [None] * len(rows)
+
+    # field validation for every row, no queries
+    valid = []
+    for index, row in enumerate(rows):
+        serializer = SongBulkSerializer(data=row)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = _row_error(index, _first_error(serializer.errors))
+
+    created = 0
+    batches = 0
+    seen_by_artist, seen_by_album = set(), set()  # pairs claimed by earlier rows of this payload
+    for start in range(0, len(valid), batch_size):
+        batch = valid[start:start + batch_size]
+        existing_by_artist, existing_by_album = _existing_pairs(batch)
+        pairs_by_artist = existing_by_artist | seen_by_artist
+        pairs_by_album = existing_by_album | seen_by_album
+
+        insertable = []
+        for index, data in batch:
+            message = _conflict_message(data, pairs_by_artist, pairs_by_album)
+            if message:
+                results[index] = _row_error(index, message)
+                continue
+            pairs_by_artist.add((data['title'], data['artist']))
+            pairs_by_album.add((data['title'], data['album']))
+            seen_by_artist.add((data['title'], data['artist']))
+            seen_by_album.add((data['title'], data['album']))
+            insertable.append((index, data))
+
+        if not insertable:
+            continue
+
+        created += _insert_batch(insertable, results)
+        batches += 1
+        invalidate_song_lists()
+        # new ids may have been cached as missing
+        invalidate_song_details(*(
+            detail_cache_key(results[index]['id'])
+            for index, _ in insertable if results[index]['status'] == 'created'
+        ))
+
+    duration = time.perf_counter() - started
+    summary = {
+        "received": len(rows),
+        "created": created,
+        "failed": len(rows) - created,
+        "batches": batches,
+        "duration_ms": round(duration * 1000, 1),
+        "rows_per_second": round(len(rows) / duration, 1) if duration > 0 else None,
+    }
+    return results, summary
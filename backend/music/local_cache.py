@@ -0,0 +1,188 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from .metrics import metrics, timed_invalidation
+from .timing import record_local_lookup
+
+logger = logging.getLogger(__name__)
+
+"""
+- in-process tier in front of redis for song detail responses
+- the few hundred songs that take most of the traffic are served from worker memory with
+  no network round trip; everything else falls through to redis, then postgres
+- bounded LRU with a short ttl, so memory stays flat and a missed invalidation can only
+  serve a stale song for LOCAL_TTL seconds
+- writes publish the changed keys on a redis pub/sub channel, a daemon thread in every
+  worker listens and drops them from its local tier, typically within milliseconds
+"""
+
+LOCAL_MAX_ENTRIES = 1000
+LOCAL_TTL = 30
+INVALIDATION_CHANNEL = 'songs_detail_invalidations'
+LISTENER_POLL_TIMEOUT = 1.0
+# pause before resubscribing after the pub/sub connection drops
+LISTENER_RETRY_DELAY = 1.0
+
+MISSING = object()
+
+
+class LocalCache:
+    """
+    - thread-safe LRU with per-entry expiry, e.g. LocalCache(max_entries=1000, ttl=30)
+    - get() returns MISSING rather than None, so None can be cached (negative entries)
+    - hit/miss counters are per process; a named cache also reports them to /metrics
+    """
+
+    def __init__(self, max_entries=LOCAL_MAX_ENTRIES, ttl=LOCAL_TTL, name=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                value = entry[0]
+            else:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                value = MISSING
+        record_local_lookup(value is not MISSING)
+        if self.name is not None:
+            metrics.inc('songs_cache_requests_total', family=self.name,
+                        result='hit' if value is not MISSING else 'miss')
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """e.g. {"hits": 950, "misses": 50, "hit_ratio": 0.95, "size": 212}"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "size": len(self._entries),
+            }
+
+
+song_details = LocalCache(name='song_detail_local')
+
+_listener_lock = threading.Lock()
+_listener_pid = None
+
+
+def _redis_connection():
+    """raw redis client behind the default cache, None for non-redis backends"""
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def _subscribe(connection):
+    pubsub = connection.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(INVALIDATION_CHANNEL)
+    return pubsub
+
+
+def _listen(connection, pubsub):
+    """drop published keys from this worker's local tier, resubscribing if the connection drops"""
+    while True:
+        try:
+            while True:
+                # polls rather than listen(), which would trip the pool's SOCKET_TIMEOUT when idle
+                message = pubsub.get_message(timeout=LISTENER_POLL_TIMEOUT)
+                if message is None:
+                    continue
+                data = message['data']
+                if isinstance(data, bytes):
+                    data = data.decode('utf-8')
+                song_details.delete(*data.split(','))
+        except Exception:
+            logger.warning('song detail invalidation listener disconnected', exc_info=True)
+        time.sleep(LISTENER_RETRY_DELAY)
+        try:
+            pubsub = _subscribe(connection)
+        except Exception:
+            continue
+        # anything published while we were not subscribed is lost, start clean
+        song_details.clear()
+
+
+def invalidation_listener_started():
+    """whether this process already has its listener, a cheap check that never touches redis"""
+    return _listener_pid == os.getpid()
+
+
+def start_invalidation_listener():
+    """
+    - start this process's listener thread, once; called lazily from the read path
+    - blocks on the redis SUBSCRIBE round trip, so async callers run it in a thread
+    - per pid, so a worker forked from a parent that already had one starts its own
+    - without a redis cache backend there is nothing to listen to and local entries
+      simply expire after LOCAL_TTL
+    """
+    global _listener_pid
+    if invalidation_listener_started():
+        return
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        connection = _redis_connection()
+        if connection is not None:
+            # subscribed before returning, so nothing cached from here on can miss a message
+            try:
+                pubsub = _subscribe(connection)
+            except Exception:
+                # redis is down, the read path will fail over on its own; retry next request
+                logger.warning('song detail invalidation listener could not subscribe', exc_info=True)
+                return
+            thread = threading.Thread(
+                target=_listen, args=(connection, pubsub), name='song-detail-invalidations', daemon=True
+            )
+            thread.start()
+        _listener_pid = os.getpid()
+
+
+def invalidate_song_details(*keys):
+    """drop detail entries from redis, this worker's local tier and every other worker's"""
+    keys = [str(key) for key in keys]
+    if not keys:
+        return
+    with timed_invalidation('song_detail'):
+        song_details.delete(*keys)
+        cache.delete_many(keys)
+        connection = _redis_connection()
+        if connection is not None:
+            connection.publish(INVALIDATION_CHANNEL, ','.join(keys))
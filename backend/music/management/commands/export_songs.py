@@ -0,0 +1,60 @@
+import resource
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from music.export import EXPORT_BATCH_SIZE, EXPORT_FORMATS
+from music.models import Song
+
+
+class Command(BaseCommand):
+    """
+    - stream the song catalog to a file or stdout: manage.py export_songs --format csv -o songs.csv
+    - same keyset-batched reader as GET /api/songs/export/, so memory stays flat
+    - --stats reports rows, bytes, time to first byte and peak memory on stderr
+    """
+    help = 'Export all songs as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('-o', '--output', help='file to write to (default: stdout)')
+        parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+        parser.add_argument('--stats', action='store_true', help='print export measurements to stderr')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive')
+
+        _, streamer = EXPORT_FORMATS[options['format']]
+        if options['output']:
+            output = open(options['output'], 'w', newline='', encoding='utf-8')
+            write = output.write
+        else:
+            output = None
+            write = lambda chunk: self.stdout.write(chunk, ending='')  # noqa: E731
+
+        started = time.perf_counter()
+        first_chunk_at = None
+        written = 0
+        try:
+            for chunk in streamer(Song.objects.all(), batch_size=options['batch_size']):
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                write(chunk)
+                written += len(chunk.encode('utf-8'))
+        finally:
+            if output is not None:
+                output.close()
+
+        if options['stats']:
+            elapsed = time.perf_counter() - started
+            # ru_maxrss is kilobytes on linux, bytes on macos
+            peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if sys.platform == 'darwin':
+                peak_kb //= 1024
+            self.stderr.write(
+                f"songs={Song.objects.count()} bytes={written} "
+                f"ttfb_ms={((first_chunk_at or time.perf_counter()) - started) * 1000:.1f} "
+                f"total_ms={elapsed * 1000:.1f} peak_rss_kb={peak_kb}"
+            )
@@ -0,0 +1,42 @@
+import os
+import socket
+
+from django.core.management.base import BaseCommand, CommandError
+
+from music.local_cache import _redis_connection
+from music.plays import FLUSH_BATCH_SIZE, flush
+
+
+class Command(BaseCommand):
+    """
+    - write buffered play events (POST /api/plays/) to the database, see music/plays.py
+    - runs until stopped; run several for more throughput, each takes its own batches
+    - --once writes what is buffered right now and exits, e.g. from cron
+    """
+    help = 'Write buffered play events to the database in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='drain the buffer and exit')
+        parser.add_argument('--batch-size', type=int, default=FLUSH_BATCH_SIZE)
+        parser.add_argument('--block', type=int, default=1000, help='ms to wait for new events')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive')
+        if _redis_connection() is None:
+            raise CommandError('play events are only buffered with a redis cache backend, nothing to flush')
+
+        consumer = f'{socket.gethostname()}-{os.getpid()}'
+        block_ms = None if options['once'] else options['block']
+        total = 0
+        try:
+            while True:
+                taken = flush(consumer, count=options['batch_size'], block_ms=block_ms)
+                total += taken
+                if taken and options['verbosity'] > 1:
+                    self.stdout.write(f'Flushed {taken} play events')
+                if options['once'] and not taken:
+                    break
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Flushed {total} play events'))
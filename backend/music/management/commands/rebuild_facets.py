@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from music.facets import rebuild_facet_counts
+from music.models import SongFacet
+
+
+class Command(BaseCommand):
+    """
+    - recompute the SongFacet rollups behind GET /api/songs/facets/ from music_song
+    - needed after writes that bypass Song.save(), e.g. queryset.update() or raw sql
+    """
+    help = 'Rebuild the genre/decade/year facet counters'
+
+    def handle(self, *args, **options):
+        rebuild_facet_counts()
+        total = SongFacet.objects.filter(facet='total').values_list('count', flat=True).first() or 0
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt facet counts for {total} songs'))
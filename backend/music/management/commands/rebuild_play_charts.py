@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from music.charts import rebuild_play_charts
+from music.models import PlayRollup
+
+
+class Command(BaseCommand):
+    """
+    - recompute the PlayRollup table behind the play charts from music_playevent and
+      reload the live charts in redis, see music/charts.py
+    - needed after editing play events by hand, or if a flusher died between writing a
+      batch and updating redis
+    """
+    help = 'Rebuild the play chart rollups from the play events'
+
+    def handle(self, *args, **options):
+        rebuild_play_charts()
+        buckets = PlayRollup.objects.count()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt play charts from {buckets} rollup rows'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from music.smart_playlists import rebuild_smart_playlists
+
+
+class Command(BaseCommand):
+    """
+    - re-materialize every smart playlist from its saved filters
+    - needed after writes that bypass Song.save(), e.g. queryset.update() or raw sql
+    """
+    help = 'Rebuild the materialized smart playlist memberships'
+
+    def handle(self, *args, **options):
+        counts = rebuild_smart_playlists()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {len(counts)} smart playlists ({sum(counts.values())} memberships)'
+        ))
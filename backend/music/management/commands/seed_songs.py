@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from music.seeding import SEED_BATCH_SIZE, seed_songs
+
+
+class Command(BaseCommand):
+    """
+    - add synthetic songs for load testing: manage.py seed_songs --count 1000000
+    - bypasses Song.save(): COPY on postgres, batched inserts on sqlite, see music/seeding.py
+    - the same --seed on the same database gives the same catalog
+    """
+    help = 'Generate N realistic synthetic songs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, required=True)
+        parser.add_argument('--batch-size', type=int, default=SEED_BATCH_SIZE)
+        parser.add_argument('--seed', type=int, default=0, help='random seed for the generated data')
+
+    def handle(self, *args, **options):
+        if options['count'] <= 0:
+            raise CommandError('--count must be positive')
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive')
+
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        inserted = seed_songs(options['count'], batch_size=options['batch_size'], seed=options['seed'], log=log)
+        skipped = options['count'] - inserted
+        message = f'Seeded {inserted} songs'
+        if skipped:
+            message += f' ({skipped} skipped, they clashed with existing songs)'
+        self.stdout.write(self.style.SUCCESS(message))
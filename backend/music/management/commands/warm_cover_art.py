@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from music.cover_art import warm_cover_art
+from music.models import Song
+
+
+class Command(BaseCommand):
+    """
+    - fetch and resize every song's cover art that isn't in the thumbnail cache yet, so
+      the first request for a cover doesn't wait for it, see music/cover_art.py
+    - covers are fetched in threads and resized in the cover art process pool
+    """
+    help = 'Render the cover art thumbnails ahead of the first request'
+
+    def handle(self, *args, **options):
+        sources = Song.objects.exclude(cover_art_url__isnull=True).exclude(cover_art_url='').values_list(
+            'cover_art_url', flat=True
+        ).iterator()
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        cached, failed = warm_cover_art(sources, log=log)
+        message = f'Cached {cached} covers'
+        if failed:
+            message += f' ({failed} could not be fetched or decoded)'
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,344 @@
+import bisect
+import os
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound
+
+"""
+- prometheus metrics for the song api, served as text at GET /metrics
+- request latency per SongViewSet action, cache hits/misses per key family, cache
+  invalidation counts and durations, database connections opened and in use, queries,
+  throttle decisions,
+  play event buffering and flushing
+- multiprocess safe without prometheus_client: each worker adds up its observations in
+  memory and flushes them to one redis hash (HINCRBY / HINCRBYFLOAT in a pipeline) at most
+  every METRICS_FLUSH_INTERVAL seconds, so every worker (and every host sharing the redis)
+  adds into the same series; /metrics renders that hash
+- recording is a dict update under a lock, no network round trip; a worker's last
+  METRICS_FLUSH_INTERVAL seconds show up on its next request or scrape
+- without a redis cache backend the numbers are this process's only
+- gauges (e.g. the play event buffer depth) are not recorded but read when /metrics is
+  scraped, from the collector registered with register_gauge()
+"""
+
+METRICS_KEY = 'songs_metrics'
+METRICS_FLUSH_INTERVAL = 1.0
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+INVALIDATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+FLUSH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'songs_request_duration_seconds': (
+        'histogram', 'Song API request latency by viewset action and status code', LATENCY_BUCKETS,
+    ),
+    'songs_cache_requests_total': (
+        'counter', 'Song response cache lookups by key family and result', None,
+    ),
+    'songs_cache_invalidations_total': (
+        'counter', 'Song response cache invalidations by key family', None,
+    ),
+    'songs_cache_invalidation_duration_seconds': (
+        'histogram', 'Time spent invalidating song response caches', INVALIDATION_BUCKETS,
+    ),
+    'songs_db_connections_opened_total': (
+        'counter', 'Database connections opened', None,
+    ),
+    'songs_db_connections_in_use': (
+        'gauge', 'Connections to the database running a query or holding a transaction open', None,
+    ),
+    'songs_db_queries_total': (
+        'counter', 'SQL queries executed', None,
+    ),
+    'songs_db_query_duration_seconds_total': (
+        'counter', 'Total time spent executing SQL', None,
+    ),
+    'songs_throttle_decisions_total': (
+        'counter', 'Throttle decisions by scope and outcome', None,
+    ),
+    'songs_play_events_received_total': (
+        'counter', 'Play events accepted into the buffer', None,
+    ),
+    'songs_play_events_rejected_total': (
+        'counter', 'Play events turned away, by reason', None,
+    ),
+    'songs_play_events_flushed_total': (
+        'counter', 'Buffered play events written to the database', None,
+    ),
+    'songs_play_events_dropped_total': (
+        'counter', 'Buffered play events discarded at flush, by reason', None,
+    ),
+    'songs_play_event_flush_duration_seconds': (
+        'histogram', 'Time to write one batch of play events', FLUSH_BUCKETS,
+    ),
+    'songs_play_events_buffered': (
+        'gauge', 'Play events in the buffer, not yet written to the database', None,
+    ),
+    'songs_play_events_pending': (
+        'gauge', 'Buffered play events handed to a flusher but not yet acknowledged', None,
+    ),
+    'songs_play_events_flush_lag_seconds': (
+        'gauge', 'Age of the oldest play event not yet written to the database', None,
+    ),
+}
+
+# gauge name: callable returning its current value (or None to leave it out)
+_gauges = {}
+
+
+def _labels(labels):
+    """{'action': 'list'} -> 'action="list"' (label values are ours, never user input)"""
+    return ','.join(f'{name}="{value}"' for name, value in labels)
+
+
+class MetricsBuffer:
+    """this process's observations since the last flush, as {redis hash field: increment}"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = defaultdict(int)
+        self._last_flush = time.monotonic()
+        self._pid = os.getpid()
+
+    def _add(self, field, amount):
+        with self._lock:
+            if self._pid != os.getpid():
+                # forked after recording (gunicorn preload), the parent's numbers are not ours
+                self._values.clear()
+                self._pid = os.getpid()
+            self._values[field] += amount
+        if time.monotonic() - self._last_flush >= METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def inc(self, name, amount=1, **labels):
+        self._add(f'{name}|{_labels(sorted(labels.items()))}', amount)
+
+    def observe(self, name, value, **labels):
+        """histogram observation, counted in the first bucket it fits (cumulated at render)"""
+        buckets = METRICS[name][2]
+        index = bisect.bisect_left(buckets, value)
+        le = repr(buckets[index]) if index < len(buckets) else '+Inf'
+        base = sorted(labels.items())
+        self._add(f'{name}_bucket|{_labels([*base, ("le", le)])}', 1)
+        self._add(f'{name}_sum|{_labels(base)}', value)
+        self._add(f'{name}_count|{_labels(base)}', 1)
+
+    def flush(self):
+        """add this process's numbers into the shared hash"""
+        with self._lock:
+            values, self._values = self._values, defaultdict(int)
+            self._last_flush = time.monotonic()
+        if not values:
+            return
+        connection = _redis_connection()
+        if connection is None:
+            # no shared store, keep accumulating in process
+            for field, amount in values.items():
+                _process_totals[field] += amount
+            return
+        try:
+            pipeline = connection.pipeline(transaction=False)
+            key = cache.make_key(METRICS_KEY)
+            for field, amount in values.items():
+                if isinstance(amount, float):
+                    pipeline.hincrbyfloat(key, field, amount)
+                else:
+                    pipeline.hincrby(key, field, amount)
+            pipeline.execute()
+        except Exception:
+            # metrics must never fail a request; the numbers wait for the next flush
+            with self._lock:
+                for field, amount in values.items():
+                    self._values[field] += amount
+
+    def snapshot(self):
+        """every worker's totals, {field: value}"""
+        self.flush()
+        connection = _redis_connection()
+        if connection is None:
+            return dict(_process_totals)
+        return {
+            field.decode('utf-8'): float(value)
+            for field, value in connection.hgetall(cache.make_key(METRICS_KEY)).items()
+        }
+
+
+metrics = MetricsBuffer()
+# totals when there is no redis to flush to
+_process_totals = defaultdict(int)
+
+
+def _redis_connection():
+    from .local_cache import _redis_connection  # local_cache records into this module
+    return _redis_connection()
+
+
+def register_gauge(name, collect):
+    """read gauge `name` from collect() at every scrape"""
+    _gauges[name] = collect
+
+
+def collect_gauges():
+    """{field: value} of every registered gauge; a failing collector is left out"""
+    values = {}
+    for name, collect in _gauges.items():
+        try:
+            value = collect()
+        except Exception:
+            continue
+        if value is not None:
+            values[f'{name}|'] = value
+    return values
+
+
+def _format(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_metrics(values):
+    """prometheus text exposition of {field: value}"""
+    series = defaultdict(list)
+    for field, value in values.items():
+        name, _, labels = field.partition('|')
+        series[name].append((labels, value))
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind in ('counter', 'gauge'):
+            for labels, value in sorted(series.get(name, ())):
+                lines.append(f'{name}{{{labels}}} {_format(value)}' if labels else f'{name} {_format(value)}')
+            continue
+
+        # histogram buckets are stored per bucket, exposed cumulatively
+        bounds = [repr(bound) for bound in buckets] + ['+Inf']
+        counts = defaultdict(dict)
+        for labels, value in series.get(f'{name}_bucket', ()):
+            base, _, le = labels.rpartition('le=')
+            counts[base.rstrip(',')][le.strip('"')] = value
+        sums = dict(series.get(f'{name}_sum', ()))
+        totals = dict(series.get(f'{name}_count', ()))
+        for base in sorted(counts):
+            cumulative = 0
+            prefix = f'{base},' if base else ''
+            for bound in bounds:
+                cumulative += counts[base].get(bound, 0)
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {_format(cumulative)}')
+            braces = f'{{{base}}}' if base else ''
+            lines.append(f'{name}_sum{braces} {_format(sums.get(base, 0))}')
+            lines.append(f'{name}_count{braces} {_format(totals.get(base, 0))}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    - GET /metrics, for the prometheus scraper
+    - requires `Authorization: Bearer <METRICS_TOKEN>`; without a token configured it is a
+      404, except with DEBUG on where it is open for local use
+    """
+    token = settings.METRICS_TOKEN
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponseNotFound()
+    elif request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden()
+    values = metrics.snapshot()
+    values.update(collect_gauges())
+    return HttpResponse(render_metrics(values), content_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+    """latency of every SongViewSet (or other viewset) request, labelled by action"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def _observe(request, response, started):
+        match = request.resolver_match
+        # router views carry their {method: action} map, the async read views copy it
+        actions = getattr(match.func, 'actions', None) if match is not None else None
+        if actions:
+            metrics.observe(
+                'songs_request_duration_seconds',
+                time.perf_counter() - started,
+                action=actions.get(request.method.lower(), request.method.lower()),
+                status=response.status_code,
+            )
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        return self._observe(request, self.get_response(request), started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        return self._observe(request, await self.get_response(request), started)
+
+
+def metered_execute(execute, sql, params, many, context):
+    """database execute wrapper counting queries and their time, for every request"""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.inc('songs_db_queries_total')
+        metrics.inc('songs_db_query_duration_seconds_total', time.perf_counter() - started)
+
+
+def install_db_metrics(sender, connection, **kwargs):
+    """connection_created receiver"""
+    metrics.inc('songs_db_connections_opened_total', vendor=connection.vendor)
+    if metered_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metered_execute)
+
+
+class timed_invalidation:
+    """count and time a cache invalidation, e.g. with timed_invalidation('songs_list'): ..."""
+    __slots__ = ('family', 'started')
+
+    def __init__(self, family):
+        self.family = family
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        metrics.inc('songs_cache_invalidations_total', family=self.family)
+        metrics.observe('songs_cache_invalidation_duration_seconds', time.perf_counter() - self.started,
+                        family=self.family)
+
+
+def db_connections_in_use():
+    """
+    - songs_db_connections_in_use: backends on our database that are not idle, from
+      pg_stat_activity, so it covers every worker and host; the scrape's own is left out
+    - None (left out) on other databases, which have no such view
+    """
+    from django.db import connection
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM pg_stat_activity "
+            "WHERE datname = current_database() AND state <> 'idle' AND pid <> pg_backend_pid()"
+        )
+        return cursor.fetchone()[0]
+
+
+register_gauge('songs_db_connections_in_use', db_connections_in_use)
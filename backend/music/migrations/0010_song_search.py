@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def install_search(apps, schema_editor):
+    from music.search import install_search
+    install_search(schema_editor.connection)
+
+
+def uninstall_search(apps, schema_editor):
+    from music.search import uninstall_search
+    uninstall_search(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+    """
+    - postgres: pg_trgm, generated search_vector column and GIN indexes
+    - sqlite: FTS5 trigram shadow table plus sync triggers
+    - see music/search.py for the statements
+    """
+
+    dependencies = [
+        ('music', '0009_song_song_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search, uninstall_search),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:26
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def build_facet_counts(apps, schema_editor):
+    """fill the rollup table from the songs already in the library"""
+    Song = apps.get_model('music', 'Song')
+    SongFacet = apps.get_model('music', 'SongFacet')
+    using = schema_editor.connection.alias
+
+    counts = {}
+    rows = Song.objects.using(using).order_by().values('genre', 'decade', 'year').annotate(
+        count=Count('id'), duration=Sum('duration')
+    )
+    for row in rows:
+        keys = [('genre', row['genre']), ('decade', row['decade']), ('year', str(row['year'])), ('total', '')]
+        for key in keys:
+            count, duration = counts.get(key, (0, 0))
+            counts[key] = (count + row['count'], duration + (row['duration'] or 0))
+
+    SongFacet.objects.using(using).bulk_create([
+        SongFacet(facet=facet, value=value, count=count, duration=duration)
+        for (facet, value), (count, duration) in counts.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0011_song_updated_at_datetime'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(max_length=10)),
+                ('value', models.CharField(blank=True, max_length=20)),
+                ('count', models.BigIntegerField(default=0)),
+                ('duration', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('facet', 'value')},
+            },
+        ),
+        migrations.RunPython(build_facet_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+from music.operations import AddIndexConcurrentlyIfSupported
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('music', '0012_songfacet'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyIfSupported(
+            model_name='song',
+            index=models.Index(fields=['genre', '-created_at', '-id'], name='song_genre_created_idx'),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='song',
+            index=models.Index(fields=['decade', '-created_at', '-id'], name='song_decade_created_idx'),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='song',
+            index=models.Index(fields=['year', '-created_at', '-id'], name='song_year_created_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0014_playlist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmartPlaylist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('filters', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SmartPlaylistSong',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('smart_playlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='music.smartplaylist')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='smart_playlist_memberships', to='music.song')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('smart_playlist', 'song'), name='smart_playlist_song_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0016_playevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('plays', models.BigIntegerField(default=0)),
+                ('seconds', models.BigIntegerField(default=0)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='music.song')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('bucket', 'start', 'song'), name='play_rollup_bucket_song_uniq')],
+            },
+        ),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, router, transaction
 from .types import Decade, Genre
 
 class Song(models.Model):
@@ -21,7 +22,7 @@ class Song(models.Model):
         default=Genre.POP
     )
     created_at = models.DateField(auto_now_add=True)
-    updated_at = models.DateField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True)  # precise, it versions ETags
 
     @classmethod
     def get_decade_from_year(cls, year):
@@ -41,10 +42,52 @@ class Song(models.Model):
         else:
             return Decade.TWENTIES_TWO  # default to current decade if year is out of range
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """remember the facet values as loaded, so save() knows what it changes without re-reading the row"""
+        from .facets import FACET_FIELDS, facet_state
+
+        instance = super().from_db(db, field_names, values)
+        if FACET_FIELDS.issubset(field_names):
+            instance._loaded_facets = facet_state(instance)
+        return instance
+
     def save(self, *args, **kwargs):
-        """override save to automatically set decade based on year"""
+        """
+        - override save to automatically set decade based on year
+        - keeps the SongFacet rollup counters in step, in the same transaction
+        - a save that moves no facet value (compared with what this instance was loaded
+          with) leaves the facet columns out of the UPDATE: no extra query, and even a stale
+          copy can't move them behind the counters' back
+        - a save that does move one reads the old values under a row lock first, so two
+          concurrent writers moving the same song each see the other's change
+        """
+        from .facets import FACET_FIELDS, apply_facet_change, facet_state
+
         self.decade = Song.get_decade_from_year(self.year)  # call the class method directly
-        super().save(*args, **kwargs)
+        using = kwargs.get('using') or router.db_for_write(Song, instance=self)
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic(using=using):
+            track, previous = True, None
+            if not self._state.adding and self.pk is not None:
+                loaded = getattr(self, '_loaded_facets', None)
+                if update_fields is not None and FACET_FIELDS.isdisjoint(update_fields):
+                    track = False
+                elif update_fields is None and loaded is not None and loaded == facet_state(self):
+                    kwargs['update_fields'] = [
+                        field.name for field in self._meta.concrete_fields
+                        if not field.primary_key and field.name not in FACET_FIELDS
+                    ]
+                    track = False
+                else:
+                    previous = Song.objects.using(using).select_for_update().filter(pk=self.pk).values(
+                        'genre', 'decade', 'year', 'duration'
+                    ).first()
+            super().save(*args, **kwargs)
+            if track:
+                apply_facet_change(previous, facet_state(self), using=using)
+        if track:
+            self._loaded_facets = facet_state(self)
 
     class Meta:
         ordering = ['-created_at']
@@ -52,6 +95,162 @@ class Song(models.Model):
             ('title', 'artist'),  # primary group constraint
             ('title', 'album')    # secondary group constraint
         ]
+        indexes = [
+            # keyset pagination walks this index, see pagination.SongCursorPagination
+            models.Index(fields=['-created_at', '-id'], name='song_created_id_idx'),
+            # one per SongFilter equality filter, each followed by the list ordering so an
+            # equality-filtered page is a single index range read with no sort step; a year
+            # range seeks song_year_created_idx but still sorts the matching rows (they come
+            # out ordered by year first), and an open-ended range may walk song_created_id_idx
+            # (title/artist/?q= are served by the search indexes, see search.py)
+            models.Index(fields=['genre', '-created_at', '-id'], name='song_genre_created_idx'),
+            models.Index(fields=['decade', '-created_at', '-id'], name='song_decade_created_idx'),
+            models.Index(fields=['year', '-created_at', '-id'], name='song_year_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.title} - {self.artist}"
+
+
+class SongFacet(models.Model):
+    """
+    - rollup counters behind the unfiltered GET /songs/facets/, one row per (facet, value)
+      e.g. ('genre', 'Rock'), ('decade', '80s'), ('year', '1985'), plus ('total', '')
+    - kept in step by Song.save, the post_delete signal and bulk ingestion; queryset
+      .update() bypasses them, run `manage.py rebuild_facets` after raw bulk edits
+    """
+    facet = models.CharField(max_length=10)
+    value = models.CharField(max_length=20, blank=True)
+    count = models.BigIntegerField(default=0)
+    duration = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('facet', 'value')]
+
+    def __str__(self):
+        return f"{self.facet}={self.value}: {self.count}"
+
+
+
+class Playlist(models.Model):
+    """
+    - an ordered list of songs, e.g. the iPod "Playlists" menu
+    - the order lives in PlaylistEntry.rank, see playlists.py
+    """
+    name = models.CharField(max_length=100)
+    description = models.CharField(max_length=1000, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+
+    def __str__(self):
+        return self.name
+
+
+class PlaylistEntry(models.Model):
+    """
+    - one song at one position of a playlist, the same song can appear more than once
+    - rank orders the entries: sparse integers with gaps, so an insert or a move writes
+      only the entry itself (see playlists.ranks_between)
+    """
+    playlist = models.ForeignKey(Playlist, on_delete=models.CASCADE, related_name='entries')
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='playlist_entries')
+    rank = models.BigIntegerField()
+    added_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['playlist', 'rank']
+        constraints = [
+            # also the index a playlist page is read from, a keyset range scan on rank
+            models.UniqueConstraint(fields=['playlist', 'rank'], name='playlist_entry_rank_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.playlist_id}@{self.rank}: {self.song_id}"
+
+
+class SmartPlaylist(models.Model):
+    """
+    - a saved SongFilter query, e.g. "80s Rock" = {"decade": "80s", "genre": "Rock"}
+    - its songs are materialized in SmartPlaylistSong and kept up to date per song write
+      (see smart_playlists.py), reading one is an index range scan
+    """
+    name = models.CharField(max_length=100)
+    # canonical SongFilter params, values as the list endpoint would receive them
+    filters = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+
+    def __str__(self):
+        return self.name
+
+
+class SmartPlaylistSong(models.Model):
+    """one song matching one smart playlist's filters"""
+    smart_playlist = models.ForeignKey(SmartPlaylist, on_delete=models.CASCADE, related_name='members')
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='smart_playlist_memberships')
+
+    class Meta:
+        constraints = [
+            # also the index smart playlist pages are read from, newest song first
+            models.UniqueConstraint(fields=['smart_playlist', 'song'], name='smart_playlist_song_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.smart_playlist_id}: {self.song_id}"
+
+
+class PlayEvent(models.Model):
+    """
+    - one play of a song from the iPod UI
+    - written behind the request: POST /plays/ buffers events in redis and
+      `manage.py flush_play_events` inserts them in batches (see plays.py)
+    - event_id is the client's (or the api's) id for the event, a redelivered batch
+      inserts nothing twice
+    """
+    event_id = models.UUIDField(unique=True)
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='plays')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    played_at = models.DateTimeField()
+    seconds_played = models.PositiveIntegerField()
+    recorded_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['song', 'played_at'], name='play_song_played_idx'),
+            models.Index(fields=['played_at'], name='play_played_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.song_id} @ {self.played_at}"
+
+
+class PlayRollup(models.Model):
+    """
+    - plays and listening seconds of a song per hour and per day (UTC), one row per
+      (bucket, start, song), e.g. ('hour', 2024-01-01 12:00, 7)
+    - added to by every play event flush, so charts never aggregate music_playevent;
+      `manage.py rebuild_play_charts` recomputes them from the events
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    BUCKET_CHOICES = [(HOUR, 'Hour'), (DAY, 'Day')]
+
+    bucket = models.CharField(max_length=4, choices=BUCKET_CHOICES)
+    start = models.DateTimeField()
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='+')
+    plays = models.BigIntegerField(default=0)
+    seconds = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bucket', 'start', 'song'], name='play_rollup_bucket_song_uniq'),
+        ]
 
     def __str__(self):
-        return f"{self.title} - {self.artist}"
\ No newline at end of file
+        return f"{self.song_id} {self.bucket} {self.start}: {self.plays}"
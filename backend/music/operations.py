@@ -0,0 +1,26 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db.migrations.operations import AddIndex
+
+"""
+- migration operations shared by the music migrations
+"""
+
+
+class AddIndexConcurrentlyIfSupported(AddIndexConcurrently):
+    """
+    - CREATE INDEX CONCURRENTLY on postgres, so adding an index never locks music_song
+      against writes while it builds
+    - a plain CREATE INDEX on other backends (the sqlite dev database), which have no
+      concurrent variant
+    - the migration must set atomic = False
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        return AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        return AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
@@ -0,0 +1,139 @@
+from django.db.models import Q
+from rest_framework.pagination import BasePagination
+from rest_framework.utils.urls import remove_query_param
+
+from .cursors import CURSOR_QUERY_PARAM, cursor_link, decode_cursor, invalid_cursor
+from .models import Song
+
+
+class SongCursorPagination(BasePagination):
+    """
+    - keyset (cursor) pagination over (created_at, id), newest first
+    - each page is one range scan on the (created_at, id) index, so page 1 and
+      page 50,000 cost the same: no OFFSET and no COUNT(*)
+    - the cursor is an opaque token holding the (created_at, id) of the row the
+      page starts after, plus a flag for walking backwards
+    - only applied when the client asks for it with ?cursor= or ?page_size=,
+      otherwise the list endpoint keeps returning the full result set
+    """
+    page_size = 10
+    max_page_size = 100
+    cursor_query_param = CURSOR_QUERY_PARAM
+    page_size_query_param = 'page_size'
+    ordering = ('-created_at', '-id')
+
+    def is_requested(self, request):
+        """whether the client opted into paginated results"""
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_page_size(self, request):
+        """page size from ?page_size=, clamped to max_page_size"""
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        queryset, position = self.get_page_queryset(queryset, request)
+        return self.set_page(list(queryset), position)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset for the async read path, the page is fetched with the async orm"""
+        if not self.is_requested(request):
+            return None
+        queryset, position = self.get_page_queryset(queryset, request)
+        return self.set_page([item async for item in queryset], position)
+
+    def get_page_queryset(self, queryset, request):
+        """(queryset for the requested page plus one extra row, decoded cursor position)"""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        self.reverse = bool(position and position[2])
+
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            created_at, pk, _ = position
+            if self.reverse:
+                queryset = queryset.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+                ).order_by('created_at', 'id')
+            else:
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+                )
+
+        # fetch one extra row to find out if there is another page without counting
+        return queryset[:self.page_size + 1], position
+
+    def set_page(self, results, position):
+        """trim the fetched rows to the page and work out the next/previous links"""
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if self.reverse:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = results
+        return results
+
+    def get_position(self, item):
+        """(created_at, id) of a page item, a Song or a .values() row"""
+        if isinstance(item, dict):
+            return item['created_at'], item['id']
+        return item.created_at, item.pk
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        created_at, pk = self.get_position(self.page[-1])
+        return self.encode_cursor(created_at, pk, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            # walked past the end, step back to the start of the list
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        created_at, pk = self.get_position(self.page[0])
+        return self.encode_cursor(created_at, pk, reverse=True)
+
+    def get_pagination_data(self):
+        """pagination block for the response envelope"""
+        return {
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "page_size": self.page_size,
+        }
+
+    def decode_cursor(self, request):
+        """decode ?cursor= into (created_at, id, reverse), or None for the first page"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        tokens = decode_cursor(
+            encoded, defaults={'r': '0'},
+            c=Song._meta.get_field('created_at').to_python, p=int, r=lambda flag: flag == '1',
+        )
+        if tokens['c'] is None:
+            raise invalid_cursor()
+        return tokens['c'], tokens['p'], tokens['r']
+
+    def encode_cursor(self, created_at, pk, reverse):
+        """encode a keyset position into an absolute url for the next/previous page"""
+        tokens = {'c': created_at.isoformat(), 'p': str(pk)}
+        if reverse:
+            tokens['r'] = '1'
+        return cursor_link(self.request, tokens)
@@ -0,0 +1,156 @@
+from django.db import transaction
+from django.db.models import F, Max, Min
+
+from .cursors import cursor_link, decode_cursor
+from .models import Playlist, PlaylistEntry
+from .serializers import song_read_serializer
+
+"""
+- playlist order as sparse integer ranks: entries are RANK_GAP apart when appended, an
+  insert or move takes a rank between its two neighbours, so it writes one row no matter
+  how long the playlist is
+- when two neighbours are out of room (after ~16 moves into the same spot) the playlist
+  is rebalanced: every entry renumbered RANK_GAP apart, in one transaction. rare, and
+  the only O(n) write
+- writers of one playlist are serialized by locking its Playlist row
+- a page of entries is one query: the (playlist, rank) index range after the cursor's
+  rank, joined to music_song, read as .values() rows
+"""
+
+RANK_GAP = 1 << 16
+# most songs one append can add
+APPEND_MAX_SONGS = 5000
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+SONG_FIELDS = [f'song__{name}' for name in song_read_serializer.field_names]
+
+
+class NoRoom(Exception):
+    """no free ranks left between two neighbours"""
+
+
+def ranks_between(lower, upper, count):
+    """
+    - count increasing ranks strictly between lower and upper (None: open ended)
+    - e.g. ranks_between(0, None, 2) -> [65536, 131072]; raises NoRoom when they don't fit
+    """
+    if lower is None and upper is None:
+        return [RANK_GAP * (index + 1) for index in range(count)]
+    if upper is None:
+        return [lower + RANK_GAP * (index + 1) for index in range(count)]
+    if lower is None:
+        return [upper - RANK_GAP * (count - index) for index in range(count)]
+    step = (upper - lower) // (count + 1)
+    if step < 1:
+        raise NoRoom
+    return [lower + step * (index + 1) for index in range(count)]
+
+
+def rebalance(playlist_id):
+    """renumber every entry RANK_GAP apart, keeping the order"""
+    entries = PlaylistEntry.objects.filter(playlist_id=playlist_id)
+    bounds = entries.aggregate(low=Min('rank'), high=Max('rank'))
+    if bounds['low'] is None:
+        return
+    # the unique index is checked row by row, so first move every rank below both the
+    # current ranks and the new (positive) ones, then write the new ranks
+    entries.update(rank=F('rank') - (bounds['high'] - min(bounds['low'], 0) + 1))
+    renumbered = [
+        PlaylistEntry(pk=pk, rank=position * RANK_GAP)
+        for position, pk in enumerate(entries.order_by('rank').values_list('id', flat=True), start=1)
+    ]
+    PlaylistEntry.objects.bulk_update(renumbered, ['rank'], batch_size=1000)
+
+
+def _neighbours(playlist_id, after=None, before=None, exclude=None):
+    """
+    - (lower, upper) ranks of the slot right after entry `after` or right before entry
+      `before`; neither means the end of the playlist
+    - raises PlaylistEntry.DoesNotExist for an anchor entry not in this playlist
+    """
+    entries = PlaylistEntry.objects.filter(playlist_id=playlist_id)
+    if exclude is not None:
+        entries = entries.exclude(pk=exclude)
+    if after is not None:
+        lower = entries.get(pk=after).rank
+        upper = entries.filter(rank__gt=lower).aggregate(rank=Min('rank'))['rank']
+    elif before is not None:
+        upper = entries.get(pk=before).rank
+        lower = entries.filter(rank__lt=upper).aggregate(rank=Max('rank'))['rank']
+    else:
+        lower, upper = entries.aggregate(rank=Max('rank'))['rank'], None
+    return lower, upper
+
+
+def _lock(playlist_id):
+    """lock the playlist row for the rest of the transaction, Playlist.DoesNotExist if gone"""
+    Playlist.objects.select_for_update().only('id').get(pk=playlist_id)
+
+
+def add_songs(playlist_id, song_ids, after=None, before=None):
+    """
+    - insert songs (in the order given) after entry `after`, before entry `before`, or at
+      the end; one bulk INSERT whatever the count
+    - returns the new entries
+    """
+    with transaction.atomic():
+        _lock(playlist_id)
+        lower, upper = _neighbours(playlist_id, after, before)
+        try:
+            ranks = ranks_between(lower, upper, len(song_ids))
+        except NoRoom:
+            rebalance(playlist_id)
+            lower, upper = _neighbours(playlist_id, after, before)
+            ranks = ranks_between(lower, upper, len(song_ids))
+        entries = PlaylistEntry.objects.bulk_create([
+            PlaylistEntry(playlist_id=playlist_id, song_id=song_id, rank=rank)
+            for song_id, rank in zip(song_ids, ranks)
+        ])
+    return entries
+
+
+def move_entry(playlist_id, entry_id, after=None, before=None):
+    """
+    - move one entry right after entry `after`, right before entry `before`, or to the end
+    - a single UPDATE of the moved row, unless the slot has to be rebalanced first
+    """
+    with transaction.atomic():
+        _lock(playlist_id)
+        entry = PlaylistEntry.objects.get(playlist_id=playlist_id, pk=entry_id)
+        lower, upper = _neighbours(playlist_id, after, before, exclude=entry_id)
+        try:
+            (rank,) = ranks_between(lower, upper, 1)
+        except NoRoom:
+            rebalance(playlist_id)
+            lower, upper = _neighbours(playlist_id, after, before, exclude=entry_id)
+            (rank,) = ranks_between(lower, upper, 1)
+        PlaylistEntry.objects.filter(pk=entry.pk).update(rank=rank)
+        entry.rank = rank
+    return entry
+
+
+def entry_rows(playlist_id, after_rank=None, limit=PAGE_SIZE, request=None):
+    """
+    - up to limit entries of a playlist after after_rank, in order, in one joined query
+    - e.g. [{'id': 7, 'rank': 65536, 'added_at': ..., 'song': {...}}, ...]
+    """
+    entries = PlaylistEntry.objects.filter(playlist_id=playlist_id)
+    if after_rank is not None:
+        entries = entries.filter(rank__gt=after_rank)
+    rows = list(entries.order_by('rank').values('id', 'rank', 'added_at', *SONG_FIELDS)[:limit])
+    songs = song_read_serializer.serialize(
+        [{name: row.pop(f'song__{name}') for name in song_read_serializer.field_names} for row in rows], request
+    )
+    for row, song in zip(rows, songs):
+        row['song'] = song
+    return rows
+
+
+def decode_after_cursor(encoded):
+    """?cursor= of a playlist or smart playlist page -> the rank / song id it starts after"""
+    return decode_cursor(encoded, r=int)['r']
+
+
+def after_page_link(request, rank):
+    """absolute url of the page after rank (a smart playlist's: after that song id)"""
+    return cursor_link(request, {'r': rank})
@@ -0,0 +1,301 @@
+import logging
+import time
+import uuid
+from datetime import timedelta, timezone as dt_timezone
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from redis.exceptions import ResponseError
+
+from .charts import record_plays
+from .local_cache import _redis_connection
+from .metrics import metrics, register_gauge
+from .models import PlayEvent, Song
+
+logger = logging.getLogger(__name__)
+
+"""
+- write-behind play events: POST /plays/ validates the events without touching the
+  database, appends them to a redis stream (XADD, one pipelined round trip) and answers
+  202 straight away
+- `manage.py flush_play_events` drains the stream through a consumer group in batches of
+  FLUSH_BATCH_SIZE: one bulk INSERT per batch, then XACK + XDEL
+- at-least-once: a flusher that dies between the insert and the ack leaves its batch
+  pending, and the next flusher claims it once it has been idle for CLAIM_IDLE_MS. the
+  unique event_id makes the replay a no-op (INSERT ... ON CONFLICT DO NOTHING), and only
+  the rows an insert RETURNs reach the rollups and charts, so two flushers writing the
+  same batch count each play once
+- backpressure: with PLAY_BUFFER_MAX events waiting, new events are turned away with a
+  503 rather than growing redis without bound. /metrics reports the buffer depth, the
+  unacknowledged events and the age of the oldest unwritten event (flush lag)
+- without a redis cache backend there is no buffer and events are inserted directly
+"""
+
+PLAY_STREAM = 'play_events'
+PLAY_GROUP = 'play_event_flushers'
+# most events one POST /plays/ can carry
+PLAY_BATCH_MAX = 500
+# buffered events before new ones are refused
+PLAY_BUFFER_MAX = 1_000_000
+FLUSH_BATCH_SIZE = 5000
+# a batch taken by a flusher and not acknowledged for this long is handed to another one
+CLAIM_IDLE_MS = 60_000
+# longest play we believe, a day
+MAX_SECONDS_PLAYED = 86_400
+# oldest played_at accepted, e.g. plays synced from a device that was offline for a while
+PLAYED_AT_MAX_AGE = timedelta(days=90)
+# how far ahead of our clock a client's played_at may be
+PLAYED_AT_MAX_SKEW = timedelta(minutes=5)
+
+
+class BufferFull(Exception):
+    """the play event buffer is at PLAY_BUFFER_MAX"""
+
+
+def parse_event(data, user_id=None):
+    """
+    - a validated play event from request data, raises ValueError with the bad field
+    - e.g. {"song": 12, "seconds_played": 180, "played_at": "2024-01-01T12:00:00Z"}
+      (played_at defaults to now, event_id to a new uuid)
+    - played_at must be within PLAYED_AT_MAX_AGE before now and PLAYED_AT_MAX_SKEW after,
+      so a bad client clock can't put plays into long-gone or future chart windows
+    """
+    if not isinstance(data, dict):
+        raise ValueError('event')
+    song = data.get('song')
+    if not isinstance(song, int) or isinstance(song, bool) or song <= 0:
+        raise ValueError('song')
+    seconds = data.get('seconds_played')
+    if not isinstance(seconds, int) or isinstance(seconds, bool) or not 0 <= seconds <= MAX_SECONDS_PLAYED:
+        raise ValueError('seconds_played')
+    played_at = data.get('played_at')
+    now = timezone.now()
+    if played_at is None:
+        played_at = now
+    else:
+        played_at = parse_datetime(played_at) if isinstance(played_at, str) else None
+        if played_at is None:
+            raise ValueError('played_at')
+        if timezone.is_naive(played_at):
+            played_at = timezone.make_aware(played_at, dt_timezone.utc)
+        if not now - PLAYED_AT_MAX_AGE <= played_at <= now + PLAYED_AT_MAX_SKEW:
+            raise ValueError('played_at')
+    try:
+        event_id = uuid.UUID(str(data['event_id'])) if data.get('event_id') is not None else uuid.uuid4()
+    except ValueError:
+        raise ValueError('event_id')
+    return {
+        'event_id': event_id,
+        'song_id': song,
+        'user_id': user_id,
+        'played_at': played_at,
+        'seconds_played': seconds,
+    }
+
+
+def _stream_key():
+    return cache.make_key(PLAY_STREAM)
+
+
+def _encode(event):
+    """stream entry fields of an event"""
+    return {
+        'e': event['event_id'].hex,
+        's': event['song_id'],
+        'u': event['user_id'] or '',
+        'p': event['played_at'].isoformat(),
+        'd': event['seconds_played'],
+    }
+
+
+def _decode(fields):
+    """event from stream entry fields, None if unreadable"""
+    try:
+        fields = {key.decode(): value.decode() for key, value in fields.items()}
+        return {
+            'event_id': uuid.UUID(fields['e']),
+            'song_id': int(fields['s']),
+            'user_id': int(fields['u']) if fields['u'] else None,
+            'played_at': parse_datetime(fields['p']),
+            'seconds_played': int(fields['d']),
+        }
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+def enqueue(events):
+    """buffer validated events, returns how many; BufferFull when the buffer is full"""
+    connection = _redis_connection()
+    if connection is None:
+        write_events(events)
+        metrics.inc('songs_play_events_received_total', len(events))
+        return len(events)
+
+    stream = _stream_key()
+    if connection.xlen(stream) >= PLAY_BUFFER_MAX:
+        metrics.inc('songs_play_events_rejected_total', len(events), reason='buffer_full')
+        raise BufferFull
+    pipeline = connection.pipeline(transaction=False)
+    for event in events:
+        pipeline.xadd(stream, _encode(event))
+    pipeline.execute()
+    metrics.inc('songs_play_events_received_total', len(events))
+    return len(events)
+
+
+def insert_events(events, using='default'):
+    """
+    - INSERT .. ON CONFLICT (event_id) DO NOTHING RETURNING event_id, one statement per
+      FLUSH_BATCH_SIZE; works on both postgres and sqlite (3.35+)
+    - returns the ids of the events this call inserted: an event already stored, or stored
+      by another flusher in the meantime, is not among them
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(PlayEvent._meta.db_table)
+    fields = [
+        PlayEvent._meta.get_field(name)
+        for name in ('event_id', 'song', 'user', 'played_at', 'seconds_played', 'recorded_at')
+    ]
+    event_id = quote(fields[0].column)
+    recorded_at = timezone.now()
+    inserted = set()
+    for offset in range(0, len(events), FLUSH_BATCH_SIZE):
+        chunk = events[offset:offset + FLUSH_BATCH_SIZE]
+        params = []
+        for event in chunk:
+            values = (
+                event['event_id'], event['song_id'], event['user_id'], event['played_at'],
+                event['seconds_played'], recorded_at,
+            )
+            params.extend(field.get_db_prep_save(value, connection) for field, value in zip(fields, values))
+        row = f"({', '.join(['%s'] * len(fields))})"
+        sql = (
+            f"INSERT INTO {table} ({', '.join(quote(field.column) for field in fields)}) "
+            f"VALUES {', '.join([row] * len(chunk))} "
+            f"ON CONFLICT ({event_id}) DO NOTHING RETURNING {event_id}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            inserted.update(fields[0].to_python(value) for value, in cursor.fetchall())
+    return inserted
+
+
+def write_events(events):
+    """
+    - insert events, skipping event ids already stored
+    - events for songs deleted since they were buffered are dropped, deleted users cleared
+    - the events actually inserted are added to the play charts in the same transaction
+      (see charts.py); a replayed or concurrently flushed event never counts twice
+    - returns how many events were inserted
+    """
+    events = list({event['event_id']: event for event in events}.values())
+    song_ids = {event['song_id'] for event in events}
+    existing_songs = {
+        pk: (artist, genre, decade)
+        for pk, artist, genre, decade in Song.objects.filter(pk__in=song_ids).values_list(
+            'pk', 'artist', 'genre', 'decade'
+        )
+    }
+    user_ids = {event['user_id'] for event in events if event['user_id'] is not None}
+    existing_users = set(
+        get_user_model().objects.filter(pk__in=user_ids).values_list('pk', flat=True)
+    ) if user_ids else set()
+
+    kept = [
+        {**event, 'user_id': event['user_id'] if event['user_id'] in existing_users else None}
+        for event in events if event['song_id'] in existing_songs
+    ]
+    if len(kept) < len(events):
+        metrics.inc('songs_play_events_dropped_total', len(events) - len(kept), reason='song_deleted')
+    with transaction.atomic():
+        inserted = insert_events(kept)
+        # retries, replayed batches and a racing flusher's rows are someone else's to count
+        fresh = [event for event in kept if event['event_id'] in inserted]
+        record_plays(fresh, existing_songs)
+    if len(fresh) < len(kept):
+        metrics.inc('songs_play_events_dropped_total', len(kept) - len(fresh), reason='duplicate')
+    return len(fresh)
+
+
+def _ensure_group(connection, stream):
+    try:
+        connection.xgroup_create(stream, PLAY_GROUP, id='0', mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def flush(consumer, count=FLUSH_BATCH_SIZE, block_ms=None):
+    """
+    - write one batch of buffered events, returns how many entries it took off the buffer
+    - a batch another flusher left unacknowledged for CLAIM_IDLE_MS comes first
+    """
+    connection = _redis_connection()
+    if connection is None:
+        return 0
+    stream = _stream_key()
+    _ensure_group(connection, stream)
+
+    _, entries, *_ = connection.xautoclaim(stream, PLAY_GROUP, consumer, CLAIM_IDLE_MS, '0-0', count=count)
+    if not entries:
+        response = connection.xreadgroup(PLAY_GROUP, consumer, {stream: '>'}, count=count, block=block_ms)
+        entries = response[0][1] if response else []
+    # entries deleted while pending come back without fields
+    entries = [(entry_id, fields) for entry_id, fields in entries if fields]
+    if not entries:
+        return 0
+
+    started = time.perf_counter()
+    events = [_decode(fields) for _, fields in entries]
+    malformed = sum(event is None for event in events)
+    if malformed:
+        logger.warning('dropping %d unreadable play events', malformed)
+        metrics.inc('songs_play_events_dropped_total', malformed, reason='malformed')
+    written = write_events([event for event in events if event is not None])
+
+    # only now is the batch safe to forget; a crash before this line replays it
+    entry_ids = [entry_id for entry_id, _ in entries]
+    pipeline = connection.pipeline(transaction=False)
+    pipeline.xack(stream, PLAY_GROUP, *entry_ids)
+    pipeline.xdel(stream, *entry_ids)
+    pipeline.execute()
+    metrics.inc('songs_play_events_flushed_total', written)
+    metrics.observe('songs_play_event_flush_duration_seconds', time.perf_counter() - started)
+    return len(entries)
+
+
+def buffer_depth():
+    connection = _redis_connection()
+    return connection.xlen(_stream_key()) if connection is not None else None
+
+
+def pending_count():
+    connection = _redis_connection()
+    if connection is None:
+        return None
+    try:
+        return connection.xpending(_stream_key(), PLAY_GROUP)['pending']
+    except ResponseError:
+        # no flusher has run yet, so no group
+        return 0
+
+
+def flush_lag():
+    """seconds since the oldest buffered event was accepted, 0 with an empty buffer"""
+    connection = _redis_connection()
+    if connection is None:
+        return None
+    oldest = connection.xrange(_stream_key(), count=1)
+    if not oldest:
+        return 0
+    accepted_ms = int(oldest[0][0].split(b'-')[0])
+    return max(time.time() - accepted_ms / 1000, 0.0)
+
+
+register_gauge('songs_play_events_buffered', buffer_depth)
+register_gauge('songs_play_events_pending', pending_count)
+register_gauge('songs_play_events_flush_lag_seconds', flush_lag)
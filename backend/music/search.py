@@ -0,0 +1,210 @@
+import re
+
+from django.contrib.postgres.lookups import TrigramSimilar
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVectorExact,
+    SearchVectorField,
+    TrigramSimilarity,
+)
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest, Upper
+
+from .models import Song
+
+"""
+- full-text + fuzzy search for songs, backing ?q= on the list endpoint
+- postgres: a stored, generated `search_vector` tsvector column (title > artist > album)
+  with a GIN index, plus pg_trgm GIN indexes on UPPER(title) / UPPER(artist) for typos
+  (those trigram indexes also serve the existing ?title= / ?artist= icontains filters)
+- sqlite (local testing): an FTS5 shadow table using the trigram tokenizer, kept in sync
+  with triggers and ranked with bm25
+- the schema lives in migration 0010_song_search, not in Song.Meta, since none of it is
+  portable between the two backends
+"""
+
+SEARCH_QUERY_PARAM = 'q'
+SEARCH_RESULT_LIMIT = 50  # search is ranked by relevance, so only the best matches are returned
+
+FTS_TABLE = 'music_song_fts'
+FTS_COLUMN_WEIGHTS = (10.0, 5.0, 1.0)  # title, artist, album
+
+POSTGRES_SEARCH_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    ALTER TABLE music_song ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple'::regconfig, coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple'::regconfig, coalesce(artist, '')), 'B') ||
+        setweight(to_tsvector('simple'::regconfig, coalesce(album, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS song_search_vector_idx ON music_song USING GIN (search_vector)",
+    "CREATE INDEX IF NOT EXISTS song_title_trgm_idx ON music_song USING GIN (UPPER(title) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS song_artist_trgm_idx ON music_song USING GIN (UPPER(artist) gin_trgm_ops)",
+]
+
+POSTGRES_DROP_SEARCH_SQL = [
+    "DROP INDEX IF EXISTS song_artist_trgm_idx",
+    "DROP INDEX IF EXISTS song_title_trgm_idx",
+    "DROP INDEX IF EXISTS song_search_vector_idx",
+    "ALTER TABLE music_song DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_SEARCH_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, artist, album,
+        content='music_song', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON music_song BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, artist, album)
+        VALUES (new.id, new.title, new.artist, new.album);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON music_song BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, artist, album)
+        VALUES ('delete', old.id, old.title, old.artist, old.album);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON music_song BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, artist, album)
+        VALUES ('delete', old.id, old.title, old.artist, old.album);
+        INSERT INTO {FTS_TABLE}(rowid, title, artist, album)
+        VALUES (new.id, new.title, new.artist, new.album);
+    END
+    """,
+]
+
+SQLITE_DROP_SEARCH_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def install_search(connection):
+    """
+    - create (or repair) the search schema for this connection's backend
+    - idempotent: also run after every migrate, because sqlite drops the FTS triggers
+      whenever a later migration rebuilds the music_song table
+    """
+    if connection.vendor == 'postgresql':
+        statements = POSTGRES_SEARCH_SQL
+    elif connection.vendor == 'sqlite':
+        statements = SQLITE_SEARCH_SQL
+    else:
+        return
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+                [f'{FTS_TABLE}_%'],
+            )
+            needs_rebuild = cursor.fetchone()[0] < 3
+        for statement in statements:
+            cursor.execute(statement)
+        if connection.vendor == 'sqlite' and needs_rebuild:
+            # triggers were missing, so the shadow table may have drifted from music_song
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def uninstall_search(connection):
+    """drop the search schema for this connection's backend"""
+    if connection.vendor == 'postgresql':
+        statements = POSTGRES_DROP_SEARCH_SQL
+    elif connection.vendor == 'sqlite':
+        statements = SQLITE_DROP_SEARCH_SQL
+    else:
+        return
+
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def is_search_request(request):
+    """whether the request carries a non-blank ?q="""
+    return bool(request.query_params.get(SEARCH_QUERY_PARAM, '').strip())
+
+
+def search_songs(queryset, query):
+    """
+    - filter a song queryset down to matches for `query`, best matches first
+    - annotates `search_rank` (higher is better)
+    - tolerates typos through trigram similarity on both backends
+    """
+    query = ' '.join(query.split())
+    if not query:
+        return queryset
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        queryset = _postgres_search(queryset, query)
+    elif vendor == 'sqlite':
+        queryset = _sqlite_search(queryset, query)
+    else:
+        queryset = _fallback_search(queryset, query)
+
+    return queryset.order_by('-search_rank', '-created_at', '-id')
+
+
+def _postgres_search(queryset, query):
+    """tsvector prefix match OR trigram similarity, both served by GIN indexes"""
+    upper = query.upper()
+    words = re.findall(r'\w+', query.lower())
+
+    title_similarity = TrigramSimilarity(Upper('title'), Value(upper))
+    artist_similarity = TrigramSimilarity(Upper('artist'), Value(upper))
+    # `%` is the indexable form of similarity() > pg_trgm.similarity_threshold
+    matches = Q(TrigramSimilar(Upper('title'), Value(upper))) | Q(TrigramSimilar(Upper('artist'), Value(upper)))
+    rank = Greatest(title_similarity, artist_similarity)
+
+    if words:
+        # prefix-match every word so partial input from the search box matches
+        tsquery = SearchQuery(' & '.join(f'{word}:*' for word in words), config='simple', search_type='raw')
+        vector = RawSQL(
+            f'{Song._meta.db_table}.search_vector', [], output_field=SearchVectorField()
+        )
+        matches |= Q(SearchVectorExact(vector, tsquery))
+        rank = SearchRank(vector, tsquery) + rank
+
+    return queryset.filter(matches).annotate(search_rank=rank)
+
+
+def _sqlite_search(queryset, query):
+    """
+    - match any trigram of the query against the FTS5 trigram index
+    - bm25 rewards rows sharing more trigrams, so near-misses rank below exact hits
+    - the shadow table is joined in, so MATCH runs once per query; bm25 in a correlated
+      subquery re-ran it for every candidate row, seconds per search at 10k songs
+    """
+    grams = {query.lower()[i:i + 3] for i in range(len(query) - 2)}
+    if not grams:
+        # the trigram tokenizer cannot match anything shorter than three characters
+        return _fallback_search(queryset, query)
+
+    match = ' OR '.join('"{}"'.format(gram.replace('"', '""')) for gram in sorted(grams))
+    weights = ', '.join(str(weight) for weight in FTS_COLUMN_WEIGHTS)
+    table = Song._meta.db_table
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f"{FTS_TABLE}.rowid = {table}.id", f"{FTS_TABLE} MATCH %s"],
+        params=[match],
+    ).annotate(search_rank=RawSQL(f"-bm25({FTS_TABLE}, {weights})", [], output_field=FloatField()))
+
+
+def _fallback_search(queryset, query):
+    """substring match without ranking, for very short queries or other backends"""
+    return queryset.filter(
+        Q(title__icontains=query) | Q(artist__icontains=query)
+    ).annotate(search_rank=Value(0.0, output_field=FloatField()))
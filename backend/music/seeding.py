@@ -0,0 +1,256 @@
+import io
+import random
+import string
+import time
+
+from django.db import connection, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from .caching import invalidate_song_lists
+from .facets import rebuild_facet_counts
+from .smart_playlists import rebuild_smart_playlists
+from .models import Song
+from .search import FTS_TABLE, install_search
+from .types import Genre
+
+"""
+- synthetic song catalogs for load testing: manage.py seed_songs --count 1000000
+- rows are generated a batch at a time from a seeded random.Random, column by column
+  (rng.choices(..., k=batch) for genres/years/durations, decade through a year -> decade
+  table), never through Song() instances or Song.save()
+- every title is unique, so (title, artist) and (title, album) are too; the odd clash with
+  a hand-entered song is skipped, not an error
+- postgres loads with COPY into a temp table and one INSERT ... SELECT ... ON CONFLICT
+  DO NOTHING per batch, sqlite with one executemany per batch
+- numbering continues after the highest song id, so seeding twice adds more songs
+  instead of colliding with the first run
+"""
+
+SEED_BATCH_SIZE = 20000
+
+TITLE_WORDS = (
+    'Electric', 'Velvet', 'Neon', 'Golden', 'Broken', 'Silver', 'Midnight', 'Crystal', 'Wild',
+    'Blue', 'Paper', 'Summer', 'Falling', 'Burning', 'Secret', 'Hollow', 'Lonely', 'Sweet',
+    'Endless', 'Fading', 'Dancing', 'Silent', 'Restless', 'Shining', 'Northern', 'Little',
+    'Lucky', 'Crimson', 'Distant', 'Frozen', 'Heavy', 'Young', 'Last', 'Starlit', 'Wasted',
+    'Quiet', 'Glass', 'Satellite', 'Tender', 'Faded',
+)
+TITLE_NOUNS = (
+    'Heart', 'Highway', 'Dream', 'Night', 'Fire', 'Rain', 'Love', 'City', 'River', 'Shadow',
+    'Thunder', 'Ocean', 'Echo', 'Storm', 'Honey', 'Light', 'Road', 'Sky', 'Moon', 'Angel',
+    'Paradise', 'Carnival', 'Horizon', 'Mirror', 'Garden', 'Signal', 'Lullaby', 'Parade',
+    'Machine', 'Avenue', 'Kingdom', 'Window', 'Fever', 'Letters', 'Radio', 'Heartbeat',
+    'Waves', 'Diamonds', 'Stranger', 'Memory', 'Tides', 'Runaway', 'Wildfire', 'Static',
+    'Daydream', 'Sunrise', 'Rebel', 'Vertigo', 'Gravity', 'Carousel',
+)
+ARTIST_FIRST = (
+    'Ava', 'Leo', 'Mia', 'Noah', 'Ivy', 'Jude', 'Nina', 'Otis', 'Ruby', 'Eli', 'Zoe', 'Milo',
+    'Cleo', 'Finn', 'June', 'Remy', 'Tess', 'Hugo', 'Lola', 'Axel', 'Nora', 'Cruz', 'Skye',
+    'Wren', 'Dean',
+)
+ARTIST_LAST = (
+    'Hart', 'Vega', 'Stone', 'Rivers', 'Cole', 'Knight', 'Blake', 'Frost', 'Lane', 'Monroe',
+    'Wilde', 'Gray', 'Fox', 'Reyes', 'Shaw', 'Quinn', 'Marsh', 'Sloane', 'West', 'Crane',
+)
+BAND_WORDS = (
+    'Keys', 'Lanterns', 'Arrows', 'Wolves', 'Comets', 'Echoes', 'Pilots', 'Strangers', 'Tigers',
+    'Satellites', 'Ghosts', 'Orchids', 'Rebels', 'Drifters', 'Ravens', 'Dreamers',
+)
+ALBUM_WORDS = (
+    'Sessions', 'Nights', 'Stories', 'Tapes', 'Hours', 'Letters', 'Seasons', 'Colors',
+    'Frequencies', 'Postcards', 'Youth', 'Motion', 'Gold', 'Static', 'Noise', 'Bloom',
+)
+ARTIST_COUNT = 20000
+ALBUMS_PER_ARTIST = 6
+
+# share of songs per genre, roughly a mainstream streaming library
+GENRE_WEIGHTS = {
+    Genre.POP: 24, Genre.ROCK: 20, Genre.HIP_HOP: 15, Genre.ELECTRONIC: 10, Genre.R_AND_B: 9,
+    Genre.COUNTRY: 8, Genre.JAZZ: 4, Genre.CLASSICAL: 3, Genre.NEW_WAVE: 4, Genre.DISCO: 3,
+}
+# share of songs per release year, weighted towards recent music
+FIRST_YEAR = 1970
+DECADE_WEIGHTS = {1970: 8, 1980: 12, 1990: 16, 2000: 20, 2010: 24, 2020: 20}
+
+SPOTIFY_TRACK_URL = 'https://open.spotify.com/track/'
+COVER_ART_URL = 'https://i.scdn.co/image/ab67616d0000b273{:024x}.jpg'
+BASE62 = string.digits + string.ascii_letters
+# ~0.618 * 62**22, odd and not a multiple of 31: i -> i * ID_STRIDE mod 62**22 (or mod
+# 16**24) never repeats and spreads consecutive songs over the whole id space
+ID_STRIDE = 1673514689202993649083888250260942745345
+
+COPY_COLUMNS = (
+    'title', 'artist', 'album', 'year', 'decade', 'duration', 'spotify_url', 'cover_art_url',
+    'genre', 'created_at', 'updated_at',
+)
+
+
+def _years():
+    """(years, weights) for the release year draw, up to the current year"""
+    years, weights = [], []
+    for year in range(FIRST_YEAR, timezone.now().year + 1):
+        decade_start = year - year % 10
+        years.append(year)
+        weights.append(DECADE_WEIGHTS.get(decade_start, DECADE_WEIGHTS[max(DECADE_WEIGHTS)]))
+    return years, weights
+
+
+def artist_name(index):
+    """name of synthetic artist `index`, solo artists and bands"""
+    if index % 4 == 3:
+        return f'The {TITLE_WORDS[index % len(TITLE_WORDS)]} {BAND_WORDS[index // 4 % len(BAND_WORDS)]}'
+    first = ARTIST_FIRST[index % len(ARTIST_FIRST)]
+    last = ARTIST_LAST[index // len(ARTIST_FIRST) % len(ARTIST_LAST)]
+    # 500 distinct first/last pairs, a number keeps the rest apart
+    number = index // (len(ARTIST_FIRST) * len(ARTIST_LAST))
+    return f'{first} {last}' if number == 0 else f'{first} {last} {number + 1}'
+
+
+def album_name(artist_index, album_index):
+    word = ALBUM_WORDS[(artist_index + album_index) % len(ALBUM_WORDS)]
+    noun = TITLE_NOUNS[(artist_index * 7 + album_index) % len(TITLE_NOUNS)]
+    return f'{noun} {word}'
+
+
+def song_title(index):
+    """unique title of synthetic song `index`: 2000 word pairs, then numbered versions"""
+    word = TITLE_WORDS[index % len(TITLE_WORDS)]
+    noun = TITLE_NOUNS[index // len(TITLE_WORDS) % len(TITLE_NOUNS)]
+    version = index // (len(TITLE_WORDS) * len(TITLE_NOUNS))
+    return f'{word} {noun}' if version == 0 else f'{word} {noun} {version + 1}'
+
+
+def track_id(index):
+    """22 character base62 id, like a spotify track id, unique per index"""
+    value = (index + 1) * ID_STRIDE % 62 ** 22
+    chars = []
+    for _ in range(22):
+        value, digit = divmod(value, 62)
+        chars.append(BASE62[digit])
+    return ''.join(chars)
+
+
+def generate_batch(start, count, seed=0):
+    """
+    - columns for synthetic songs start .. start + count - 1, as a dict of lists
+    - the same (start, count, seed) always gives the same rows
+    """
+    rng = random.Random(f'{seed}:{start}')
+    years, year_weights = _years()
+    decade_by_year = {year: Song.get_decade_from_year(year) for year in years}
+    indexes = range(start, start + count)
+
+    year_column = rng.choices(years, year_weights, k=count)
+    # most songs come from a few popular artists
+    artist_column = [int(ARTIST_COUNT * rng.random() ** 2) for _ in indexes]
+    album_column = rng.choices(range(ALBUMS_PER_ARTIST), k=count)
+    return {
+        'title': [song_title(i) for i in indexes],
+        'artist': [artist_name(a) for a in artist_column],
+        'album': [album_name(a, b) for a, b in zip(artist_column, album_column)],
+        'year': year_column,
+        'decade': [decade_by_year[year] for year in year_column],
+        'duration': [min(max(int(rng.gauss(215, 50)), 45), 1200) for _ in indexes],
+        'spotify_url': [SPOTIFY_TRACK_URL + track_id(i) for i in indexes],
+        # some tracks have no artwork
+        'cover_art_url': [COVER_ART_URL.format(i * ID_STRIDE % 16 ** 24) if i % 8 else None for i in indexes],
+        'genre': rng.choices(list(GENRE_WEIGHTS), list(GENRE_WEIGHTS.values()), k=count),
+    }
+
+
+def _copy_value(value):
+    """a value in postgres COPY text format"""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _timestamps(columns, count):
+    """created_at/updated_at columns, as a batch written through Song.save() would get them"""
+    now = timezone.now()
+    return {
+        **columns,
+        'created_at': [connection.ops.adapt_datefield_value(now.date())] * count,
+        'updated_at': [connection.ops.adapt_datetimefield_value(now)] * count,
+    }
+
+
+def _copy_batch(cursor, columns, count):
+    """COPY a batch into the staging table and move the non-conflicting rows into music_song"""
+    columns = _timestamps(columns, count)
+    buffer = io.StringIO()
+    for row in zip(*(columns[name] for name in COPY_COLUMNS)):
+        buffer.write('\t'.join(_copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    names = ', '.join(COPY_COLUMNS)
+    copy_sql = f'COPY music_song_seed ({names}) FROM STDIN'
+    if hasattr(cursor, 'copy_expert'):  # psycopg2
+        cursor.copy_expert(copy_sql, buffer)
+    else:  # psycopg 3
+        with cursor.copy(copy_sql) as copy:
+            copy.write(buffer.getvalue())
+    cursor.execute(
+        f'INSERT INTO music_song ({names}) SELECT {names} FROM music_song_seed ON CONFLICT DO NOTHING'
+    )
+    inserted = cursor.rowcount
+    cursor.execute('TRUNCATE music_song_seed')
+    return inserted
+
+
+def _insert_batch(cursor, columns, count):
+    """
+    - one executemany of a prepared INSERT OR IGNORE for the batch
+    - bulk_create was the first choice, but on sqlite it is capped at 999 parameters per
+      statement (~90 rows) and spends two thirds of its time in per-value field prep
+    """
+    columns = _timestamps(columns, count)
+    insert = connection.ops.insert_statement(on_conflict=OnConflict.IGNORE)
+    cursor.executemany(
+        f'{insert} music_song ({", ".join(COPY_COLUMNS)}) VALUES ({", ".join(["%s"] * len(COPY_COLUMNS))})',
+        list(zip(*(columns[name] for name in COPY_COLUMNS))),
+    )
+    return cursor.rowcount
+
+
+def seed_songs(count, batch_size=SEED_BATCH_SIZE, seed=0, log=None):
+    """
+    - insert `count` synthetic songs, returns how many were inserted
+    - facet counters and smart playlists are rebuilt and the list caches invalidated once
+      at the end
+    """
+    start = (Song.objects.order_by('-id').values_list('id', flat=True).first() or 0)
+    # the FTS insert trigger costs five times the insert itself; for a big load it is cheaper
+    # to drop it and have install_search() put it back and rebuild the index in one pass
+    pause_search_index = connection.vendor == 'sqlite' and count >= Song.objects.count()
+    started = time.perf_counter()
+    inserted = 0
+    use_copy = connection.vendor == 'postgresql'
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if use_copy:
+            # same column types, none of the constraints; dropped with the transaction
+            cursor.execute(
+                f'CREATE TEMP TABLE music_song_seed ON COMMIT DROP AS '
+                f'SELECT {", ".join(COPY_COLUMNS)} FROM music_song WITH NO DATA'
+            )
+        elif pause_search_index:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai')
+        for offset in range(0, count, batch_size):
+            batch = min(batch_size, count - offset)
+            columns = generate_batch(start + offset, batch, seed=seed)
+            if use_copy:
+                inserted += _copy_batch(cursor, columns, batch)
+            else:
+                inserted += _insert_batch(cursor, columns, batch)
+            if log:
+                log(f'{offset + batch}/{count} songs ({time.perf_counter() - started:.1f}s)')
+        if pause_search_index:
+            install_search(connection)
+        rebuild_facet_counts()
+        rebuild_smart_playlists()
+
+    invalidate_song_lists()
+    return inserted
@@ -1,7 +1,11 @@
 # convert django model instances to json (and vice versa)
 
+from datetime import date
+from functools import cached_property
 from rest_framework import serializers
-from .models import Song
+from rest_framework.settings import ISO_8601, api_settings
+from .cover_art import source_for, thumbnail_url
+from .models import Playlist, SmartPlaylist, Song
 from .types import Decade, Genre
 from .utils import get_message
 from django.core.exceptions import ValidationError
@@ -17,7 +21,7 @@ from django.utils import timezone
 # ModelSerializer auto-generates fields based on Song model
 class SongSerializer(serializers.ModelSerializer):
     created_at = serializers.DateField(read_only=True)
-    updated_at = serializers.DateField(read_only=True)
+    updated_at = serializers.DateTimeField(read_only=True)
     decade = serializers.ChoiceField(choices=Decade.choices, read_only=True)
     genre = serializers.ChoiceField(choices=Genre.choices)
     year = serializers.IntegerField()
@@ -48,6 +52,7 @@ class SongSerializer(serializers.ModelSerializer):
 
     def validate_cover_art_url(self, value):
         """validate that the cover art url is a valid image url"""
+        value = source_for(value, self.instance)
         if not value:
             raise serializers.ValidationError(get_message('errors.song.validation.cover_art_url.required'))
         valid_extensions = ('.jpg', '.jpeg', '.png', '.gif')
@@ -96,6 +101,131 @@ class SongSerializer(serializers.ModelSerializer):
                         })
             raise serializers.ValidationError(str(e))
 
+    def to_representation(self, instance):
+        """cover_art_url is served as an iPod-sized thumbnail (see cover_art.py)"""
+        data = super().to_representation(instance)
+        data['cover_art_url'] = thumbnail_url(instance.pk, data['cover_art_url'], request=self.context.get('request'))
+        return data
+
     class Meta:
         model = Song
-        fields = '__all__' # all model fields in the API
\ No newline at end of file
+        fields = '__all__' # all model fields in the API
+
+
+class SongBulkSerializer(SongSerializer):
+    """
+    - row serializer for POST /songs/bulk/
+    - same field validation as SongSerializer, minus the per-row uniqueness queries:
+      ingest.bulk_create_songs checks (title, artist) and (title, album) for the whole
+      batch with one query instead
+    """
+
+    def validate(self, data):
+        return data
+
+    class Meta(SongSerializer.Meta):
+        validators = []
+
+
+class SongReadSerializer:
+    """
+    - read-only fast path for song lists
+    - builds exactly what SongSerializer(many=True).data does, straight from .values() rows:
+      no model instances and no per-field to_representation calls
+    - fields and converters are compiled from SongSerializer, so they can't drift apart;
+      only dates and datetimes need converting, ints/strings/choices are already final
+    - SongSerializer stays the serializer for writes and single songs
+    """
+    final_field_classes = (serializers.IntegerField, serializers.CharField, serializers.ChoiceField)
+
+    @cached_property
+    def fields(self):
+        """readable SongSerializer fields, in output order"""
+        return [
+            (name, field) for name, field in SongSerializer().fields.items()
+            if not field.write_only
+        ]
+
+    @cached_property
+    def field_names(self):
+        # every Song field is exposed under its own name, so .values() keys are the output keys
+        return [name for name, _ in self.fields]
+
+    def values(self, queryset):
+        """the .values() queryset to feed into serialize()"""
+        return queryset.values(*self.field_names)
+
+    def get_converters(self):
+        """(name, converter) for the fields whose database value isn't final"""
+        converters = []
+        for name, field in self.fields:
+            if isinstance(field, serializers.DateTimeField):
+                converters.append((name, self.datetime_converter(field)))
+            elif isinstance(field, serializers.DateField):
+                iso = getattr(field, 'format', api_settings.DATE_FORMAT) == ISO_8601
+                converters.append((name, date.isoformat if iso else field.to_representation))
+            elif not isinstance(field, self.final_field_classes):
+                converters.append((name, field.to_representation))
+        return converters
+
+    def datetime_converter(self, field):
+        """DateTimeField.to_representation with the timezone lookup done once per call"""
+        tz = getattr(field, 'timezone', None) or field.default_timezone()
+        if tz is None or getattr(field, 'format', api_settings.DATETIME_FORMAT) != ISO_8601:
+            return field.to_representation
+
+        def convert(value):
+            value = value.astimezone(tz).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return convert
+
+    def serialize(self, rows, request=None):
+        """
+        - turn .values() rows into API dicts, converting in place
+        - request gives the origin of the thumbnail urls (see cover_art.thumbnail_url)
+        - e.g. {'id': 1, 'created_at': datetime.date(2024, 1, 1), ...}
+          -> {'id': 1, 'created_at': '2024-01-01', ...}
+        """
+        rows = list(rows)
+        converters = self.get_converters()
+        for row in rows:
+            for name, convert in converters:
+                value = row[name]
+                if value is not None:
+                    row[name] = convert(value)
+            # like SongSerializer.to_representation
+            row['cover_art_url'] = thumbnail_url(row['id'], row['cover_art_url'], request=request)
+        return rows
+
+
+song_read_serializer = SongReadSerializer()
+
+
+
+class PlaylistSerializer(serializers.ModelSerializer):
+    """playlist fields, song_count comes from the viewset's annotated queryset"""
+    song_count = serializers.IntegerField(read_only=True, default=0)
+
+    class Meta:
+        model = Playlist
+        fields = ['id', 'name', 'description', 'song_count', 'created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at']
+
+
+class SmartPlaylistSerializer(serializers.ModelSerializer):
+    """smart playlist fields, filters are stored in canonical form"""
+    song_count = serializers.IntegerField(read_only=True, default=0)
+
+    def validate_filters(self, value):
+        """only SongFilter params, with values the list endpoint would accept"""
+        from .smart_playlists import canonical_filters
+
+        try:
+            return canonical_filters(value)
+        except ValueError as e:
+            raise serializers.ValidationError(get_message('errors.smart_playlist.invalid_filters', name=e))
+
+    class Meta:
+        model = SmartPlaylist
+        fields = ['id', 'name', 'filters', 'song_count', 'created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at']
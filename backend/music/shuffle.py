@@ -0,0 +1,186 @@
+import hashlib
+import math
+import random
+from array import array
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Min
+
+from .caching import STALE_TTL, canonical_list_params, get_list_generation, get_or_build
+from .cursors import cursor_link, decode_cursor, invalid_cursor
+
+"""
+- random songs and shuffle queues without ORDER BY RANDOM() (a sort of the whole table)
+- random_song_ids() samples by id-range probing: draw random ids between the smallest and
+  largest primary key of the matching rows and keep the ones that exist and match the
+  filters. every matching row is equally likely, and each round is one primary key lookup
+  per probe. when the matching ids are too sparse for probing to find enough rows it
+  falls back to reading the next matching ids from a random pivot, one LIMIT n query
+  (plus one more if it wraps around), which favours rows that follow a gap
+- shuffle_order() is a seeded, artist-spaced play order for a whole (filtered) library:
+  each artist's songs are spread evenly over [0, 1) from a random offset, with a little
+  jitter, and everything is sorted by position, so one artist's songs are as far apart as
+  their share of the library allows. O(n log n), the same seed gives the same order
+- a queue is built once per (seed, filters, list generation) and cached in chunks of
+  SHUFFLE_CHUNK ids, so a page reads one or two chunks and a 100k song shuffle is never
+  held in one response or one cache value
+"""
+
+RANDOM_MAX = 100
+# probing rounds before falling back to sampling the matching ids
+PROBE_ROUNDS = 3
+# most ids one probing round looks up
+PROBE_MAX = 2000
+
+SHUFFLE_KEY_PREFIX = 'songs_shuffle'
+SHUFFLE_CHUNK = 1000
+# jitter of a song's position, as a share of the gap between two songs of its artist
+SHUFFLE_JITTER = 0.2
+
+
+def random_song_ids(queryset, n, rng=random):
+    """
+    - up to n distinct ids drawn uniformly from queryset, in random order
+    - e.g. random_song_ids(Song.objects.filter(genre='Rock'), 10)
+    """
+    bounds = queryset.aggregate(low=Min('pk'), high=Max('pk'))
+    low, high = bounds['low'], bounds['high']
+    if low is None or n <= 0:
+        return []
+
+    chosen = []
+    seen = set()
+    # share of probed ids that turned out to be matching rows, starts optimistic
+    hit_rate = 1.0
+    for _ in range(PROBE_ROUNDS):
+        needed = n - len(chosen)
+        unprobed = high - low + 1 - len(seen)
+        if unprobed <= 0:
+            break
+        size = min(PROBE_MAX, unprobed, math.ceil(needed / max(hit_rate, 0.01) * 1.5))
+        candidates = []
+        while len(candidates) < size:
+            pk = rng.randint(low, high)
+            if pk not in seen:
+                seen.add(pk)
+                candidates.append(pk)
+        found = list(queryset.filter(pk__in=candidates).values_list('pk', flat=True))
+        hit_rate = len(found) / size
+        rng.shuffle(found)
+        chosen.extend(found[:needed])
+        if len(chosen) == n:
+            return chosen
+
+    # ids too sparse for probing: the next matching ids from a random pivot, wrapping once
+    remaining = queryset.exclude(pk__in=chosen).order_by('pk').values_list('pk', flat=True)
+    pivot = rng.randint(low, high)
+    found = list(remaining.filter(pk__gte=pivot)[:n - len(chosen)])
+    if len(chosen) + len(found) < n:
+        found.extend(remaining.filter(pk__lt=pivot)[:n - len(chosen) - len(found)])
+    rng.shuffle(found)
+    chosen.extend(found)
+    return chosen
+
+
+def shuffle_order(rows, seed):
+    """
+    - artist-spaced play order of (id, artist) rows, as a list of ids
+    - artists are matched case-insensitively
+    """
+    rng = random.Random(seed)
+    by_artist = defaultdict(list)
+    for pk, artist in rows:
+        by_artist[artist.casefold()].append(pk)
+
+    positions = []
+    # sorted, so the order depends on the seed and the rows, not on how the rows came back
+    for artist in sorted(by_artist):
+        pks = sorted(by_artist[artist])
+        rng.shuffle(pks)
+        gap = 1.0 / len(pks)
+        offset = rng.random() * gap
+        for index, pk in enumerate(pks):
+            jitter = (rng.random() - 0.5) * SHUFFLE_JITTER * gap
+            positions.append((offset + index * gap + jitter, pk))
+    positions.sort()
+    return [pk for _, pk in positions]
+
+
+def _queue_key(seed, query_params, filterset_class, generation):
+    """e.g. songs_shuffle_v1718000000000000_42_3f2a..., chunks append _<n>"""
+    filters = [
+        (name, value) for name, value in canonical_list_params(query_params, filterset_class)
+        if name in filterset_class.base_filters
+    ]
+    digest = hashlib.blake2b(urlencode(filters).encode('utf-8'), digest_size=16).hexdigest()
+    return f"{SHUFFLE_KEY_PREFIX}_v{generation}_{seed}_{digest}"
+
+
+class ShuffleQueue:
+    """
+    - one seeded shuffle of the (filtered) songs, read a page at a time
+    - pages are addressed by an opaque cursor holding the list generation the queue was
+      built in and the offset, so a client keeps paging through the same order even if the
+      catalog changes on the way (deleted songs are skipped)
+    """
+
+    def __init__(self, queryset, seed, key, ttl=None):
+        self.queryset = queryset
+        self.seed = seed
+        self.key = key
+        self.ttl = settings.CACHE_TTL if ttl is None else ttl
+
+    @classmethod
+    def for_request(cls, queryset, seed, request, filterset_class, generation=None):
+        if generation is None:
+            generation = get_list_generation()
+        return cls(queryset, seed, _queue_key(seed, request.query_params, filterset_class, generation))
+
+    def _chunk_key(self, index):
+        return f"{self.key}_{index}"
+
+    def build(self):
+        """shuffle the songs and store the order in chunks, returns the queue length"""
+        order = shuffle_order(self.queryset.order_by().values_list('pk', 'artist').iterator(), self.seed)
+        chunks = {
+            self._chunk_key(index): array('q', order[start:start + SHUFFLE_CHUNK]).tobytes()
+            for index, start in enumerate(range(0, len(order), SHUFFLE_CHUNK))
+        }
+        # chunks outlive the length entry that points at them, so they are never missing first
+        cache.set_many(chunks, self.ttl + 2 * STALE_TTL)
+        return len(order)
+
+    def length(self):
+        length, _ = get_or_build(self.key, self.build, ttl=self.ttl)
+        return length
+
+    def page_ids(self, offset, size):
+        """ids at [offset, offset + size) of the queue"""
+        first, last = offset // SHUFFLE_CHUNK, (offset + size - 1) // SHUFFLE_CHUNK
+        keys = [self._chunk_key(index) for index in range(first, last + 1)]
+        chunks = cache.get_many(keys)
+        if len(chunks) < len(keys):
+            # evicted under memory pressure, rebuilding writes every chunk again
+            self.build()
+            chunks = cache.get_many(keys)
+        ids = array('q')
+        for key in keys:
+            ids.frombytes(chunks.get(key, b''))
+        start = offset - first * SHUFFLE_CHUNK
+        return ids[start:start + size].tolist()
+
+
+def decode_shuffle_cursor(encoded):
+    """?cursor= of a shuffle page -> (generation, offset)"""
+    tokens = decode_cursor(encoded, g=int, o=int)
+    if tokens['o'] < 0:
+        raise invalid_cursor()
+    return tokens['g'], tokens['o']
+
+
+def shuffle_page_link(request, seed, generation, offset):
+    """absolute url of the shuffle page starting at offset, pinned to the seed"""
+    return cursor_link(request, {'g': generation, 'o': offset}, seed=seed)
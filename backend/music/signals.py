@@ -0,0 +1,58 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .caching import detail_cache_key, invalidate_song_lists
+from .charts import forget_song
+from .facets import apply_facet_change, facet_state
+from .local_cache import invalidate_song_details
+from .models import SmartPlaylist, Song
+from .smart_playlists import invalidate_definitions, sync_song
+
+
+@receiver(post_save, sender=Song)
+@receiver(post_delete, sender=Song)
+def invalidate_song_responses(sender, instance, **kwargs):
+    """
+    - any Song write through the orm (the api, the admin, a shell) drops the cached
+      responses and moves the list validators, so a revalidating client gets the change
+    - queryset.update() and bulk_create() send no signals, their callers invalidate
+      themselves (see ingest.py, seeding.py)
+    """
+    invalidate_song_lists()
+    # a new id may have been cached as missing
+    invalidate_song_details(detail_cache_key(instance.pk))
+
+
+@receiver(post_delete, sender=Song)
+def remove_song_from_facets(sender, instance, using, **kwargs):
+    """
+    - keep SongFacet rollups in step with deletes
+    - a signal rather than Song.delete() so queryset.delete() is covered too
+    """
+    apply_facet_change(facet_state(instance), None, using=using)
+
+
+@receiver(pre_delete, sender=Song)
+def remove_song_from_charts(sender, instance, using, **kwargs):
+    """
+    - a deleted song's plays leave every live chart, as its PlayRollup rows cascade
+    - pre_delete, the rollups are read before the cascade removes them
+    """
+    forget_song(instance.pk, using=using)
+
+
+@receiver(post_save, sender=Song)
+def update_smart_playlists(sender, instance, created, raw=False, **kwargs):
+    """
+    - re-check the saved song against every smart playlist definition
+    - deletes need nothing, SmartPlaylistSong rows cascade
+    """
+    if not raw:
+        sync_song(instance, created=created)
+
+
+@receiver(post_save, sender=SmartPlaylist)
+@receiver(post_delete, sender=SmartPlaylist)
+def forget_smart_playlist_definitions(sender, **kwargs):
+    """song writes read the definitions from the cache, drop it when one changes"""
+    invalidate_definitions()
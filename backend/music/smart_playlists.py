@@ -0,0 +1,173 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django_filters import NumberFilter
+
+from .caching import canonical_list_params
+from .filters import SongFilter
+from .models import SmartPlaylist, SmartPlaylistSong, Song
+from .serializers import song_read_serializer
+
+"""
+- smart playlists: saved SongFilter params whose matching songs are materialized in
+  SmartPlaylistSong, so opening one is an index range scan instead of the filter query
+- a definition is materialized in full when it is created or its filters change
+- after that membership is maintained per song: a Song write re-checks that one song
+  against every definition, in python for the plain lookups (exact, gte, lte) and with a
+  primary-key-restricted query for the rest: case-insensitive lookups (title, artist),
+  whose case folding is the database's (e.g. sqlite's LIKE only folds ascii), and ?q=
+  search. the python checks only narrow the candidates, so a song write and a full
+  materialize always agree. deletes cascade
+- the definitions themselves are cached (they change rarely), so a song write costs one
+  cache read when no smart playlist changes membership; any SmartPlaylist save or delete
+  drops the cache (signals.py), and it expires after CACHE_TTL regardless
+- writes that bypass Song.save(): bulk ingestion adds its songs in one pass per batch,
+  seed_songs and `manage.py rebuild_smart_playlists` re-materialize everything
+"""
+
+DEFINITIONS_KEY = 'smart_playlist_definitions'
+MATERIALIZE_BATCH_SIZE = 5000
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+SONG_FIELDS = [f'song__{name}' for name in song_read_serializer.field_names]
+
+_COMPARISONS = {
+    'exact': lambda value, expected: value == expected,
+    'gte': lambda value, expected: value >= expected,
+    'lte': lambda value, expected: value <= expected,
+    'gt': lambda value, expected: value > expected,
+    'lt': lambda value, expected: value < expected,
+}
+
+
+def canonical_filters(data):
+    """
+    - validated, normalized SongFilter params for a definition, e.g.
+      {'Genre': ...} -> ValueError, {'year_min': ' 1980 '} -> {'year_min': '1980'}
+    - raises ValueError naming the first unknown or invalid param
+    """
+    if not isinstance(data, dict):
+        raise ValueError('filters')
+    for name, value in data.items():
+        if name not in SongFilter.base_filters or not isinstance(value, (str, int, float)) or isinstance(value, bool):
+            raise ValueError(name)
+    params = {name: str(value) for name, value in data.items()}
+    form = SongFilter(params, queryset=Song.objects.none()).form
+    if not form.is_valid():
+        raise ValueError(next(iter(form.errors)))
+    return dict(canonical_list_params(params, SongFilter))
+
+
+def compile_filters(filters):
+    """
+    - (predicates, sql_filters): python checks of one song for the plain lookups, and the
+      params that need the database (case-insensitive lookups, method filters like ?q=)
+    """
+    predicates, sql_filters = [], {}
+    for name, value in filters.items():
+        field = SongFilter.base_filters[name]
+        compare = _COMPARISONS.get(field.lookup_expr)
+        if field.method or compare is None:
+            sql_filters[name] = value
+            continue
+        expected = Decimal(value) if isinstance(field, NumberFilter) else value
+        predicates.append((field.field_name, compare, expected))
+    return predicates, sql_filters
+
+
+def _python_match(predicates, song):
+    return all(
+        getattr(song, attribute) is not None and compare(getattr(song, attribute), expected)
+        for attribute, compare, expected in predicates
+    )
+
+
+def get_definitions():
+    """[(smart playlist id, filters)], cached until a definition changes or CACHE_TTL passes"""
+    definitions = cache.get(DEFINITIONS_KEY)
+    if definitions is None:
+        definitions = list(SmartPlaylist.objects.order_by('id').values_list('id', 'filters'))
+        cache.set(DEFINITIONS_KEY, definitions, timeout=settings.CACHE_TTL)
+    return definitions
+
+
+def invalidate_definitions():
+    cache.delete(DEFINITIONS_KEY)
+
+
+def matching_definitions(songs):
+    """{song pk: {smart playlist ids it belongs to}} for saved songs"""
+    matches = {song.pk: set() for song in songs}
+    for playlist_id, filters in get_definitions():
+        predicates, sql_filters = compile_filters(filters)
+        candidates = [song for song in songs if _python_match(predicates, song)]
+        if candidates and sql_filters:
+            queryset = Song.objects.filter(pk__in=[song.pk for song in candidates])
+            found = set(SongFilter(sql_filters, queryset=queryset).qs.values_list('pk', flat=True))
+            candidates = [song for song in candidates if song.pk in found]
+        for song in candidates:
+            matches[song.pk].add(playlist_id)
+    return matches
+
+
+def sync_song(song, created=False):
+    """re-check one song against every definition and fix its memberships"""
+    wanted = matching_definitions([song])[song.pk]
+    current = set() if created else set(
+        SmartPlaylistSong.objects.filter(song=song).values_list('smart_playlist_id', flat=True)
+    )
+    if current - wanted:
+        SmartPlaylistSong.objects.filter(song=song, smart_playlist_id__in=current - wanted).delete()
+    if wanted - current:
+        SmartPlaylistSong.objects.bulk_create([
+            SmartPlaylistSong(smart_playlist_id=playlist_id, song=song) for playlist_id in wanted - current
+        ])
+
+
+def add_new_songs(songs):
+    """memberships of freshly inserted songs (bulk ingestion), one insert for the batch"""
+    if not get_definitions():
+        return
+    SmartPlaylistSong.objects.bulk_create([
+        SmartPlaylistSong(smart_playlist_id=playlist_id, song_id=pk)
+        for pk, playlist_ids in matching_definitions(songs).items()
+        for playlist_id in playlist_ids
+    ], batch_size=MATERIALIZE_BATCH_SIZE)
+
+
+def materialize(smart_playlist):
+    """recompute one smart playlist's songs from its filters, returns how many match"""
+    queryset = SongFilter(smart_playlist.filters, queryset=Song.objects.all()).qs
+    with transaction.atomic():
+        SmartPlaylistSong.objects.filter(smart_playlist=smart_playlist).delete()
+        members, count = [], 0
+        for pk in queryset.order_by().values_list('pk', flat=True).iterator(chunk_size=MATERIALIZE_BATCH_SIZE):
+            members.append(SmartPlaylistSong(smart_playlist=smart_playlist, song_id=pk))
+            if len(members) == MATERIALIZE_BATCH_SIZE:
+                SmartPlaylistSong.objects.bulk_create(members)
+                count += len(members)
+                members = []
+        SmartPlaylistSong.objects.bulk_create(members)
+    invalidate_definitions()
+    return count + len(members)
+
+
+def rebuild_smart_playlists():
+    """re-materialize every smart playlist, returns {id: song count}"""
+    return {smart_playlist.pk: materialize(smart_playlist) for smart_playlist in SmartPlaylist.objects.all()}
+
+
+def member_rows(smart_playlist_id, before_song=None, limit=PAGE_SIZE, request=None):
+    """
+    - up to limit songs of a smart playlist, newest (highest id) first, in one joined
+      query over the (smart_playlist, song) index; before_song is the keyset cursor
+    """
+    members = SmartPlaylistSong.objects.filter(smart_playlist_id=smart_playlist_id)
+    if before_song is not None:
+        members = members.filter(song_id__lt=before_song)
+    rows = members.order_by('-song_id').values(*SONG_FIELDS)[:limit]
+    return song_read_serializer.serialize(
+        [{name: row[f'song__{name}'] for name in song_read_serializer.field_names} for row in rows], request
+    )
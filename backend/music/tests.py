@@ -3,9 +3,12 @@ from django.contrib.auth.models import User
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
+from django.core.cache import cache
+from .local_cache import song_details
 from .models import Song
 from .serializers import SongSerializer
 from .types import Genre
+from .utils import get_message
 
 class SongTests(TestCase):
     def setUp(self):
@@ -34,6 +37,10 @@ class SongTests(TestCase):
         
         # setup API client
         self.client = APIClient()
+
+        # cached list/detail responses must not leak between tests
+        cache.clear()
+        song_details.clear()
         
     def test_song_creation(self):
         """test creating a new song"""
@@ -420,3 +427,1253 @@ class SongTests(TestCase):
         self.assertEqual(self.song.title, 'Updated Title Only')
         self.assertEqual(self.song.artist, 'Test Artist')  # s hould remain unchanged
         self.assertEqual(self.song.album, 'Test Album')    # should remain unchanged
+
+    def test_song_list_cursor_pagination(self):
+        """test walking the list with keyset cursors"""
+        for i in range(24):
+            Song.objects.create(
+                title=f'Paged Song {i}',
+                artist='Paged Artist',
+                album=f'Paged Album {i}',
+                year=2020,
+                duration=200,
+                spotify_url=f'https://open.spotify.com/track/paged{i}',
+                genre=Genre.ROCK
+            )
+
+        self.client.force_authenticate(user=self.regular_user)
+        response = self.client.get(reverse('song-list'), {'page_size': 10})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['data']), 10)
+        self.assertIsNone(response.data['pagination']['previous'])
+
+        # follow next links to the end, every song should show up exactly once
+        seen = [song['id'] for song in response.data['data']]
+        pages = [response.data]
+        while response.data['pagination']['next']:
+            response = self.client.get(response.data['pagination']['next'])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(song['id'] for song in response.data['data'])
+            pages.append(response.data)
+
+        self.assertEqual(len(pages), 3)
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(len(set(seen)), 25)
+        expected = list(Song.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+        # the previous link of the last page leads back to the second page
+        response = self.client.get(pages[-1]['pagination']['previous'])
+        self.assertEqual(
+            [song['id'] for song in response.data['data']],
+            [song['id'] for song in pages[1]['data']]
+        )
+
+    def test_song_list_invalid_cursor(self):
+        """test that a tampered cursor is rejected"""
+        self.client.force_authenticate(user=self.regular_user)
+        response = self.client.get(reverse('song-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data['detail'], get_message('errors.song.list.invalid_cursor'))
+
+    def test_song_search(self):
+        """test ranked, typo-tolerant search with ?q="""
+        Song.objects.create(
+            title='Bohemian Rhapsody',
+            artist='Queen',
+            album='A Night at the Opera',
+            year=1975,
+            duration=354,
+            spotify_url='https://open.spotify.com/track/bohemian',
+            genre=Genre.ROCK
+        )
+        Song.objects.create(
+            title='Under Pressure',
+            artist='Queen',
+            album='Hot Space',
+            year=1981,
+            duration=248,
+            spotify_url='https://open.spotify.com/track/pressure',
+            genre=Genre.ROCK
+        )
+
+        self.client.force_authenticate(user=self.regular_user)
+        url = reverse('song-list')
+
+        # exact title match ranks first
+        response = self.client.get(url, {'q': 'bohemian rhapsody'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data'][0]['title'], 'Bohemian Rhapsody')
+
+        # misspelled artist still finds both songs
+        response = self.client.get(url, {'q': 'qeen'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({song['artist'] for song in response.data['data']}, {'Queen'})
+        self.assertEqual(len(response.data['data']), 2)
+
+        # search stays in sync with updates
+        Song.objects.filter(title='Under Pressure').update(title='Radio Ga Ga')
+        response = self.client.get(url, {'q': 'radio ga'})
+        self.assertEqual(response.data['data'][0]['title'], 'Radio Ga Ga')
+
+    def test_list_cache_generation_invalidation(self):
+        """test that writes invalidate cached lists by bumping the generation"""
+        self.client.force_authenticate(user=self.admin_user)
+        url = reverse('song-list')
+
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(len(response.data['data']), 1)
+        stats = self.client.get(reverse('song-cache-stats')).data['data']
+        self.assertEqual(stats['list_misses'], 1)
+        self.assertEqual(stats['list_hits'], 1)
+        generation = stats['list_generation']
+
+        data = {
+            'title': 'Cache Song',
+            'artist': 'Cache Artist',
+            'album': 'Cache Album',
+            'year': 2024,
+            'duration': 200,
+            'spotify_url': 'https://open.spotify.com/track/cache123',
+            'genre': Genre.POP
+        }
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # the cached list is skipped, the new song shows up immediately
+        response = self.client.get(url)
+        self.assertEqual(len(response.data['data']), 2)
+        stats = self.client.get(reverse('song-cache-stats')).data['data']
+        self.assertEqual(stats['list_invalidations'], 1)
+        self.assertEqual(stats['list_misses'], 2)
+        self.assertEqual(stats['list_generation'], generation + 1)
+
+    def test_list_cache_key_is_canonical(self):
+        """test that equivalent list queries share one cache key"""
+        from django.http import QueryDict
+        from .caching import list_cache_key
+        from .views import SongFilter
+
+        def key(querystring):
+            return list_cache_key(QueryDict(querystring), SongFilter)
+
+        # parameter order, irrelevant params, whitespace and number formatting don't matter
+        self.assertEqual(key('genre=Rock&year=1985'), key('year=1985&genre=Rock'))
+        self.assertEqual(key('genre=Rock'), key('genre=Rock&utm_source=ipod&_=123'))
+        self.assertEqual(key('year=1985'), key('year=01985.0'))
+        self.assertEqual(key('artist=Queen'), key('artist=%20queen%20'))
+        self.assertEqual(key('page_size=100'), key('page_size=500'))
+        self.assertEqual(key(''), key('genre='))
+
+        # exact lookups stay case-sensitive, different filters stay apart
+        self.assertNotEqual(key('genre=Rock'), key('genre=rock'))
+        self.assertNotEqual(key('year=1985'), key('year_min=1985'))
+        self.assertNotEqual(key('page_size=10'), key(''))
+
+    def test_bulk_create(self):
+        """test bulk ingestion with set-based conflict checks"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.client.force_authenticate(user=self.admin_user)
+        url = reverse('song-bulk')
+
+        rows = [
+            {
+                'title': f'Bulk Song {i}',
+                'artist': 'Bulk Artist',
+                'album': f'Bulk Album {i}',
+                'year': 1985,
+                'duration': 200,
+                'spotify_url': f'https://open.spotify.com/track/bulk{i}',
+                'genre': Genre.ROCK
+            }
+            for i in range(50)
+        ]
+        rows.append(dict(rows[0], year=1969))  # invalid field
+        rows.append(dict(rows[0], album='Other Album'))  # duplicate title/artist within the payload
+        rows.append(dict(rows[1], title='Test Song', artist='Test Artist'))  # exists in the database
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'songs': rows}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['summary']['created'], 50)
+        self.assertEqual(response.data['summary']['failed'], 3)
+        self.assertEqual(Song.objects.count(), 51)
+        self.assertEqual([row['status'] for row in response.data['data'][-3:]], ['error'] * 3)
+        self.assertIn('year', response.data['data'][50]['message'])
+        self.assertTrue(all(row['id'] for row in response.data['data'][:50]))
+
+        # decade is computed even though bulk_create skips save()
+        self.assertEqual(Song.objects.get(title='Bulk Song 7').decade, '80s')
+
+        # one conflict query and one insert, not one of each per row
+        song_queries = [q for q in queries.captured_queries if 'music_song' in q['sql']]
+        self.assertLessEqual(len(song_queries), 4)
+
+    def test_song_export(self):
+        """test streaming the catalog as ndjson and csv"""
+        import csv
+        import io
+        import json
+        from django.core.management import call_command
+        from .export import stream_ndjson
+
+        for i in range(5):
+            Song.objects.create(
+                title=f'Export Song {i}',
+                artist='Export Artist',
+                album=f'Export Album {i}',
+                year=1999,
+                duration=180,
+                spotify_url=f'https://open.spotify.com/track/export{i}',
+                genre=Genre.JAZZ
+            )
+
+        self.client.force_authenticate(user=self.admin_user)
+        url = reverse('song-export')
+
+        response = self.client.get(url, {'format': 'ndjson'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(json.loads(lines[0])['title'], 'Test Song')
+
+        # filters apply to the export
+        response = self.client.get(url, {'format': 'csv', 'genre': 'Jazz'})
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual({row['decade'] for row in rows}, {'90s'})
+
+        response = self.client.get(url, {'format': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # batches walk the whole table without skipping or repeating rows
+        chunks = list(stream_ndjson(Song.objects.all(), batch_size=2))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(sum(chunk.count('\n') for chunk in chunks), 6)
+
+        out = io.StringIO()
+        call_command('export_songs', '--format', 'csv', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 7)
+
+    def test_conditional_get(self):
+        """test ETag / If-None-Match / If-Modified-Since handling"""
+        self.client.force_authenticate(user=self.admin_user)
+        detail_url = reverse('song-detail', args=[self.song.id])
+        list_url = reverse('song-list')
+
+        # detail: revalidation with the etag is a bodyless 304, cached or not
+        response = self.client.get(detail_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        for _ in range(2):
+            response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response.content, b'')
+        cache.clear()
+        response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(detail_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # list: same for the list etag
+        response = self.client.get(list_url, {'genre': 'Pop'})
+        list_etag = response['ETag']
+        response = self.client.get(list_url, {'genre': 'Pop'}, HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # a change the same day produces new validators everywhere
+        response = self.client.patch(detail_url, {'duration': 181}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        response = self.client.get(list_url, {'genre': 'Pop'}, HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data'][0]['duration'], 181)
+
+        # so does a write outside the api, e.g. from the admin
+        list_etag = response['ETag']
+        song = Song.objects.get(pk=self.song.pk)
+        song.duration = 182
+        song.save()
+        response = self.client.get(list_url, {'genre': 'Pop'}, HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data'][0]['duration'], 182)
+
+    def test_cached_response_bytes(self):
+        """test that cached list responses are reused as bytes with a fresh timestamp"""
+        import json
+        self.client.force_authenticate(user=self.regular_user)
+        url = reverse('song-list')
+
+        first = self.client.get(url)
+        second = self.client.get(url)
+        self.assertEqual(second['Content-Type'], 'application/json')
+        first_body, second_body = json.loads(first.content), json.loads(second.content)
+        self.assertNotEqual(first_body.pop('timestamp'), second_body.pop('timestamp'))
+        self.assertEqual(first_body, second_body)
+        self.assertEqual(second.data['data'][0]['title'], 'Test Song')
+
+    def test_read_serializer_parity(self):
+        """test that the fast read path renders byte-identical to SongSerializer"""
+        from django.utils import timezone
+        from .renderers import dumps
+        from .serializers import song_read_serializer
+
+        for i, cover in enumerate([None, 'https://example.com/cover.png', '']):
+            Song.objects.create(
+                title=f'Parity Song {i}',
+                artist='Parity Artist',
+                album=f'Parity Album {i}',
+                year=1979 + i * 11,
+                duration=100 + i,
+                spotify_url=f'https://open.spotify.com/track/parity{i}',
+                cover_art_url=cover,
+                genre=Genre.values[i]
+            )
+
+        queryset = Song.objects.order_by('-created_at', '-id')
+        for tz in ('UTC', 'America/Toronto'):
+            with timezone.override(tz):
+                expected = dumps(SongSerializer(queryset, many=True).data)
+                actual = dumps(song_read_serializer.serialize(song_read_serializer.values(queryset)))
+                self.assertEqual(actual, expected)
+
+    def test_song_facets(self):
+        """test facet counts, filtered and from the rollup counters"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .facets import facet_counts, rollup_facet_counts
+        self.client.force_authenticate(user=self.regular_user)
+        url = reverse('song-facets')
+
+        rock = Song.objects.create(
+            title='Facet Song',
+            artist='Facet Artist',
+            album='Facet Album',
+            year=1985,
+            duration=200,
+            spotify_url='https://open.spotify.com/track/facet1',
+            genre=Genre.ROCK
+        )
+        rock.year = 1987
+        rock.save()
+
+        # an edit that moves no facet neither re-reads the row nor touches the rollups
+        loaded = Song.objects.get(pk=rock.pk)
+        stale = Song.objects.get(pk=rock.pk)
+        loaded.album = 'Facet Album (Remastered)'
+        with CaptureQueriesContext(connection) as queries:
+            loaded.save()
+        sqls = [query['sql'] for query in queries.captured_queries]
+        self.assertFalse(any('music_songfacet' in sql for sql in sqls))
+        self.assertFalse(any(sql.startswith('SELECT') and 'FROM "music_song"' in sql for sql in sqls))
+
+        # nor can it move one from a stale copy: the facet columns are left out of its UPDATE
+        loaded.genre = Genre.JAZZ
+        loaded.save()
+        stale.title = 'Facet Song (Live)'
+        stale.save()
+        stale.refresh_from_db()
+        self.assertEqual(stale.genre, Genre.JAZZ)
+        self.assertEqual(rollup_facet_counts(), facet_counts(Song.objects.all()))
+        loaded.genre = Genre.ROCK
+        loaded.save()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertFalse(any('music_song"' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data['data']
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['duration'], 380)
+        self.assertEqual(data['genre'], {Genre.POP: 1, Genre.ROCK: 1})
+        self.assertEqual(data['year'], {'1987': 1, '2024': 1})
+        self.assertEqual(data['decade'][rock.decade], 1)
+
+        # filtered: same params as the list endpoint, one grouped query
+        response = self.client.get(url, {'genre': Genre.ROCK})
+        self.assertEqual(response.data['data']['genre'], {Genre.ROCK: 1})
+        self.assertEqual(response.data['data']['duration'], 200)
+
+        rock.delete()
+        data = self.client.get(url).data['data']
+        self.assertEqual((data['count'], data['duration']), (1, 180))
+        self.assertEqual(data['genre'], {Genre.POP: 1})
+
+    def test_filter_queries_use_indexes(self):
+        """test that every SongFilter combination plans an index read, not a sequential scan"""
+        import re
+        from django.db import connection
+        from .pagination import SongCursorPagination
+        from .views import SongFilter
+
+        Song.objects.bulk_create([
+            Song(
+                title=f'Seeded Song {i}',
+                artist=f'Seeded Artist {i % 500}',
+                album=f'Seeded Album {i}',
+                year=1970 + i % 60,
+                decade=Song.get_decade_from_year(1970 + i % 60),
+                duration=200,
+                spotify_url=f'https://open.spotify.com/track/seeded{i}',
+                genre=Genre.values[i % len(Genre.values)]
+            )
+            for i in range(10000)
+        ], batch_size=2000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE music_song' if connection.vendor == 'postgresql' else 'ANALYZE')
+
+        if connection.vendor == 'postgresql':
+            sequential_scan = re.compile(r'Seq Scan on music_song\b')
+        else:
+            # sqlite: SEARCH is an index range read, a bare SCAN reads the whole table
+            sequential_scan = re.compile(r'\bSCAN music_song\b(?! USING (COVERING )?INDEX)')
+
+        combinations = [
+            {},
+            {'genre': Genre.ROCK},
+            {'decade': '80s'},
+            {'year': 1985},
+            {'year_min': 1980},
+            {'year_max': 1975},
+            {'year_min': 1980, 'year_max': 1989},
+            {'genre': Genre.ROCK, 'decade': '80s'},
+            {'genre': Genre.ROCK, 'year': 1985},
+            {'genre': Genre.ROCK, 'year_min': 1980, 'year_max': 1989},
+            {'decade': '80s', 'year': 1985},
+        ]
+        page_size = SongCursorPagination.page_size
+        for params in combinations:
+            # the query a list page runs: filters, keyset ordering, one extra row
+            queryset = SongFilter(params, queryset=Song.objects.all()).qs
+            plan = queryset.order_by(*SongCursorPagination.ordering)[:page_size + 1].explain()
+            self.assertIsNone(sequential_scan.search(plan), f'{params} plans a sequential scan:\n{plan}')
+            if connection.vendor != 'sqlite':
+                continue
+            if {'genre', 'decade', 'year'} & params.keys():
+                # equality filters must seek into their own index rather than walk
+                # song_created_id_idx, and read it already in list order
+                self.assertIn('SEARCH music_song USING INDEX', plan, f'{params}:\n{plan}')
+                if 'year_min' not in params:
+                    self.assertNotIn('TEMP B-TREE', plan, f'{params} sorts:\n{plan}')
+            if {'year_min', 'year_max'} <= params.keys():
+                # a bounded year range seeks the year index; its rows come out ordered by
+                # year, so the page is still sorted afterwards (see the Song.Meta comment)
+                self.assertIn('USING INDEX song_year_created_idx (year>? AND year<?)', plan, f'{params}:\n{plan}')
+                self.assertIn('USE TEMP B-TREE FOR ORDER BY', plan, f'{params}:\n{plan}')
+
+    def test_cache_rebuild_is_single_flight(self):
+        """test that concurrent misses share one rebuild and stale entries are served meanwhile"""
+        import threading
+        import time
+        from unittest import mock
+        from .caching import get_or_build
+
+        builds = []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.3)
+            return 'fresh'
+
+        results = []
+        start = threading.Barrier(8)
+
+        def worker():
+            start.wait()
+            results.append(get_or_build('single_flight_test', build, ttl=60))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(sorted(results), [('fresh', 'hit')] * 7 + [('fresh', 'miss')])
+
+        # past its ttl while another worker holds the lock: the old value is served
+        cache.set('single_flight_test', ('old', time.time() - 1, 0.1), 60)
+        cache.add('single_flight_test_lock', 'other-worker', 10)
+        self.assertEqual(get_or_build('single_flight_test', build, ttl=60), ('old', 'stale'))
+        self.assertEqual(len(builds), 1)
+
+        # close to expiry with a slow build: refreshed early by one request
+        cache.delete('single_flight_test_lock')
+        cache.set('single_flight_test', ('old', time.time() + 1, 0.5), 60)
+        with mock.patch('music.caching.random.random', return_value=0.99):
+            self.assertEqual(get_or_build('single_flight_test', build, ttl=60), ('fresh', 'miss'))
+        self.assertEqual(get_or_build('single_flight_test', build, ttl=60), ('fresh', 'hit'))
+
+    def test_detail_local_tier(self):
+        """test the in-process detail tier, negative caching and cross-worker invalidation"""
+        import time
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .caching import detail_cache_key, get_cache_stats
+        from .local_cache import INVALIDATION_CHANNEL, _redis_connection
+        self.client.force_authenticate(user=self.admin_user)
+        url = reverse('song-detail', kwargs={'pk': self.song.pk})
+
+        local_hits = song_details.hits
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 0)
+        stats = get_cache_stats()
+        self.assertEqual(stats['detail_local']['hits'], local_hits + 1)
+        self.assertEqual(stats['detail_hits'] + stats['detail_misses'], 1)
+
+        # missing ids are cached as missing: the second 404 never reaches the database
+        missing_url = reverse('song-detail', kwargs={'pk': 999999})
+        self.assertEqual(self.client.get(missing_url).status_code, status.HTTP_404_NOT_FOUND)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(missing_url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(queries), 0)
+
+        # another worker's update: its broadcast drops our local copy
+        redis = _redis_connection()
+        if redis is None:
+            self.skipTest('cross-worker invalidation needs a redis cache backend')
+        key = detail_cache_key(self.song.pk)
+        redis.publish(INVALIDATION_CHANNEL, key)
+        deadline = time.monotonic() + 2
+        while song_details._entries.get(key) is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIsNone(song_details._entries.get(key))
+
+        # our own update drops it from both tiers right away
+        self.client.get(url)
+        self.client.patch(url, {'duration': 200}, format='json')
+        self.assertEqual(self.client.get(url).data['data']['duration'], 200)
+
+    def test_async_read_path_parity(self):
+        """test that the async list/retrieve views answer exactly like the sync ones"""
+        import json
+        from asgiref.sync import async_to_sync
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from .async_views import async_read_view
+        from .caching import LIST_GENERATION_KEY, LIST_MODIFIED_KEY
+        from .views import SongViewSet
+
+        for i in range(3):
+            Song.objects.create(
+                title=f'Async Song {i}',
+                artist='Async Artist',
+                album=f'Async Album {i}',
+                year=1985 + i,
+                duration=200 + i,
+                spotify_url=f'https://open.spotify.com/track/async{i}',
+                genre=Genre.ROCK
+            )
+        views = {
+            'list': SongViewSet.as_view({'get': 'list', 'post': 'create'}),
+            'retrieve': SongViewSet.as_view({'get': 'retrieve', 'patch': 'partial_update', 'delete': 'destroy'}),
+        }
+        factory = APIRequestFactory()
+
+        def call(action, is_async, query='', headers=None, **kwargs):
+            request = factory.get(f'/api/songs/{query}', **(headers or {}))
+            force_authenticate(request, user=self.regular_user)
+            if is_async:
+                return async_to_sync(async_read_view(views[action]))(request, **kwargs)
+            response = views[action](request, **kwargs)
+            return response.render()
+
+        def comparable(response):
+            body = json.loads(response.content) if response.content else None
+            if body:
+                body.pop('timestamp', None)
+            headers = {name: response.get(name) for name in ('Content-Type', 'ETag', 'Allow', 'Vary')}
+            return response.status_code, headers, body
+
+        cases = [
+            ('list', '', {}),
+            ('list', '?genre=Rock&page_size=2', {}),
+            ('list', '?q=async', {}),
+            ('list', '?cursor=not-a-cursor', {}),
+            ('retrieve', '', {'pk': self.song.pk}),
+            ('retrieve', '', {'pk': 999999}),
+        ]
+        for action, query, kwargs in cases:
+            results = []
+            # cold cache for each path, then the async path again reading what sync cached
+            for is_async in (True, False):
+                cache.clear()
+                song_details.clear()
+                # pin the list version, a cleared cache would otherwise start a new one
+                cache.set_many({LIST_GENERATION_KEY: 1, LIST_MODIFIED_KEY: 1700000000}, None)
+                results.append(comparable(call(action, is_async, query, **kwargs)))
+            results.append(comparable(call(action, True, query, **kwargs)))
+            self.assertEqual(results[0], results[1], (action, query, kwargs))
+            self.assertEqual(results[2], results[1], (action, query, kwargs))
+
+        # conditional get and unauthenticated requests
+        etag = call('retrieve', False, pk=self.song.pk)['ETag']
+        response = call('retrieve', True, headers={'HTTP_IF_NONE_MATCH': etag}, pk=self.song.pk)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        with self.settings(DEBUG=False):
+            request = factory.get('/api/songs/')
+            sync_response = views['list'](request).render()
+            async_response = async_to_sync(async_read_view(views['list']))(factory.get('/api/songs/'))
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(json.loads(async_response.content), json.loads(sync_response.content))
+
+    def test_seed_songs(self):
+        """test the synthetic catalog generator behind manage.py seed_songs"""
+        from io import StringIO
+        from django.core.management import call_command
+        from django.db.models import Count
+        from .search import search_songs
+        self.client.force_authenticate(user=self.regular_user)
+
+        out = StringIO()
+        call_command('seed_songs', count=2500, batch_size=1000, stdout=out)
+        self.assertIn('Seeded 2500 songs', out.getvalue())
+        # a second run carries on numbering instead of clashing with the first
+        call_command('seed_songs', count=500, stdout=out)
+        self.assertEqual(Song.objects.count(), 3001)
+
+        seeded = Song.objects.exclude(pk=self.song.pk)
+        for field in ('title', 'spotify_url'):
+            self.assertFalse(seeded.values(field).annotate(n=Count('id')).filter(n__gt=1).exists())
+        serializer = SongSerializer()
+        for song in seeded[:200]:
+            # field rules the api enforces; these raise if a value is invalid
+            self.assertEqual(song.decade, Song.get_decade_from_year(song.year))
+            serializer.validate_year(song.year)
+            serializer.validate_duration(song.duration)
+            serializer.validate_spotify_url(song.spotify_url)
+            if song.cover_art_url is not None:
+                serializer.validate_cover_art_url(song.cover_art_url)
+        self.assertGreater(seeded.values('genre').distinct().count(), 5)
+
+        # the search index and facet counters include the new rows
+        title = seeded.first().title
+        self.assertIn(title, search_songs(Song.objects.all(), title).values_list('title', flat=True)[:10])
+        response = self.client.get(reverse('song-facets'))
+        self.assertEqual(response.data['data']['count'], 3001)
+
+    def test_batch_retrieve(self):
+        """test fetching many songs by id through the detail cache"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .caching import get_cache_stats
+        from .views import BATCH_MAX_IDS
+        self.client.force_authenticate(user=self.regular_user)
+        other = Song.objects.create(
+            title='Other Song', artist='Other Artist', album='Other Album', year=1999,
+            duration=200, spotify_url='https://open.spotify.com/track/other456', genre=Genre.ROCK,
+        )
+        url = reverse('song-batch')
+        ids = f'{other.pk},999999,{self.song.pk},{other.pk}'
+
+        # cold: every miss comes from one query
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'ids': ids})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len([q for q in queries if 'music_song' in q['sql']]), 1)
+        data = response.data['data']
+        self.assertEqual([entry['id'] for entry in data], [other.pk, 999999, self.song.pk, other.pk])
+        self.assertEqual([entry['found'] for entry in data], [True, False, True, True])
+        self.assertIsNone(data[1]['song'])
+        self.assertEqual(data[0]['song']['title'], 'Other Song')
+
+        # same entries as the detail endpoint, served from the redis tier without queries
+        detail = self.client.get(reverse('song-detail', kwargs={'pk': self.song.pk}))
+        self.assertEqual(data[2]['song'], detail.data['data'])
+        song_details.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, {'ids': ids}).data['data'], data)
+        self.assertEqual(len(queries), 0)
+        stats = get_cache_stats()
+        self.assertEqual((stats['detail_hits'], stats['detail_misses']), (3, 3))
+
+        # a write drops the song from the cache the batch reads
+        self.client.force_authenticate(user=self.admin_user)
+        self.client.patch(reverse('song-detail', kwargs={'pk': other.pk}), {'year': 2001}, format='json')
+        self.assertEqual(self.client.get(url, {'ids': ids}).data['data'][0]['song']['year'], 2001)
+
+        for bad in ('', 'a,b', '1,-2', ','.join(['1'] * (BATCH_MAX_IDS + 1))):
+            self.assertEqual(self.client.get(url, {'ids': bad}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_random_and_shuffle(self):
+        """test random songs and the paged, artist-spaced shuffle queue"""
+        self.client.force_authenticate(user=self.regular_user)
+        Song.objects.bulk_create([
+            Song(
+                title=f'Shuffle {artist} {i}', artist=artist, album=f'{artist} Album', year=1985 + i,
+                duration=200, spotify_url=f'https://open.spotify.com/track/shuffle{artist}{i}',
+                genre=Genre.ROCK if artist == 'Alpha' else Genre.JAZZ, decade='80s',
+            )
+            for artist in ('Alpha', 'Beta', 'Gamma') for i in range(4)
+        ])
+
+        response = self.client.get(reverse('song-random-songs'), {'n': 3, 'genre': 'Rock'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        picked = response.data['data']
+        self.assertEqual(len(picked), 3)
+        self.assertEqual(len({song['id'] for song in picked}), 3)
+        self.assertTrue(all(song['artist'] == 'Alpha' for song in picked))
+        # asking for more than there is returns everything that matches
+        self.assertEqual(len(self.client.get(reverse('song-random-songs'), {'n': 50, 'genre': 'Rock'}).data['data']), 4)
+
+        url = reverse('song-shuffle')
+        response = self.client.get(url, {'seed': 7, 'page_size': 5, 'decade': '80s'})
+        self.assertEqual(response.data['pagination']['total'], 12)
+        self.assertIsNone(response.data['pagination']['previous'])
+        order, order_ids = [], []
+        while True:
+            self.assertTrue(response.data['data'])
+            order.extend(song['artist'] for song in response.data['data'])
+            order_ids.extend(song['id'] for song in response.data['data'])
+            if response.data['pagination']['next'] is None:
+                break
+            response = self.client.get(response.data['pagination']['next'])
+        self.assertEqual(len(order_ids), 12)
+        self.assertEqual(len(set(order_ids)), 12)
+        # artists take turns instead of bunching up
+        self.assertFalse(any(a == b for a, b in zip(order, order[1:])))
+
+        # same seed, same order; the seed comes back when the server picks one
+        again = self.client.get(url, {'seed': 7, 'page_size': 100, 'decade': '80s'}).data['data']
+        self.assertEqual([song['id'] for song in again], order_ids)
+        self.assertIsInstance(self.client.get(url).data['pagination']['seed'], int)
+        self.assertEqual(self.client.get(url, {'seed': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url, {'seed': 7, 'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data['detail'], get_message('errors.song.list.invalid_cursor'))
+
+    def test_playlists(self):
+        """test playlist ordering, single-row moves, rebalancing and joined paging"""
+        from unittest import mock
+        from django.db import connection
+        from . import playlists
+        from django.test.utils import CaptureQueriesContext
+        from .models import PlaylistEntry
+        self.client.force_authenticate(user=self.admin_user)
+        songs = Song.objects.bulk_create([
+            Song(
+                title=f'Playlist Song {i}', artist='Mix Artist', album=f'Mix Album {i}', year=2000,
+                duration=200, spotify_url=f'https://open.spotify.com/track/mix{i}', genre=Genre.POP,
+            )
+            for i in range(6)
+        ])
+        ids = [song.pk for song in songs]
+
+        response = self.client.post(reverse('playlist-list'), {'name': 'Road Trip'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        playlist = response.data['data']['id']
+        entries_url = reverse('playlist-entries', kwargs={'pk': playlist})
+
+        # one bulk insert for the whole append
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(entries_url, {'songs': ids[:4]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('INSERT')]), 1)
+        entry_ids = [entry['id'] for entry in response.data['data']]
+        response = self.client.post(entries_url, {'songs': [ids[4]], 'before': entry_ids[0]}, format='json')
+        entry_ids.insert(0, response.data['data'][0]['id'])
+        self.assertEqual(
+            self.client.post(entries_url, {'songs': [ids[5], 999999]}, format='json').status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+        def order():
+            return [entry['id'] for entry in self.client.get(entries_url, {'page_size': 500}).data['data']]
+        self.assertEqual(order(), entry_ids)
+
+        # a move writes one row
+        entry_url = reverse('playlist-entry', kwargs={'pk': playlist, 'entry_id': entry_ids[4]})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(entry_url, {'after': entry_ids[0]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE')]), 1)
+        entry_ids.insert(1, entry_ids.pop(4))
+        self.assertEqual(order(), entry_ids)
+
+        # keep moving into the same gap until it runs out of ranks and gets rebalanced
+        with mock.patch('music.playlists.rebalance', wraps=playlists.rebalance) as rebalance:
+            for _ in range(20):
+                first, second = entry_ids[1], entry_ids[2]
+                url = reverse('playlist-entry', kwargs={'pk': playlist, 'entry_id': second})
+                self.client.patch(url, {'before': first}, format='json')
+                entry_ids[1], entry_ids[2] = second, first
+                self.assertEqual(order(), entry_ids)
+        self.assertEqual(rebalance.call_count, 1)
+
+        # pages: one joined query each, following the cursor
+        with CaptureQueriesContext(connection) as queries:
+            page = self.client.get(entries_url, {'page_size': 2})
+        self.assertEqual(len([q for q in queries if 'music_playlistentry' in q['sql'] and 'JOIN' in q['sql']]), 1)
+        walked = []
+        while True:
+            walked.extend(entry['id'] for entry in page.data['data'])
+            if page.data['pagination']['next'] is None:
+                break
+            page = self.client.get(page.data['pagination']['next'])
+        self.assertEqual(walked, entry_ids)
+        self.assertEqual(page.data['data'][-1]['song']['title'], Song.objects.get(
+            pk=PlaylistEntry.objects.get(pk=entry_ids[-1]).song_id).title)
+
+        response = self.client.delete(reverse('playlist-entry', kwargs={'pk': playlist, 'entry_id': entry_ids[0]}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        detail = self.client.get(reverse('playlist-detail', kwargs={'pk': playlist}))
+        self.assertEqual(detail.data['data']['song_count'], 4)
+        self.assertEqual(self.client.get(reverse('playlist-detail', kwargs={'pk': 999999})).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_smart_playlists(self):
+        """test materialized smart playlists kept up to date per song write"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .ingest import bulk_create_songs
+        from .models import SmartPlaylist
+        from .smart_playlists import materialize
+        self.client.force_authenticate(user=self.admin_user)
+        rock = Song.objects.create(
+            title='Eighties Rock', artist='Hair Band', album='Loud', year=1984, duration=170,
+            spotify_url='https://open.spotify.com/track/smart1', genre=Genre.ROCK,
+        )
+        Song.objects.create(
+            title='Nineties Rock', artist='Grunge Band', album='Louder', year=1994, duration=300,
+            spotify_url='https://open.spotify.com/track/smart2', genre=Genre.ROCK,
+        )
+
+        url = reverse('smart-playlist-list')
+        response = self.client.post(url, {'name': '80s Rock', 'filters': {'decade': '80s', 'genre': 'Rock'}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['data']['song_count'], 1)
+        eighties = response.data['data']['id']
+        short = self.client.post(url, {'name': 'Short', 'filters': {'duration_max': ' 180 '}}, format='json').data['data']
+        self.assertEqual(short['filters'], {'duration_max': '180'})
+        for filters in ({'Genre': 'Rock'}, {'year': 'soon'}, ['genre']):
+            self.assertEqual(
+                self.client.post(url, {'name': 'Bad', 'filters': filters}, format='json').status_code,
+                status.HTTP_400_BAD_REQUEST,
+            )
+
+        def members(playlist):
+            songs_url = reverse('smart-playlist-songs', kwargs={'pk': playlist})
+            return [song['id'] for song in self.client.get(songs_url).data['data']]
+        self.assertEqual(members(eighties), [rock.pk])
+        self.assertEqual(members(short['id']), sorted([self.song.pk, rock.pk], reverse=True))
+
+        # a write re-checks only that song, the filter queries never run again
+        created = self.client.post(reverse('song-list'), {
+            'title': 'Late Eighties', 'artist': 'Synth Band', 'album': 'Neon', 'year': 1988, 'duration': 200,
+            'spotify_url': 'https://open.spotify.com/track/smart3', 'genre': 'Rock',
+        }, format='json').data['data']['id']
+        self.assertEqual(members(eighties), [created, rock.pk])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.patch(reverse('song-detail', kwargs={'pk': rock.pk}), {'year': 1991}, format='json')
+        filter_queries = [q for q in queries if q['sql'].startswith('SELECT') and '"music_song"."genre" =' in q['sql']]
+        self.assertEqual(filter_queries, [])
+        self.assertEqual(members(eighties), [created])
+        self.assertEqual(members(short['id']), sorted([self.song.pk, rock.pk], reverse=True))
+        self.client.delete(reverse('song-detail', kwargs={'pk': created}))
+        self.assertEqual(members(eighties), [])
+
+        # case-insensitive filters are matched by the database on both paths, so a song write
+        # agrees with a full materialize even where its case folding differs from python's
+        accented = self.client.post(url, {'name': 'Accents', 'filters': {'title': 'émile'}}, format='json').data['data']['id']
+        Song.objects.create(
+            title='ÉMILE', artist='Accent Band', album='Accents', year=1999, duration=200,
+            spotify_url='https://open.spotify.com/track/smart5', genre=Genre.JAZZ,
+        )
+        Song.objects.create(
+            title='émile again', artist='Accent Band', album='Accents Again', year=1999, duration=200,
+            spotify_url='https://open.spotify.com/track/smart6', genre=Genre.JAZZ,
+        )
+        incremental = members(accented)
+        self.assertTrue(incremental)
+        materialize(SmartPlaylist.objects.get(pk=accented))
+        self.assertEqual(members(accented), incremental)
+
+        # bulk ingestion bypasses Song.save, it adds memberships for the whole batch
+        bulk_create_songs([{
+            'title': 'Bulk Eighties', 'artist': 'Bulk Band', 'album': 'Bulk', 'year': 1982, 'duration': 240,
+            'spotify_url': 'https://open.spotify.com/track/smart4', 'genre': 'Rock',
+        }])
+        self.assertEqual(len(members(eighties)), 1)
+
+        # changing the filters re-materializes
+        self.client.patch(reverse('smart-playlist-detail', kwargs={'pk': eighties}), {'filters': {'genre': 'Rock'}}, format='json')
+        self.assertEqual(self.client.get(reverse('smart-playlist-detail', kwargs={'pk': eighties})).data['data']['song_count'], 3)
+
+    def test_server_timing(self):
+        """test the sampled Server-Timing header and timing log line"""
+        import json
+        from django.test import override_settings
+        url = reverse('song-list')
+
+        # other users' requests are measured and logged, but the header stays internal
+        self.client.force_authenticate(user=self.regular_user)
+        with override_settings(SERVER_TIMING_SAMPLE_RATE=1), self.assertLogs('music.timing', 'INFO') as logs:
+            response = self.client.get(url)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(len(logs.output), 1)
+        cache.clear()
+
+        self.client.force_authenticate(user=self.admin_user)
+        with override_settings(SERVER_TIMING_SAMPLE_RATE=1), self.assertLogs('music.timing', 'INFO') as logs:
+            miss = self.client.get(url)
+            hit = self.client.get(url)
+        self.assertRegex(miss['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        for metric in ('cache;dur=', 'serialize;dur=', 'render;dur=', 'total;dur='):
+            self.assertIn(metric, miss['Server-Timing'])
+        # served from the response cache: no sql, no serializer
+        self.assertIn('desc="0 queries"', hit['Server-Timing'])
+        self.assertNotIn('serialize', hit['Server-Timing'])
+
+        records = [json.loads(line.split(':', 2)[2]) for line in logs.output]
+        self.assertEqual([record['path'] for record in records], [url, url])
+        self.assertGreater(records[0]['db_queries'], 0)
+        self.assertGreater(records[1]['cache_hits'], 0)
+
+        with override_settings(SERVER_TIMING_SAMPLE_RATE=0):
+            self.assertNotIn('Server-Timing', self.client.get(url))
+
+    def test_metrics_endpoint(self):
+        """test the prometheus metrics endpoint"""
+        from django.test import override_settings
+        self.client.force_authenticate(user=self.admin_user)
+        url = reverse('song-list')
+        self.client.get(url)
+        self.client.get(url)
+        self.client.get(reverse('song-detail', args=[self.song.id]))
+        self.client.patch(reverse('song-detail', args=[self.song.id]), {'year': 1976}, format='json')
+
+        self.client.logout()
+        # fails closed: no token configured is a 404 unless DEBUG is on
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_404_NOT_FOUND)
+            with override_settings(DEBUG=True):
+                self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_200_OK)
+
+        with override_settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        for series in (
+            'songs_request_duration_seconds_bucket{action="list",status="200",le="+Inf"} 2',
+            'songs_request_duration_seconds_count{action="retrieve",status="200"} 1',
+            'songs_request_duration_seconds_count{action="partial_update",status="200"} 1',
+            'songs_cache_requests_total{family="songs_list",result="miss"} 1',
+            'songs_cache_requests_total{family="songs_list",result="hit"} 1',
+            'songs_cache_requests_total{family="song_detail",result="miss"} 1',
+            'songs_cache_invalidations_total{family="songs_list"}',
+            'songs_cache_invalidations_total{family="song_detail"}',
+            'songs_cache_invalidation_duration_seconds_count{family="song_detail"}',
+            'songs_db_queries_total ',
+            'songs_throttle_decisions_total{decision="allowed",scope="user"}',
+        ):
+            self.assertIn(series, body)
+
+    def test_play_events(self):
+        """test buffered play events and the batched flush"""
+        import uuid
+        from unittest import mock
+        from django.test import override_settings
+        from .local_cache import _redis_connection
+        from datetime import timedelta
+        from django.db.models import Sum
+        from django.utils import timezone
+        from .models import PlayEvent, PlayRollup
+        from .plays import PLAY_GROUP, _decode, _stream_key, flush, write_events
+        self.client.force_authenticate(user=self.regular_user)
+        url = reverse('play-list')
+        event_id = str(uuid.uuid4())
+        played_at = (timezone.now() - timedelta(days=60)).replace(microsecond=0)
+        events = [
+            {'song': self.song.id, 'seconds_played': 180, 'played_at': played_at.isoformat(), 'event_id': event_id},
+            {'song': self.song.id, 'seconds_played': 30},
+        ]
+
+        # buffered, not written
+        response = self.client.post(url, {'events': events}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['data']['event_ids'][0], event_id)
+        self.assertEqual(PlayEvent.objects.count(), 0)
+
+        self.assertEqual(flush('test'), 2)
+        self.assertEqual(flush('test'), 0)
+        play = PlayEvent.objects.get(event_id=event_id)
+        self.assertEqual((play.song_id, play.user_id, play.seconds_played), (self.song.id, self.regular_user.id, 180))
+        self.assertEqual(play.played_at, played_at)
+
+        # a retried event is stored once
+        self.client.post(url, events[0], format='json')
+        flush('test')
+        self.assertEqual(PlayEvent.objects.count(), 2)
+
+        # a flusher that died before acknowledging: its batch goes to the next one
+        self.client.post(url, {'song': self.song.id, 'seconds_played': 5}, format='json')
+        connection = _redis_connection()
+        connection.xreadgroup(PLAY_GROUP, 'crashed', {_stream_key(): '>'}, count=10)
+        self.assertEqual(flush('test'), 0)
+        with mock.patch('music.plays.CLAIM_IDLE_MS', 0):
+            self.assertEqual(flush('test'), 1)
+        self.assertEqual(PlayEvent.objects.count(), 3)
+        self.assertEqual(connection.xlen(_stream_key()), 0)
+
+        for bad, field in (
+            ({'song': 'x', 'seconds_played': 1}, 'song'),
+            ({'song': self.song.id, 'seconds_played': -1}, 'seconds_played'),
+            ({'song': self.song.id, 'seconds_played': 1, 'played_at': 'yesterday'}, 'played_at'),
+            # far outside the chart windows either way
+            ({'song': self.song.id, 'seconds_played': 1, 'played_at': '2001-01-01T00:00:00Z'}, 'played_at'),
+            ({'song': self.song.id, 'seconds_played': 1,
+              'played_at': (timezone.now() + timedelta(days=1)).isoformat()}, 'played_at'),
+            ({'song': self.song.id, 'seconds_played': 1, 'event_id': 'nope'}, 'event_id'),
+        ):
+            response = self.client.post(url, {'events': [events[1], bad]}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(f"'{field}' in play event 1", response.data['message'])
+        self.assertEqual(connection.xlen(_stream_key()), 0)
+
+        # events for a song deleted before the flush are dropped
+        doomed = Song.objects.create(title='Gone', artist='Nobody', year=2001, duration=100,
+                                     spotify_url='https://open.spotify.com/track/gone1')
+        self.client.post(url, {'song': doomed.id, 'seconds_played': 5}, format='json')
+        doomed.delete()
+        self.assertEqual(flush('test'), 1)
+        self.assertEqual(PlayEvent.objects.count(), 3)
+
+        with mock.patch('music.plays.PLAY_BUFFER_MAX', 0):
+            response = self.client.post(url, events[1], format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '5')
+
+        with override_settings(METRICS_TOKEN='s3cret'):
+            body = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret').content.decode()
+        for series in (
+            'songs_play_events_received_total 5',
+            'songs_play_events_flushed_total 3',
+            'songs_play_events_dropped_total{reason="duplicate"} 1',
+            'songs_play_events_dropped_total{reason="song_deleted"} 1',
+            'songs_play_events_rejected_total{reason="buffer_full"} 1',
+            'songs_play_events_buffered 0',
+            'songs_play_events_pending 0',
+            'songs_play_event_flush_duration_seconds_count 4',
+        ):
+            self.assertIn(series, body)
+
+        # two flushers writing the same batch (the second claimed it before the first could
+        # acknowledge): the play and its rollups are stored once
+        self.client.post(url, {'song': self.song.id, 'seconds_played': 7}, format='json')
+        entries = connection.xreadgroup(PLAY_GROUP, 'slow', {_stream_key(): '>'}, count=10)[0][1]
+        self.assertEqual(write_events([_decode(fields) for _, fields in entries]), 1)
+        with mock.patch('music.plays.CLAIM_IDLE_MS', 0):
+            self.assertEqual(flush('test'), 1)
+        self.assertEqual(PlayEvent.objects.count(), 4)
+        for bucket in (PlayRollup.HOUR, PlayRollup.DAY):
+            rollups = PlayRollup.objects.filter(bucket=bucket).aggregate(plays=Sum('plays'))
+            self.assertEqual(rollups['plays'], 4)
+
+    def test_play_charts(self):
+        """test top songs, top artists and listening time from the play rollups"""
+        from datetime import timedelta
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .charts import rebuild_play_charts
+        from unittest import mock
+        from .models import PlayRollup
+        from django.utils import timezone
+        from .plays import flush
+        self.client.force_authenticate(user=self.regular_user)
+        other = Song.objects.create(title='Other Song', artist='Other Artist', year=1985, duration=200,
+                                    spotify_url='https://open.spotify.com/track/other1', genre=Genre.ROCK)
+        old = (timezone.now() - timedelta(days=30)).isoformat()
+        events = (
+            [{'song': self.song.id, 'seconds_played': 100}] * 2
+            + [{'song': other.id, 'seconds_played': 60}] * 3
+            + [{'song': self.song.id, 'seconds_played': 50, 'played_at': old}] * 4
+        )
+        self.client.post(reverse('play-list'), {'events': events}, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            flush('test')
+        self.assertEqual(PlayRollup.objects.filter(bucket=PlayRollup.DAY).count(), 3)
+
+        def chart(name, window):
+            response = self.client.get(reverse(f'song-{name}'), {'window': window})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response.data['data']
+
+        week = chart('top', 'week')['songs']
+        self.assertEqual([(row['song']['id'], row['plays']) for row in week], [(other.id, 3), (self.song.id, 2)])
+        self.assertEqual(week[0]['song']['title'], 'Other Song')
+        alltime = chart('top', 'all')['songs']
+        self.assertEqual([(row['song']['id'], row['plays']) for row in alltime], [(self.song.id, 6), (other.id, 3)])
+        self.assertEqual(chart('top-artists', 'day')['artists'],
+                         [{'artist': 'Other Artist', 'plays': 3}, {'artist': 'Test Artist', 'plays': 2}])
+        listening = chart('listening', 'all')
+        self.assertEqual(listening['genre'], {Genre.POP: 400, Genre.ROCK: 180})
+        self.assertEqual(listening['decade'], {'80s': 180, '20s': 400})
+        self.assertEqual(listening['seconds'], 580)
+
+        # answered from redis, the play events are never aggregated
+        with CaptureQueriesContext(connection) as queries:
+            chart('top-artists', 'week')
+            chart('listening', 'day')
+        self.assertFalse(any('music_playevent' in query['sql'] for query in queries.captured_queries))
+
+        # redis lost the charts: reloaded from the rollups; rebuilt from the events on demand
+        cache.clear()
+        self.assertEqual(chart('top', 'all')['songs'][0]['plays'], 6)
+        PlayRollup.objects.all().delete()
+        rebuild_play_charts()
+        self.assertEqual(PlayRollup.objects.filter(bucket=PlayRollup.HOUR).count(), 3)
+        self.assertEqual(chart('listening', 'week')['seconds'], 380)
+
+        # a deleted song leaves every chart, in redis as in the rollup table
+        for window in ('day', 'week', 'all'):
+            self.assertIn('Other Artist', [row['artist'] for row in chart('top-artists', window)['artists']])
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertEqual([row['song']['id'] for row in chart('top', 'all')['songs']], [self.song.id])
+        answers = {
+            (name, window): chart(name, window)
+            for name in ('top-artists', 'listening') for window in ('day', 'week', 'all')
+        }
+        self.assertEqual(answers[('top-artists', 'week')]['artists'], [{'artist': 'Test Artist', 'plays': 2}])
+        self.assertEqual(answers[('listening', 'all')]['genre'], {Genre.POP: 400})
+        with mock.patch('music.charts._redis_connection', return_value=None):
+            for (name, window), answer in answers.items():
+                self.assertEqual(chart(name, window), answer)
+        self.assertEqual(self.client.get(reverse('song-top'), {'window': 'year'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_cover_art_thumbnails(self):
+        """test cover art thumbnails, fetched once from a local stand-in and cached on disk"""
+        import os
+        import socket
+        import tempfile
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from io import BytesIO
+        from unittest import mock
+        from django.test import override_settings
+        from PIL import Image
+        from .cover_art import CheckedRedirectHandler, CoverArtStore, CoverArtUnavailable, fetch
+
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 900), (200, 30, 30)).save(buffer, 'JPEG')
+        image = buffer.getvalue()
+        fetched, hosts = [], []
+
+        class Origin(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fetched.append(self.path)
+                hosts.append(self.headers['Host'])
+                if self.path.startswith('/broken'):
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.end_headers()
+                self.wfile.write(image)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Origin)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+        origin = f'http://127.0.0.1:{server.server_port}'
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+
+        # by default the server never fetches from its own network, redirects included
+        self.client.force_authenticate(user=self.admin_user)
+        with override_settings(COVER_ART_ROOT=root.name):
+            private = Song.objects.create(title='Private', artist='Test Artist', year=2020, duration=100,
+                                          spotify_url='https://open.spotify.com/track/private1',
+                                          cover_art_url=f'{origin}/covers/private.jpg')
+            private_url = self.client.get(reverse('song-detail', args=[private.id])).data['data']['cover_art_url']
+            self.assertEqual(self.client.get(private_url).status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(fetched, [])
+            private.delete()
+            with self.assertRaises(CoverArtUnavailable):
+                CheckedRedirectHandler().redirect_request(None, None, 302, 'Found', {}, 'http://169.254.169.254/latest/')
+
+        # the stand-in origin is on loopback
+        with override_settings(COVER_ART_ROOT=root.name, COVER_ART_ALLOW_PRIVATE_SOURCES=True):
+            self.song.cover_art_url = f'{origin}/covers/one.jpg'
+            self.song.save()
+            detail = self.client.get(reverse('song-detail', args=[self.song.id])).data['data']
+            url = detail['cover_art_url']
+            # absolute, on the origin the api was reached at, so another origin's page can load it
+            self.assertTrue(url.startswith(f'http://testserver/api/covers/{self.song.id}/'))
+            self.assertTrue(url.endswith('/large.jpg'))
+            self.assertEqual(self.client.get(reverse('song-list')).data['data'][0]['cover_art_url'], url)
+
+            # a GET sent back unchanged keeps the original
+            self.client.patch(reverse('song-detail', args=[self.song.id]), {'cover_art_url': url}, format='json')
+            self.song.refresh_from_db()
+            self.assertEqual(self.song.cover_art_url, f'{origin}/covers/one.jpg')
+
+            self.client.logout()
+            sizes = {}
+            for size in ('large', 'small', 'large'):
+                response = self.client.get(url.replace('large.jpg', f'{size}.jpg'))
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response['Content-Type'], 'image/jpeg')
+                self.assertIn('immutable', response['Cache-Control'])
+                sizes[size] = Image.open(BytesIO(b''.join(response.streaming_content))).size
+                etag = response['ETag']
+                response.close()
+            self.assertEqual(sizes, {'large': (320, 320), 'small': (80, 80)})
+            self.assertEqual(fetched, ['/covers/one.jpg'])
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+            # the same image under another url shares the cached files
+            thumbs = sorted(os.listdir(os.path.join(root.name, 'thumbs')))
+            twin = Song.objects.create(title='Twin', artist='Test Artist', year=2020, duration=100,
+                                       spotify_url='https://open.spotify.com/track/twin1',
+                                       cover_art_url=f'{origin}/covers/two.jpg')
+            twin_url = self.client.get(f'/api/covers/{twin.id}/x/large.jpg')['Location']
+            response = self.client.get(twin_url)
+            self.assertEqual(response['ETag'], etag)
+            response.close()
+            self.assertEqual(sorted(os.listdir(os.path.join(root.name, 'thumbs'))), thumbs)
+
+            # failures are remembered instead of hitting the origin again
+            twin.cover_art_url = f'{origin}/broken.jpg'
+            twin.save()
+            broken_url = self.client.get(f'/api/covers/{twin.id}/x/small.jpg')['Location']
+            self.assertEqual(self.client.get(broken_url).status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(self.client.get(broken_url).status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(fetched.count('/broken.jpg'), 1)
+
+            # the fetch connects to the address that was checked, even if the host's dns
+            # answer changes right after (rebinding), and still sends the url's host
+            resolve = socket.getaddrinfo
+            answers = iter([[(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', ('127.0.0.1', 0))]])
+
+            def rebinding(host, *args, **kwargs):
+                if host == 'covers.invalid':
+                    return next(answers)
+                return resolve(host, *args, **kwargs)
+
+            with mock.patch('socket.getaddrinfo', side_effect=rebinding):
+                self.assertEqual(fetch(f'http://covers.invalid:{server.server_port}/covers/pinned.jpg'), image)
+            self.assertEqual(hosts[-1], f'covers.invalid:{server.server_port}')
+
+        # least recently used thumbnails go first once the byte budget is exceeded
+        store = CoverArtStore(root.name + '/lru', max_bytes=2500)
+        for index in range(3):
+            store.put(f'source{index}', f'{index:064x}', {'small': b'x' * 1000})
+            os.utime(store._thumb_path(f'{index:064x}', 'small'), (index, index))
+        self.assertLessEqual(store.usage(), 2500)
+        self.assertIsNone(store.get(f'{0:064x}', 'small'))
+        self.assertIsNotNone(store.get(f'{2:064x}', 'small'))
@@ -0,0 +1,25 @@
+from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
+
+from .metrics import metrics
+
+"""
+- DRF's anon/user rate throttles, counting their decisions for /metrics
+"""
+
+
+class MeteredThrottleMixin:
+    def allow_request(self, request, view):
+        allowed = super().allow_request(request, view)
+        # scope is None when the throttle doesn't apply (e.g. anon throttle, logged in user)
+        if self.rate is not None and getattr(self, 'key', None) is not None:
+            metrics.inc('songs_throttle_decisions_total', scope=self.scope,
+                        decision='allowed' if allowed else 'throttled')
+        return allowed
+
+
+class MeteredAnonRateThrottle(MeteredThrottleMixin, AnonRateThrottle):
+    pass
+
+
+class MeteredUserRateThrottle(MeteredThrottleMixin, UserRateThrottle):
+    pass
@@ -0,0 +1,28 @@
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+"""
+- cover art resizing, run in cover_art's process pool
+- imports nothing from django, so a pool process starts without setting django up
+"""
+
+
+def render_thumbnails(data, sizes, quality):
+    """
+    - {name: jpeg bytes} of an image for {name: pixels per side}, every size from one decode
+    - square crops, like the UI's object-cover
+    """
+    largest = max(sizes.values())
+    with Image.open(BytesIO(data)) as image:
+        # jpeg decodes straight to a smaller scale when it is at least twice the largest size
+        image.draft('RGB', (largest * 2, largest * 2))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        thumbnails = {}
+        for name, pixels in sizes.items():
+            buffer = BytesIO()
+            ImageOps.fit(image, (pixels, pixels), Image.Resampling.LANCZOS).save(
+                buffer, 'JPEG', quality=quality, optimize=True
+            )
+            thumbnails[name] = buffer.getvalue()
+    return thumbnails
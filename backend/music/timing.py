@@ -0,0 +1,255 @@
+import contextvars
+import json
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django_redis.client import DefaultClient
+
+logger = logging.getLogger(__name__)
+
+"""
+- per-request performance breakdown: sql queries and time, cache calls/hits/misses and
+  time, serializer time, render time and the total
+- logged as one json line on the `music.timing` logger, and sent back as a Server-Timing
+  header (visible in the browser devtools network panel) to staff users only, or to
+  anyone with DEBUG on: it tells a client how long our queries and cache calls take
+- sampled: SERVER_TIMING_SAMPLE_RATE of requests are measured (none by default), the
+  others pay one context variable lookup per sql query / cache call / span
+- sql is timed by an execute wrapper installed on every database connection, cache calls
+  by TimedRedisClient (the django-redis CLIENT_CLASS) and the async read path's redis
+  client, serialize/render by span() around the code that does them
+"""
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """measurements for one sampled request, times in seconds"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.cache_calls = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_time = 0.0
+        self.local_hits = 0
+        self.local_misses = 0
+        self.spans = {}
+        # cache client methods call each other (add -> set), only the outer call counts
+        self.cache_depth = 0
+
+    def add_span(self, name, duration):
+        self.spans[name] = self.spans.get(name, 0.0) + duration
+
+    def header(self, total):
+        """Server-Timing header value"""
+        metrics = [
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.db_queries} queries"',
+            f'cache;dur={self.cache_time * 1000:.2f};'
+            f'desc="{self.cache_calls} calls, {self.cache_hits} hits, {self.cache_misses} misses"',
+        ]
+        if self.local_hits or self.local_misses:
+            metrics.append(f'local;desc="{self.local_hits} hits, {self.local_misses} misses"')
+        metrics.extend(f'{name};dur={duration * 1000:.2f}' for name, duration in self.spans.items())
+        metrics.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(metrics)
+
+    def record(self, request, response, total):
+        """the structured log entry"""
+        return {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 3),
+            'db_queries': self.db_queries,
+            'db_ms': round(self.db_time * 1000, 3),
+            'cache_calls': self.cache_calls,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_ms': round(self.cache_time * 1000, 3),
+            'local_hits': self.local_hits,
+            'local_misses': self.local_misses,
+            **{f'{name}_ms': round(duration * 1000, 3) for name, duration in self.spans.items()},
+        }
+
+
+class span:
+    """
+    - time a block into the current request's measurements, e.g. with span('serialize'): ...
+    - a no-op outside a sampled request
+    """
+    __slots__ = ('name', 'timings', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.timings = _current.get()
+        if self.timings is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings.add_span(self.name, time.perf_counter() - self.started)
+
+
+def record_local_lookup(hit):
+    """count an in-process cache tier lookup"""
+    timings = _current.get()
+    if timings is not None:
+        if hit:
+            timings.local_hits += 1
+        else:
+            timings.local_misses += 1
+
+
+def timed_execute(execute, sql, params, many, context):
+    """database execute wrapper, installed on every connection by install_db_timing()"""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_time += time.perf_counter() - started
+        timings.db_queries += 1
+
+
+def install_db_timing(sender, connection, **kwargs):
+    """connection_created receiver"""
+    if timed_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(timed_execute)
+
+
+class timed_cache_call:
+    """
+    - time one cache call, e.g. with timed_cache_call() as call: ...; call.outcome(hits, misses)
+    - used by TimedRedisClient and the async read path's redis client
+    """
+    __slots__ = ('timings', 'started', 'outer')
+
+    def __enter__(self):
+        self.timings = _current.get()
+        if self.timings is not None:
+            self.outer = self.timings.cache_depth == 0
+            self.timings.cache_depth += 1
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        timings = self.timings
+        if timings is not None:
+            timings.cache_depth -= 1
+            if self.outer:
+                timings.cache_calls += 1
+                timings.cache_time += time.perf_counter() - self.started
+
+    def outcome(self, hits, misses):
+        if self.timings is not None and self.outer:
+            self.timings.cache_hits += hits
+            self.timings.cache_misses += misses
+
+
+_MISSING = object()
+
+
+class TimedRedisClient(DefaultClient):
+    """django-redis client that reports its calls to the current request's timings"""
+
+    def get(self, key, default=None, version=None, client=None):
+        with timed_cache_call() as call:
+            value = super().get(key, default=_MISSING, version=version, client=client)
+            call.outcome(value is not _MISSING, value is _MISSING)
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, version=None, client=None):
+        with timed_cache_call() as call:
+            values = super().get_many(keys, version=version, client=client)
+            call.outcome(len(values), len(keys) - len(values))
+        return values
+
+    def set(self, *args, **kwargs):
+        with timed_cache_call():
+            return super().set(*args, **kwargs)
+
+    def set_many(self, *args, **kwargs):
+        with timed_cache_call():
+            return super().set_many(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with timed_cache_call():
+            return super().delete(*args, **kwargs)
+
+    def delete_many(self, *args, **kwargs):
+        with timed_cache_call():
+            return super().delete_many(*args, **kwargs)
+
+    def incr(self, *args, **kwargs):
+        with timed_cache_call():
+            return super().incr(*args, **kwargs)
+
+
+class ServerTimingMiddleware:
+    """
+    - measures a sample of requests, logs the breakdown and adds the Server-Timing header
+      for trusted clients
+    - first in MIDDLEWARE so the total covers the whole stack; works under WSGI and ASGI
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def _sampled():
+        rate = settings.SERVER_TIMING_SAMPLE_RATE
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+    @staticmethod
+    def _trusted(request):
+        """whether the client may see the breakdown; request.user is set by then, by django or DRF"""
+        if settings.DEBUG:
+            return True
+        user = getattr(request, 'user', None)
+        return bool(user is not None and user.is_authenticated and user.is_staff)
+
+    def _finish(self, request, response, timings):
+        total = time.perf_counter() - timings.started
+        if self._trusted(request):
+            response['Server-Timing'] = timings.header(total)
+        logger.info(json.dumps(timings.record(request, response, total)))
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timings)
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timings)
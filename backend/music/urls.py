@@ -1,12 +1,35 @@
-from django.urls import path, include
+from django.conf import settings
+from django.urls import path, include, re_path
 from rest_framework.routers import DefaultRouter
-from .views import SongViewSet
+from .async_views import async_read_view
+from .cover_art import cover_art_view
+from .views import PlayEventViewSet, PlaylistViewSet, SmartPlaylistViewSet, SongViewSet
 
 # create a router and register our viewsets with it
 router = DefaultRouter()
 router.register(r'songs', SongViewSet, basename='song')
+router.register(r'playlists', PlaylistViewSet, basename='playlist')
+router.register(r'smart-playlists', SmartPlaylistViewSet, basename='smart-playlist')
+router.register(r'plays', PlayEventViewSet, basename='play')
+
+
+def song_urls(async_reads):
+    """
+    - the router's urls, with song-list / song-detail served by the async read path when
+      async_reads is on (same patterns and names, writes still reach the viewset)
+    """
+    urls = router.urls
+    if not async_reads:
+        return urls
+    return [
+        re_path(url.pattern.regex.pattern, async_read_view(url.callback), name=url.name)
+        if url.name in ('song-list', 'song-detail') else url
+        for url in urls
+    ]
+
 
 # the api urls are now determined automatically by the router
 urlpatterns = [
-    path('', include(router.urls)),
-] 
\ No newline at end of file
+    path('', include(song_urls(settings.ASYNC_SONG_READS))),
+    path('covers/<int:song_id>/<str:digest>/<str:size>.jpg', cover_art_view, name='cover-art'),
+] 
@@ -1,41 +1,91 @@
 from rest_framework import viewsets, status, serializers
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
-from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
-from django_filters.rest_framework import DjangoFilterBackend, FilterSet, CharFilter, NumberFilter
-from .models import Song
-from .serializers import SongSerializer
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny, SAFE_METHODS
+from .filters import SongFilter
+from .models import Playlist, PlaylistEntry, SmartPlaylist, Song
+from .serializers import PlaylistSerializer, SmartPlaylistSerializer, SongSerializer, song_read_serializer
+from .plays import PLAY_BATCH_MAX, BufferFull, enqueue, parse_event
+from .smart_playlists import (
+    MAX_PAGE_SIZE as SMART_PLAYLIST_MAX_PAGE_SIZE,
+    PAGE_SIZE as SMART_PLAYLIST_PAGE_SIZE,
+    materialize,
+    member_rows,
+)
+from .playlists import (
+    APPEND_MAX_SONGS,
+    MAX_PAGE_SIZE as PLAYLIST_MAX_PAGE_SIZE,
+    PAGE_SIZE as PLAYLIST_PAGE_SIZE,
+    add_songs,
+    after_page_link,
+    decode_after_cursor,
+    entry_rows,
+    move_entry,
+)
+from .pagination import SongCursorPagination
+from .search import SEARCH_RESULT_LIMIT, is_search_request
+from .ingest import BULK_MAX_ROWS, bulk_create_songs
+from .export import EXPORT_FORMATS, ExportContentNegotiation
+from .facets import facet_counts, rollup_facet_counts
+from .charts import CHART_LIMIT, CHART_MAX, CHART_SLACK, WINDOWS, listening_time, top
+from .shuffle import (
+    RANDOM_MAX,
+    ShuffleQueue,
+    decode_shuffle_cursor,
+    random_song_ids,
+    shuffle_page_link,
+)
+from .caching import (
+    NEGATIVE_TTL,
+    canonical_list_params,
+    detail_cache_key,
+    get_cache_stats,
+    get_list_generation,
+    get_list_version,
+    get_many_or_build,
+    get_or_build,
+    list_cache_key,
+    record_detail_lookup,
+    record_detail_lookups,
+    record_list_lookup,
+)
+from .local_cache import MISSING, song_details, start_invalidation_listener
+from .conditional import list_validators, not_modified_response, set_validators, song_validators
+from .renderers import RenderedEnvelope
+from .timing import span
 from django.utils import timezone
 from .utils import get_message
-from django.core.cache import cache
 from django.conf import settings
+from django.db.models import Count
+from django.http import Http404, StreamingHttpResponse
+import random
+
+# most songs one GET /songs/batch/ can ask for
+BATCH_MAX_IDS = 200
+
+
+class ErrorResponseMixin:
+    """the error envelope every viewset answers with, shared with the async read path"""
+
+    def error_response(self, message_key, code, error=None, **extra):
+        """error envelope, extra formats the message"""
+        response = {
+            "status": "error",
+            "code": code,
+            "message": get_message(message_key, **extra),
+        }
+        if error is not None:
+            response["error"] = str(error)
+        response["timestamp"] = timezone.now().isoformat()
+        return Response(response, status=code)
 
-class SongFilter(FilterSet):
-    """filter songs by various fields"""
-    title = CharFilter(lookup_expr='icontains')
-    artist = CharFilter(lookup_expr='icontains')
-    genre = CharFilter(lookup_expr='exact')
-    decade = CharFilter(lookup_expr='exact')
-    year = NumberFilter()
-    year_min = NumberFilter(field_name='year', lookup_expr='gte')
-    year_max = NumberFilter(field_name='year', lookup_expr='lte')
-
-    class Meta:
-        model = Song
-        fields = ['title', 'artist', 'genre', 'decade', 'year']
-
-class StandardResultsSetPagination(PageNumberPagination):
-    """standard pagination for list endpoints"""
-    page_size = 10
-    page_size_query_param = 'page_size'
-    max_page_size = 100
 
 # ViewSets bundle CRUD operations (GET/POST/PUT/DELETE) into a single class
 # ModelViewSet provides default implementations for all actions
 # the default actions are: list, create, retrieve, update, partial_update, destroy
 # these get overriden to customize the respone
-class SongViewSet(viewsets.ModelViewSet):
+class SongViewSet(ErrorResponseMixin, viewsets.ModelViewSet):
     """
     - CRUD endpoints for song model 
     - inherits from ModelViewSet which provides default CRUD operations
@@ -47,6 +97,16 @@ class SongViewSet(viewsets.ModelViewSet):
     - PUT /songs/<id>/ - update a song (full update)
     - PATCH /songs/<id>/ - update a song (partial update)
     - DELETE /songs/<id>/ - delete a song
+    - POST /songs/bulk/ - create up to BULK_MAX_ROWS songs in one request
+    - GET /songs/export/?format=ndjson|csv - stream the (filtered) catalog
+    - GET /songs/facets/ - song counts per genre/decade/year plus total duration (filterable)
+    - GET /songs/batch/?ids=1,2,3 - up to BATCH_MAX_IDS songs by id, in the order asked for
+    - GET /songs/random/?n=10 - n songs picked uniformly at random (filterable)
+    - GET /songs/shuffle/?seed=42 - seeded, artist-spaced shuffle of the (filtered) library, in pages
+    - GET /songs/top/?window=week - most played songs over the last day, week or all time
+    - GET /songs/top-artists/?window=week - most played artists
+    - GET /songs/listening/?window=week - seconds listened per genre and decade
+    - GET /songs/cache-stats/ - list/detail cache hit/miss/invalidation counters (admin)
 
     filtering:
     - ?title=song_title - search by title (case-insensitive)
@@ -55,12 +115,20 @@ class SongViewSet(viewsets.ModelViewSet):
     - ?decade=80s - filter by exact decade
     - ?year=1985 - filter by exact year
     - ?year_min=1980&year_max=1989 - filter by year range
+
+    search:
+    - ?q=bohemian rhap - ranked, typo-tolerant search over title/artist/album
+      (returns the top SEARCH_RESULT_LIMIT matches, best first)
+
+    pagination:
+    - ?page_size=25 - return the first 25 songs plus a next cursor
+    - ?cursor=<token> - follow the next/previous links from a previous page
     """
 
     # queryset: defines which data to expose (all songs in this case)
     queryset = Song.objects.all().order_by('-created_at')
     serializer_class = SongSerializer # serializer class to convert model instances to json
-    pagination_class = StandardResultsSetPagination # add pagination
+    pagination_class = SongCursorPagination # keyset pagination over (created_at, id)
     filterset_class = SongFilter # add filtering
     
     def get_permissions(self):
@@ -71,94 +139,141 @@ class SongViewSet(viewsets.ModelViewSet):
         if settings.DEBUG:
             permission_classes = [AllowAny]
         else:
-            if self.action in ['list', 'retrieve']:
+            if self.action in ['list', 'retrieve', 'batch', 'random_songs', 'shuffle', 'facets',
+                               'top', 'top_artists', 'listening']:
                 permission_classes = [IsAuthenticated]
             else:
                 permission_classes = [IsAdminUser]
         return [permission() for permission in permission_classes]
 
+    def get_read_queryset(self, request):
+        """
+        - rows for the list endpoint: plain .values() for the fast serializer, no model instances
+        - search results are ordered by relevance and capped, keyset cursors don't apply
+        """
+        rows = song_read_serializer.values(self.filter_queryset(self.get_queryset()))
+        if is_search_request(request):
+            rows = rows[:SEARCH_RESULT_LIMIT]
+        return rows
+
+    def render_list(self, rows, page):
+        """
+        - pre-rendered list envelope (no timestamp) for a page, or for all rows if unpaginated
+        - shared by list() and the async read path
+        """
+        # cursors are taken from the raw rows, before serialize() converts them in place
+        pagination = self.paginator.get_pagination_data() if page is not None else None
+        with span('serialize'):
+            data = song_read_serializer.serialize(page if page is not None else rows, self.request)
+        response_data = {
+            "status": "success",
+            "code": status.HTTP_200_OK,
+            "data": data,
+        }
+        if pagination is not None:
+            response_data["pagination"] = pagination
+
+        # encoded once, the same bytes are cached and sent; the timestamp is added on the way out
+        return RenderedEnvelope.render(response_data).body
+
+    def render_detail(self, instance):
+        """
+        - detail cache entry: (etag, last_modified, pre-rendered body)
+        - shared by retrieve() and the async read path
+        """
+        etag, last_modified = song_validators(instance.pk, instance.updated_at)
+        with span('serialize'):
+            data = self.get_serializer(instance).data
+        response = {
+            "status": "success",
+            "code": status.HTTP_200_OK,
+            "data": data,
+            "links": {
+                "collection": self.request.build_absolute_uri('/songs/'),
+                "spotify": instance.spotify_url,
+            },
+        }
+        return etag, last_modified, RenderedEnvelope.render(response).body
+
     def list(self, request, *args, **kwargs):
         """
         - list endpoint: get /songs/
-        - cached for 5 minutes
+        - paginated by keyset cursor when ?cursor= or ?page_size= is given
+        - cached for 5 minutes, each page under its own key, as pre-rendered JSON bytes
+        - keys carry the list generation, so writes invalidate without deleting
+        - keys are built from the canonical filter/pagination/ordering params only
+        - conditional: answers If-None-Match / If-Modified-Since with 304 before
+          touching the cache body or the database
+        - rebuilt single-flight with early refresh, see caching.get_or_build
         """
         try:
 
-            cache_key = f"songs_list_{request.query_params}"
-            cached_response = cache.get(cache_key)
-            
-            if cached_response:
-                return Response(cached_response)
+            generation, last_modified = get_list_version()
+            cache_key = list_cache_key(request.query_params, self.filterset_class, generation)
+            etag, last_modified = list_validators(cache_key, last_modified)
+            not_modified = not_modified_response(request, etag, last_modified)
+            if not_modified is not None:
+                return not_modified
 
-            queryset = self.filter_queryset(self.get_queryset())
-            serializer = self.get_serializer(queryset, many=True)
-            response_data = {
-                "status": "success",
-                "code": status.HTTP_200_OK,
-                "data": serializer.data,
-                "timestamp": timezone.now().isoformat()
-            }
-            
-            cache.set(cache_key, response_data, settings.CACHE_TTL)
-            
-            return Response(response_data)
+            def build():
+                rows = self.get_read_queryset(request)
+                page = None if is_search_request(request) else self.paginate_queryset(rows)
+                return self.render_list(rows, page)
+
+            # single-flight: concurrent misses on this key share one rebuild
+            body, state = get_or_build(cache_key, build)
+            record_list_lookup(hit=state != 'miss', stale=state == 'stale')
+
+            return set_validators(Response(RenderedEnvelope(body)), etag, last_modified)
+        except APIException:
+            # e.g. the paginator's invalid cursor 404, rendered by DRF like the other cursors
+            raise
         except Exception as e:
-            return Response({
-                "status": "error",
-                "code": status.HTTP_400_BAD_REQUEST,
-                "message": get_message('errors.song.list.failed'),
-                "error": str(e),
-                "timestamp": timezone.now().isoformat()
-            }, status=status.HTTP_400_BAD_REQUEST)
-            
+            # the cache or database failing is not the client's fault
+            return self.error_response('errors.song.list.failed', status.HTTP_500_INTERNAL_SERVER_ERROR, e)
 
     def retrieve(self, request, *args, **kwargs):
         """
         - retrieve endpoint: GET /songs/<id>/
-        - cached for 5 minutes
+        - cached for 5 minutes as pre-rendered JSON bytes
+        - conditional: ETag / Last-Modified come from updated_at and are cached with the
+          body, a match on a cache hit is a 304 and the song is never serialized
+        - two tiers: this worker's in-process LRU (local_cache.song_details), then redis,
+          rebuilt single-flight from the database (see caching.get_or_build)
+        - missing ids are cached too (negative entries), so repeated 404s skip the database
         """
         try: 
 
-            cache_key = f"song_detail_{kwargs.get('pk')}"
-            cached_response = cache.get(cache_key)
-            
-            if cached_response:
-                return Response(cached_response)
-
-            instance = self.get_object()
-            serializer = self.get_serializer(instance)
+            def build():
+                try:
+                    instance = self.get_object()
+                except Http404:
+                    return None
+                return self.render_detail(instance)
 
-            response = {
-                "status": "success",
-                "code": status.HTTP_200_OK,
-                "data": serializer.data, 
-                "links": {
-                    "collection": request.build_absolute_uri('/songs/'),
-                    "spotify": instance.spotify_url,
-                },
-                "timestamp": timezone.now().isoformat()
-            }
+            start_invalidation_listener()
+            cache_key = detail_cache_key(kwargs.get('pk'))
+            cached_response = song_details.get(cache_key)
+            if cached_response is MISSING:
+                # single-flight: concurrent misses on this song share one rebuild
+                cached_response, state = get_or_build(cache_key, build, negative_ttl=NEGATIVE_TTL)
+                record_detail_lookup(hit=state != 'miss')
+                song_details.set(cache_key, cached_response)
 
-            cache.set(cache_key, response, settings.CACHE_TTL)
+            if cached_response is None:
+                raise Song.DoesNotExist
 
-            return Response(response, status=status.HTTP_200_OK)
+            etag, last_modified, body = cached_response
+            not_modified = not_modified_response(request, etag, last_modified)
+            if not_modified is not None:
+                return not_modified
+            return set_validators(Response(RenderedEnvelope(body), status=status.HTTP_200_OK), etag, last_modified)
 
         except Song.DoesNotExist:
-            return Response({
-                "status": "error",
-                "code": status.HTTP_404_NOT_FOUND,
-                "message": get_message('errors.song.retrieve.not_found'),
-                "timestamp": timezone.now().isoformat()
-            }, status=status.HTTP_404_NOT_FOUND)
+            return self.error_response('errors.song.retrieve.not_found', status.HTTP_404_NOT_FOUND)
 
         except Exception as e:
-            return Response({
-                "status": "error",
-                "code": status.HTTP_400_BAD_REQUEST,
-                "message": get_message('errors.song.retrieve.failed'),
-                "error": str(e),
-                "timestamp": timezone.now().isoformat()
-            }, status=status.HTTP_400_BAD_REQUEST)
+            return self.error_response('errors.song.retrieve.failed', status.HTTP_400_BAD_REQUEST, e)
 
 
     def create(self, request, *args, **kwargs):
@@ -178,9 +293,8 @@ class SongViewSet(viewsets.ModelViewSet):
                     "timestamp": timezone.now().isoformat()
                 }, status=status.HTTP_400_BAD_REQUEST)
 
+            # the cached responses are dropped by signals.invalidate_song_responses
             self.perform_create(serializer)
-            
-            cache.delete_pattern("songs_list_*")
 
             response = {
                 "status": "success",
@@ -212,10 +326,7 @@ class SongViewSet(viewsets.ModelViewSet):
             serializer = self.get_serializer(instance, data=request.data, partial=True)
             serializer.is_valid(raise_exception=True)
             self.perform_update(serializer)
-            
-            cache.delete_pattern("songs_list_*")
-            cache.delete(f"song_detail_{kwargs.get('pk')}")
-            
+
             response = {
                 "status": "success",
                 "code": status.HTTP_200_OK,
@@ -251,9 +362,6 @@ class SongViewSet(viewsets.ModelViewSet):
             instance = self.get_object()
             self.perform_destroy(instance)
 
-            cache.delete_pattern("songs_list_*")
-            cache.delete(f"song_detail_{kwargs.get('pk')}")
-
             return Response({
                 "status": "success",
                 "code": status.HTTP_204_NO_CONTENT,
@@ -276,4 +384,657 @@ class SongViewSet(viewsets.ModelViewSet):
                 "message": get_message('errors.song.delete.failed'),
                 "error": str(e),
                 "timestamp": timezone.now().isoformat()
-            }, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        - bulk create endpoint: POST /songs/bulk/
+        - body is a list of songs, or {"songs": [...]}
+        - returns one result per row (created id or error message) plus a throughput summary
+        - 201 if every row was created, 207 if some were, 400 if none were
+        """
+        rows = request.data.get('songs') if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            return self.error_response('errors.song.bulk.invalid_payload', status.HTTP_400_BAD_REQUEST)
+
+        if len(rows) > BULK_MAX_ROWS:
+            return self.error_response('errors.song.bulk.too_many', status.HTTP_400_BAD_REQUEST, limit=BULK_MAX_ROWS)
+
+        try:
+            results, summary = bulk_create_songs(rows)
+        except Exception as e:
+            return self.error_response('errors.song.bulk.failed', status.HTTP_400_BAD_REQUEST, e)
+
+        if summary['created'] == 0 and summary['received'] > 0:
+            code, message = status.HTTP_400_BAD_REQUEST, get_message('errors.song.bulk.failed')
+        else:
+            code = status.HTTP_201_CREATED if summary['failed'] == 0 else status.HTTP_207_MULTI_STATUS
+            message = get_message('errors.song.bulk.success', **summary)
+
+        return Response({
+            "status": "success" if code != status.HTTP_400_BAD_REQUEST else "error",
+            "code": code,
+            "message": message,
+            "data": results,
+            "summary": summary,
+            "timestamp": timezone.now().isoformat()
+        }, status=code)
+
+    @action(detail=False, methods=['get'], content_negotiation_class=ExportContentNegotiation)
+    def export(self, request):
+        """
+        - export endpoint: GET /songs/export/?format=ndjson|csv
+        - honors the same filters as the list endpoint
+        - streamed in primary-key batches, never holds the whole catalog in memory
+        """
+        export_format = request.query_params.get('format', 'ndjson').lower()
+        if export_format not in EXPORT_FORMATS:
+            return self.error_response(
+                'errors.song.export.invalid_format', status.HTTP_400_BAD_REQUEST,
+                format=export_format, formats=', '.join(sorted(EXPORT_FORMATS)),
+            )
+
+        content_type, streamer = EXPORT_FORMATS[export_format]
+        queryset = self.filter_queryset(self.get_queryset())
+        response = StreamingHttpResponse(streamer(queryset), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="songs.{export_format}"'
+        return response
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        - facets endpoint: GET /songs/facets/
+        - counts per genre, decade and year plus total count and duration
+        - honors the same filters as the list endpoint, answered with one grouped query
+        - unfiltered requests read the SongFacet rollups and never touch the songs table
+        """
+        try:
+            filter_params = [
+                name for name, _ in canonical_list_params(request.query_params, self.filterset_class)
+                if name in self.filterset_class.base_filters
+            ]
+            if filter_params:
+                data = facet_counts(self.filter_queryset(self.get_queryset()))
+            else:
+                data = rollup_facet_counts()
+
+            return Response({
+                "status": "success",
+                "code": status.HTTP_200_OK,
+                "data": data,
+                "timestamp": timezone.now().isoformat()
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return self.error_response('errors.song.facets.failed', status.HTTP_400_BAD_REQUEST, e)
+
+    def cached_songs(self, ids):
+        """
+        - {id: what GET /songs/<id>/ returns as data, or None} for distinct ids
+        - reads the same cache entries as retrieve: the in-process tier first, then one redis
+          get_many for the rest; misses are loaded with one id__in query and written back
+          with set_many
+        """
+        start_invalidation_listener()
+        keys = {pk: detail_cache_key(pk) for pk in ids}
+        entries = {}
+        for key in keys.values():
+            cached_response = song_details.get(key)
+            if cached_response is not MISSING:
+                entries[key] = cached_response
+
+        remote = [key for key in keys.values() if key not in entries]
+        if remote:
+            def build_many(missing):
+                missing = set(missing)
+                pks = [pk for pk, key in keys.items() if key in missing]
+                return {
+                    detail_cache_key(instance.pk): self.render_detail(instance)
+                    for instance in self.get_queryset().order_by().filter(pk__in=pks)
+                }
+
+            cached_responses, hits = get_many_or_build(remote, build_many, negative_ttl=NEGATIVE_TTL)
+            record_detail_lookups(hits, len(remote) - hits)
+            for key, cached_response in cached_responses.items():
+                song_details.set(key, cached_response)
+                entries[key] = cached_response
+
+        return {
+            pk: RenderedEnvelope(entries[key][2])['data'] if entries[key] is not None else None
+            for pk, key in keys.items()
+        }
+
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        """
+        - batch retrieve endpoint: GET /songs/batch/?ids=3,1,2
+        - one entry per requested id, in request order: {"id", "found", "song"}, song being
+          what GET /songs/<id>/ returns as data, null when there is no such song
+        - read through the detail cache, see cached_songs()
+        """
+        try:
+            ids = [int(part) for part in request.query_params.get('ids', '').split(',') if part.strip()]
+        except ValueError:
+            ids = []
+        if not ids or min(ids) <= 0:
+            return self.error_response('errors.song.batch.invalid_ids', status.HTTP_400_BAD_REQUEST)
+        if len(ids) > BATCH_MAX_IDS:
+            return self.error_response('errors.song.batch.too_many', status.HTTP_400_BAD_REQUEST, limit=BATCH_MAX_IDS)
+
+        try:
+            songs = self.cached_songs(ids)
+            return Response({
+                "status": "success",
+                "code": status.HTTP_200_OK,
+                "data": [{"id": pk, "found": songs[pk] is not None, "song": songs[pk]} for pk in ids],
+                "timestamp": timezone.now().isoformat()
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return self.error_response('errors.song.batch.failed', status.HTTP_400_BAD_REQUEST, e)
+
+    def songs_in_order(self, ids):
+        """serialized songs for ids, in the order given, skipping ids that no longer exist"""
+        rows = song_read_serializer.serialize(
+            song_read_serializer.values(Song.objects.filter(pk__in=ids)), self.request
+        )
+        by_id = {row['id']: row for row in rows}
+        return [by_id[pk] for pk in ids if pk in by_id]
+
+    def chart_params(self, request):
+        """(window, limit) of a chart request, None for a window that doesn't exist"""
+        window = request.query_params.get('window', 'week')
+        try:
+            limit = int(request.query_params.get('limit', CHART_LIMIT))
+        except ValueError:
+            limit = CHART_LIMIT
+        return (window if window in WINDOWS else None), min(max(limit, 1), CHART_MAX)
+
+    def chart_response(self, window, data):
+        return Response({
+            "status": "success",
+            "code": status.HTTP_200_OK,
+            "data": {"window": window, **data},
+            "timestamp": timezone.now().isoformat()
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def top(self, request):
+        """
+        - top songs endpoint: GET /songs/top/?window=day|week|all&limit=25
+        - most played songs, [{"plays", "song"}], from the live charts (see charts.py),
+          never an aggregate over the play events; songs deleted since are left out
+        """
+        window, limit = self.chart_params(request)
+        if window is None:
+            return self.error_response('errors.song.charts.invalid_window', status.HTTP_400_BAD_REQUEST)
+        try:
+            rows = top('songs', window, limit + CHART_SLACK)
+            songs = self.cached_songs([pk for pk, _ in rows])
+            entries = [{"plays": plays, "song": songs[pk]} for pk, plays in rows if songs[pk] is not None]
+            return self.chart_response(window, {"songs": entries[:limit]})
+        except Exception as e:
+            return self.error_response('errors.song.charts.failed', status.HTTP_400_BAD_REQUEST, e)
+
+    @action(detail=False, methods=['get'], url_path='top-artists')
+    def top_artists(self, request):
+        """
+        - top artists endpoint: GET /songs/top-artists/?window=day|week|all&limit=25
+        - most played artists, [{"artist", "plays"}]
+        """
+        window, limit = self.chart_params(request)
+        if window is None:
+            return self.error_response('errors.song.charts.invalid_window', status.HTTP_400_BAD_REQUEST)
+        try:
+            rows = top('artists', window, limit)
+            return self.chart_response(window, {"artists": [{"artist": artist, "plays": plays} for artist, plays in rows]})
+        except Exception as e:
+            return self.error_response('errors.song.charts.failed', status.HTTP_400_BAD_REQUEST, e)
+
+    @action(detail=False, methods=['get'])
+    def listening(self, request):
+        """
+        - listening time endpoint: GET /songs/listening/?window=day|week|all
+        - seconds listened per genre and decade, e.g.
+          {"window": "week", "genre": {"Rock": 5400}, "decade": {"80s": 3600}, "seconds": 5400}
+        """
+        window, _ = self.chart_params(request)
+        if window is None:
+            return self.error_response('errors.song.charts.invalid_window', status.HTTP_400_BAD_REQUEST)
+        try:
+            return self.chart_response(window, listening_time(window))
+        except Exception as e:
+            return self.error_response('errors.song.charts.failed', status.HTTP_400_BAD_REQUEST, e)
+
+    @action(detail=False, methods=['get'], url_path='random')
+    def random_songs(self, request):
+        """
+        - random songs endpoint: GET /songs/random/?n=10
+        - up to RANDOM_MAX songs, every (filtered) song equally likely, never the same one twice
+        - honors the list filters, e.g. ?n=5&genre=Rock&decade=80s
+        - sampled by id-range probing (see shuffle.random_song_ids), never ORDER BY RANDOM()
+        """
+        try:
+            n = int(request.query_params.get('n', 10))
+        except ValueError:
+            n = 10
+        n = min(max(n, 1), RANDOM_MAX)
+
+        try:
+            ids = random_song_ids(self.filter_queryset(self.get_queryset()), n)
+            return Response({
+                "status": "success",
+                "code": status.HTTP_200_OK,
+                "data": self.songs_in_order(ids),
+                "timestamp": timezone.now().isoformat()
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return self.error_response('errors.song.random.failed', status.HTTP_400_BAD_REQUEST, e)
+
+    @action(detail=False, methods=['get'])
+    def shuffle(self, request):
+        """
+        - shuffle queue endpoint: GET /songs/shuffle/?seed=42&page_size=100
+        - the whole (filtered) library in a seeded, artist-spaced random order, a page at a time
+        - follow pagination.next to the end; without ?seed= a new seed is picked and
+          returned, and the links carry it
+        - the order is built once and cached in chunks, see shuffle.ShuffleQueue
+        """
+        seed = request.query_params.get('seed')
+        if seed is None:
+            seed = random.randrange(2 ** 31)
+        else:
+            try:
+                seed = int(seed)
+            except ValueError:
+                return self.error_response('errors.song.shuffle.invalid_seed', status.HTTP_400_BAD_REQUEST)
+
+        page_size = self.paginator.get_page_size(request)
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            # a bad cursor is a 404 like on every other paged endpoint, see cursors.py
+            generation, offset = decode_shuffle_cursor(cursor)
+        else:
+            generation, offset = get_list_generation(), 0
+
+        try:
+            queue = ShuffleQueue.for_request(
+                self.filter_queryset(self.get_queryset()), seed, request, self.filterset_class, generation,
+            )
+            total = queue.length()
+            ids = queue.page_ids(offset, min(page_size, total - offset)) if offset < total else []
+
+            end = offset + page_size
+            return Response({
+                "status": "success",
+                "code": status.HTTP_200_OK,
+                "data": self.songs_in_order(ids),
+                "pagination": {
+                    "next": shuffle_page_link(request, seed, generation, end) if end < total else None,
+                    "previous": (
+                        shuffle_page_link(request, seed, generation, max(offset - page_size, 0))
+                        if offset > 0 else None
+                    ),
+                    "page_size": page_size,
+                    "seed": seed,
+                    "total": total,
+                },
+                "timestamp": timezone.now().isoformat()
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            return self.error_response('errors.song.shuffle.failed', status.HTTP_400_BAD_REQUEST, e)
+
+    @action(detail=False, methods=['get'], url_path='cache-stats')
+    def cache_stats(self, request):
+        """
+        - cache stats endpoint: GET /songs/cache-stats/
+        - list and detail cache hits, misses, hit ratios, invalidations and current generation
+        - detail_local is the in-process tier of the worker that answered
+        """
+        return Response({
+            "status": "success",
+            "code": status.HTTP_200_OK,
+            "data": get_cache_stats(),
+            "timestamp": timezone.now().isoformat()
+        }, status=status.HTTP_200_OK)
+
+
+class SongCollectionViewSet(ErrorResponseMixin, viewsets.ModelViewSet):
+    """
+    - shared CRUD for named collections of songs (playlists, smart playlists), answering
+      in the same envelope as the song endpoints
+    - messages: prefix of the collection's message keys, e.g. 'errors.playlist'
+    """
+    messages = None
+    pagination_class = None
+    filter_backends = []
+
+    def get_permissions(self):
+        """
+        - in DEBUG mode, allow any access
+        - in production, require authentication to read and admin to change
+        """
+        if settings.DEBUG:
+            permission_classes = [AllowAny]
+        elif self.request.method in SAFE_METHODS:
+            permission_classes = [IsAuthenticated]
+        else:
+            permission_classes = [IsAdminUser]
+        return [permission() for permission in permission_classes]
+
+    def success_response(self, code, data=None, message_key=None, **extra):
+        """success envelope, e.g. success_response(201, data, 'errors.playlist.create.success')"""
+        response = {
+            "status": "success",
+            "code": code,
+        }
+        if message_key is not None:
+            response["message"] = get_message(message_key, **extra)
+        if data is not None:
+            response["data"] = data
+        response["timestamp"] = timezone.now().isoformat()
+        return Response(response, status=code)
+
+    def validation_error(self, serializer):
+        """first serializer error as the message, like the song endpoints"""
+        error_field = next(iter(serializer.errors.keys()))
+        return Response({
+            "status": "error",
+            "code": status.HTTP_400_BAD_REQUEST,
+            "message": serializer.errors[error_field][0],
+            "timestamp": timezone.now().isoformat()
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    def list(self, request, *args, **kwargs):
+        return self.success_response(status.HTTP_200_OK, self.get_serializer(self.get_queryset(), many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return self.success_response(status.HTTP_200_OK, self.get_serializer(self.get_object()).data)
+        except Http404:
+            return self.error_response(f'{self.messages}.not_found', status.HTTP_404_NOT_FOUND)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return self.validation_error(serializer)
+        try:
+            self.perform_create(serializer)
+        except Exception as e:
+            return self.error_response(f'{self.messages}.create.failed', status.HTTP_400_BAD_REQUEST, e)
+        return self.success_response(status.HTTP_201_CREATED, serializer.data, f'{self.messages}.create.success')
+
+    def update(self, request, *args, **kwargs):
+        try:
+            instance = self.get_object()
+        except Http404:
+            return self.error_response(f'{self.messages}.not_found', status.HTTP_404_NOT_FOUND)
+        serializer = self.get_serializer(instance, data=request.data, partial=True)
+        if not serializer.is_valid():
+            return self.validation_error(serializer)
+        try:
+            self.perform_update(serializer)
+        except Exception as e:
+            return self.error_response(f'{self.messages}.update.failed', status.HTTP_400_BAD_REQUEST, e)
+        return self.success_response(status.HTTP_200_OK, serializer.data, f'{self.messages}.update.success')
+
+    def destroy(self, request, *args, **kwargs):
+        deleted, _ = self.get_queryset().model.objects.filter(pk=kwargs.get('pk')).delete()
+        if not deleted:
+            return self.error_response(f'{self.messages}.not_found', status.HTTP_404_NOT_FOUND)
+        return self.success_response(status.HTTP_204_NO_CONTENT, message_key=f'{self.messages}.delete.success')
+
+    def get_page_size(self, request, default, maximum):
+        """?page_size= clamped to [1, maximum]"""
+        try:
+            return min(max(int(request.query_params.get('page_size', default)), 1), maximum)
+        except ValueError:
+            return default
+
+
+class PlaylistViewSet(SongCollectionViewSet):
+    """
+    - playlists and their ordered songs, built for playlists of 10k+ entries
+
+    apis:
+    - GET /playlists/ - list all playlists with their song counts
+    - POST /playlists/ - create a playlist
+    - GET /playlists/<id>/ - retrieve a playlist
+    - PATCH /playlists/<id>/ - rename / describe a playlist
+    - DELETE /playlists/<id>/ - delete a playlist and its entries
+    - GET /playlists/<id>/entries/ - the songs in order, in keyset pages (?page_size=, ?cursor=)
+    - POST /playlists/<id>/entries/ - add songs, at the end or after/before an entry
+    - PATCH /playlists/<id>/entries/<entry_id>/ - move an entry after/before another one
+    - DELETE /playlists/<id>/entries/<entry_id>/ - remove an entry
+
+    ordering:
+    - entries carry sparse ranks, inserting or moving writes only that entry
+      (see playlists.py)
+    """
+    queryset = Playlist.objects.annotate(song_count=Count('entries')).order_by('-created_at', '-id')
+    serializer_class = PlaylistSerializer
+    messages = 'errors.playlist'
+
+    def anchors(self, request):
+        """(after, before) entry ids from the request body, ValueError if malformed"""
+        after, before = request.data.get('after'), request.data.get('before')
+        if after is not None and before is not None:
+            raise ValueError('after and before')
+        return (
+            int(after) if after is not None else None,
+            int(before) if before is not None else None,
+        )
+
+    @action(detail=True, methods=['get', 'post'])
+    def entries(self, request, pk=None):
+        """
+        - GET /playlists/<id>/entries/?page_size=100&cursor=<token>: entries in order, each
+          {"id", "rank", "added_at", "song"}; one joined query per page, keyset on rank
+        - POST /playlists/<id>/entries/ {"songs": [3, 1, 2], "after": <entry id>}: add songs in
+          that order, after or before ("before") an entry, or at the end; one bulk insert
+        """
+        if not Playlist.objects.filter(pk=pk).exists():
+            return self.error_response('errors.playlist.not_found', status.HTTP_404_NOT_FOUND)
+        if request.method == 'POST':
+            return self.add_entries(request, pk)
+
+        page_size = self.get_page_size(request, PLAYLIST_PAGE_SIZE, PLAYLIST_MAX_PAGE_SIZE)
+        cursor = request.query_params.get('cursor')
+        after_rank = decode_after_cursor(cursor) if cursor else None
+
+        # one extra row says whether there is a next page, without counting
+        rows = entry_rows(pk, after_rank, page_size + 1, request)
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        return Response({
+            "status": "success",
+            "code": status.HTTP_200_OK,
+            "data": rows,
+            "pagination": {
+                "next": after_page_link(request, rows[-1]['rank']) if has_next else None,
+                "page_size": page_size,
+            },
+            "timestamp": timezone.now().isoformat()
+        }, status=status.HTTP_200_OK)
+
+    def add_entries(self, request, pk):
+        song_ids = request.data.get('songs') if isinstance(request.data, dict) else None
+        if (not isinstance(song_ids, list) or not song_ids
+                or not all(isinstance(song_id, int) and not isinstance(song_id, bool) for song_id in song_ids)):
+            return self.error_response('errors.playlist.entries.invalid_songs', status.HTTP_400_BAD_REQUEST)
+        if len(song_ids) > APPEND_MAX_SONGS:
+            return self.error_response('errors.playlist.entries.too_many', status.HTTP_400_BAD_REQUEST,
+                                       limit=APPEND_MAX_SONGS)
+        try:
+            after, before = self.anchors(request)
+        except (TypeError, ValueError):
+            return self.error_response('errors.playlist.entries.invalid_anchor', status.HTTP_400_BAD_REQUEST)
+
+        # one query checks every song exists
+        existing = set(Song.objects.filter(pk__in=set(song_ids)).values_list('pk', flat=True))
+        missing = sorted(set(song_ids) - existing)
+        if missing:
+            return self.error_response('errors.playlist.entries.songs_not_found', status.HTTP_400_BAD_REQUEST,
+                                       ids=', '.join(map(str, missing)))
+
+        try:
+            entries = add_songs(pk, song_ids, after=after, before=before)
+        except PlaylistEntry.DoesNotExist:
+            return self.error_response('errors.playlist.entries.invalid_anchor', status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return self.error_response('errors.playlist.entries.failed', status.HTTP_400_BAD_REQUEST, e)
+
+        return self.success_response(
+            status.HTTP_201_CREATED,
+            [{"id": entry.pk, "rank": entry.rank, "song": entry.song_id} for entry in entries],
+            'errors.playlist.entries.added', count=len(entries),
+        )
+
+    @action(detail=True, methods=['patch', 'delete'], url_path=r'entries/(?P<entry_id>\d+)')
+    def entry(self, request, pk=None, entry_id=None):
+        """
+        - PATCH /playlists/<id>/entries/<entry_id>/ {"after": <entry id>} or {"before": <entry id>}
+          (neither: to the end): move one entry, a single-row update
+        - DELETE /playlists/<id>/entries/<entry_id>/: remove one entry
+        """
+        if request.method == 'DELETE':
+            deleted, _ = PlaylistEntry.objects.filter(playlist_id=pk, pk=entry_id).delete()
+            if not deleted:
+                return self.error_response('errors.playlist.entries.not_found', status.HTTP_404_NOT_FOUND)
+            return self.success_response(status.HTTP_204_NO_CONTENT, message_key='errors.playlist.entries.removed')
+
+        try:
+            after, before = self.anchors(request)
+        except (TypeError, ValueError):
+            return self.error_response('errors.playlist.entries.invalid_anchor', status.HTTP_400_BAD_REQUEST)
+        if not PlaylistEntry.objects.filter(playlist_id=pk, pk=entry_id).exists():
+            return self.error_response('errors.playlist.entries.not_found', status.HTTP_404_NOT_FOUND)
+
+        try:
+            entry = move_entry(pk, int(entry_id), after=after, before=before)
+        except PlaylistEntry.DoesNotExist:
+            return self.error_response('errors.playlist.entries.invalid_anchor', status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return self.error_response('errors.playlist.entries.failed', status.HTTP_400_BAD_REQUEST, e)
+
+        return self.success_response(
+            status.HTTP_200_OK, {"id": entry.pk, "rank": entry.rank, "song": entry.song_id},
+            'errors.playlist.entries.moved',
+        )
+
+
+class SmartPlaylistViewSet(SongCollectionViewSet):
+    """
+    - smart playlists: saved song filters with materialized membership
+
+    apis:
+    - GET /smart-playlists/ - list all smart playlists with their song counts
+    - POST /smart-playlists/ - create one, e.g. {"name": "80s Rock", "filters": {"decade": "80s", "genre": "Rock"}}
+    - GET /smart-playlists/<id>/ - retrieve a smart playlist
+    - PATCH /smart-playlists/<id>/ - rename it or change its filters
+    - DELETE /smart-playlists/<id>/ - delete it
+    - GET /smart-playlists/<id>/songs/ - its songs, newest first, in keyset pages
+
+    filters:
+    - any list endpoint filter (SongFilter), e.g. {"duration_max": 180} for songs under 3 minutes
+    - membership is computed when the filters are saved and then kept up to date by every
+      song write (see smart_playlists.py), reading never runs the filter
+    """
+    queryset = SmartPlaylist.objects.annotate(song_count=Count('members')).order_by('-created_at', '-id')
+    serializer_class = SmartPlaylistSerializer
+    messages = 'errors.smart_playlist'
+
+    def perform_create(self, serializer):
+        serializer.save()
+        serializer.instance.song_count = materialize(serializer.instance)
+
+    def perform_update(self, serializer):
+        serializer.save()
+        if 'filters' in serializer.validated_data:
+            serializer.instance.song_count = materialize(serializer.instance)
+
+    @action(detail=True, methods=['get'])
+    def songs(self, request, pk=None):
+        """
+        - GET /smart-playlists/<id>/songs/?page_size=100&cursor=<token>
+        - one joined query per page over the (smart_playlist, song) index, keyset on song id
+        """
+        if not SmartPlaylist.objects.filter(pk=pk).exists():
+            return self.error_response('errors.smart_playlist.not_found', status.HTTP_404_NOT_FOUND)
+        page_size = self.get_page_size(request, SMART_PLAYLIST_PAGE_SIZE, SMART_PLAYLIST_MAX_PAGE_SIZE)
+        cursor = request.query_params.get('cursor')
+        before_song = decode_after_cursor(cursor) if cursor else None
+
+        rows = member_rows(pk, before_song, page_size + 1, request)
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        return Response({
+            "status": "success",
+            "code": status.HTTP_200_OK,
+            "data": rows,
+            "pagination": {
+                "next": after_page_link(request, rows[-1]['id']) if has_next else None,
+                "page_size": page_size,
+            },
+            "timestamp": timezone.now().isoformat()
+        }, status=status.HTTP_200_OK)
+
+
+class PlayEventViewSet(ErrorResponseMixin, viewsets.ViewSet):
+    """
+    - play events from the iPod UI
+
+    apis:
+    - POST /plays/ - record one play event, or {"events": [...]} for up to PLAY_BATCH_MAX
+
+    write-behind:
+    - events are buffered in redis and written in batches by `manage.py flush_play_events`
+      (see plays.py); a 202 means buffered, not yet in the database
+    """
+
+    def get_permissions(self):
+        """
+        - in DEBUG mode, allow any access
+        - in production, require authentication
+        """
+        if settings.DEBUG:
+            return [AllowAny()]
+        return [IsAuthenticated()]
+
+    def create(self, request):
+        """
+        - play event endpoint: POST /plays/
+        - an event is {"song": <id>, "seconds_played": 180, "played_at": <iso datetime>,
+          "event_id": <uuid>}, played_at and event_id optional; resending an event_id is a no-op
+        - 202 once buffered, 503 with Retry-After while the buffer is full
+        """
+        data = request.data
+        rows = data.get('events') if isinstance(data, dict) and 'events' in data else [data]
+        if not isinstance(rows, list) or not rows:
+            return self.error_response('errors.play.invalid_payload', status.HTTP_400_BAD_REQUEST)
+        if len(rows) > PLAY_BATCH_MAX:
+            return self.error_response('errors.play.too_many', status.HTTP_400_BAD_REQUEST, limit=PLAY_BATCH_MAX)
+
+        user_id = request.user.pk if request.user.is_authenticated else None
+        events = []
+        for index, row in enumerate(rows):
+            try:
+                events.append(parse_event(row, user_id))
+            except ValueError as e:
+                return self.error_response('errors.play.invalid', status.HTTP_400_BAD_REQUEST, field=str(e), index=index)
+
+        try:
+            accepted = enqueue(events)
+        except BufferFull:
+            response = self.error_response('errors.play.buffer_full', status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = '5'
+            return response
+        except Exception as e:
+            return self.error_response('errors.play.failed', status.HTTP_400_BAD_REQUEST, e)
+
+        return Response({
+            "status": "success",
+            "code": status.HTTP_202_ACCEPTED,
+            "message": get_message('errors.play.accepted', count=accepted),
+            "data": {"event_ids": [str(event['event_id']) for event in events]},
+            "timestamp": timezone.now().isoformat()
+        }, status=status.HTTP_202_ACCEPTED)